@@ -1,12 +1,17 @@
-from .task_manager import create_research_plan
-from .information_retrieval import retrieve_information
-from .analysis import analyse_information
-from .report_generator import generate_report
+from .task_manager import create_research_plan, create_research_plan_async
+from .information_retrieval import retrieve_information, retrieve_information_async
+from .analysis import analyse_information, analyse_information_async
+from .report_generator import generate_report, generate_report_async, generate_report_stream
 
 # Make sure these are available at the package level
 __all__ = [
     'create_research_plan',
     'retrieve_information',
     'analyse_information',
-    'generate_report'
+    'generate_report',
+    'create_research_plan_async',
+    'retrieve_information_async',
+    'analyse_information_async',
+    'generate_report_async',
+    'generate_report_stream'
 ]
\ No newline at end of file
@@ -1,37 +1,36 @@
 import json
 import os
 import re
-from config import get_model, TEMPERATURE
+from config import TEMPERATURE
 from utils.prompt_templates import ANALYSIS_SYSTEM_PROMPT
-from utils.caching import generate_cache_key, get_cached_response, cache_response
-from utils.client_manager import get_client
+from utils.completions import get_completion_content, get_completion_content_async
+from utils.tracing import traced
 
-def analyse_information(subtask, information):
+def build_analysis_messages(subtask, information):
     """
-    Analyse information collected for a research subtask.
+    Build the messages used to analyse the information collected for a subtask.
     
     Args:
         subtask (dict): A subtask from the research plan.
         information (dict): Information retrieved for the subtask.
-        
+    
     Returns:
-        dict: Analysis of the information.
+        list: The messages list.
     """
-    try:
-        # Format the information for the prompt 
-        formatted_information = []
-        for source in information.get("sources", [])[:3]:  # Limit to top 3 sources (for now)
-            formatted_information.append(
-                f"Source: {source.get('title', 'Unknown')}\n"
-                f"URL: {source.get('url', 'Unknown')}\n"
-                f"Key Information: " + "; ".join(source.get("key_information", []))
-            )
-        
-        # Join the formatted information
-        information_text = "\n\n".join(formatted_information)
-        
-        # Streamlined prompt with few findings for faster processing and testing (for now)
-        human_prompt = f"""Analyse this information for the research subtask:
+    # Format the information for the prompt 
+    formatted_information = []
+    for source in information.get("sources", [])[:3]:  # Limit to top 3 sources (for now)
+        formatted_information.append(
+            f"Source: {source.get('title', 'Unknown')}\n"
+            f"URL: {source.get('url', 'Unknown')}\n"
+            f"Key Information: " + "; ".join(source.get("key_information", []))
+        )
+    
+    # Join the formatted information
+    information_text = "\n\n".join(formatted_information)
+    
+    # Streamlined prompt with few findings for faster processing and testing (for now)
+    human_prompt = f"""Analyse this information for the research subtask:
 
             Subtask: {subtask["description"]}
 
@@ -39,74 +38,124 @@ def analyse_information(subtask, information):
             {information_text}
 
             Focus on 3-5 key findings and a brief summary."""
+    
+    return [
+        {"role": "system", "content": ANALYSIS_SYSTEM_PROMPT},
+        {"role": "user", "content": human_prompt}
+    ]
+
+@traced("parse")
+def parse_analysis(content, subtask):
+    """
+    Parse the model's response into an analysis.
+    
+    Args:
+        content (str): The model's response content.
+        subtask (dict): A subtask from the research plan.
+    
+    Returns:
+        dict: Analysis of the information.
+    """
+    # Parse the JSON response
+    try:
+        analysis = json.loads(content)
+        return analysis
+    except json.JSONDecodeError:
+        # If parsing fails, try to extract JSON from the text
+        json_match = re.search(r'({[\s\S]*})', content)
+        if json_match:
+            try:
+                analysis = json.loads(json_match.group(1))
+                return analysis
+            except:
+                pass
         
-        # Get the client from client manager
-        client = get_client()
-        
-        # Generate cache key
-        messages = [
-            {"role": "system", "content": ANALYSIS_SYSTEM_PROMPT},
-            {"role": "user", "content": human_prompt}
-        ]
-        cache_key = generate_cache_key(get_model(), messages, TEMPERATURE)
-        
-        # Check cache first
-        cached_response = get_cached_response(cache_key)
-        if cached_response:
-            print(f"Using cached analysis for subtask: {subtask['id']}")
-            content = cached_response.choices[0].message.content
-        else:
-            # Call the API
-            response = client.chat.create(
-                model=get_model(),
-                messages=messages,
-                temperature=TEMPERATURE
-            )
-            
-            # Cache the response
-            cache_response(cache_key, response)
-            
-            # Extract the content
-            content = response.choices[0].message.content
-        
-        # Parse the JSON response
-        try:
-            analysis = json.loads(content)
-            return analysis
-        except json.JSONDecodeError:
-            # If parsing fails, try to extract JSON from the text
-            json_match = re.search(r'({[\s\S]*})', content)
-            if json_match:
-                try:
-                    analysis = json.loads(json_match.group(1))
-                    return analysis
-                except:
-                    pass
-            
-            # Fallback to a manually constructed analysis - simple for speed
-            return {
-                "subtask_id": subtask["id"],
-                "analysis": {
-                    "key_findings": [
-                        "Information was successfully collected on this topic",
-                        "Multiple sources provided relevant insights"
-                    ],
-                    "patterns_identified": [],
-                    "contradictions": [],
-                    "knowledge_gaps": [],
-                    "summary": f"The collected information provides useful insights into {subtask['description']}."
-                }
-            }
-    except Exception as e:
-        print(f"Error in analyse_information: {e}")
-        # Return a simple analysis on error
+        # Fallback to a manually constructed analysis - simple for speed
         return {
             "subtask_id": subtask["id"],
             "analysis": {
-                "key_findings": ["Limited information processing"],
+                "key_findings": [
+                    "Information was successfully collected on this topic",
+                    "Multiple sources provided relevant insights"
+                ],
                 "patterns_identified": [],
                 "contradictions": [],
                 "knowledge_gaps": [],
-                "summary": f"Basic insights on {subtask['description']}."
+                "summary": f"The collected information provides useful insights into {subtask['description']}."
             }
-        }
\ No newline at end of file
+        }
+
+def fallback_analysis(subtask):
+    """
+    Build a simple analysis to return when the analysis fails.
+    
+    Args:
+        subtask (dict): A subtask from the research plan.
+    
+    Returns:
+        dict: A minimal analysis of the subtask.
+    """
+    return {
+        "subtask_id": subtask["id"],
+        "analysis": {
+            "key_findings": ["Limited information processing"],
+            "patterns_identified": [],
+            "contradictions": [],
+            "knowledge_gaps": [],
+            "summary": f"Basic insights on {subtask['description']}."
+        }
+    }
+
+@traced("agent")
+def analyse_information(subtask, information):
+    """
+    Analyse information collected for a research subtask.
+    
+    Args:
+        subtask (dict): A subtask from the research plan.
+        information (dict): Information retrieved for the subtask.
+        
+    Returns:
+        dict: Analysis of the information.
+    """
+    try:
+        # Call the model (or use the cached response)
+        content = get_completion_content(
+            build_analysis_messages(subtask, information),
+            TEMPERATURE,
+            cache_message=f"Using cached analysis for subtask: {subtask['id']}",
+            stage="analysis"
+        )
+        
+        return parse_analysis(content, subtask)
+    except Exception as e:
+        print(f"Error in analyse_information: {e}")
+        # Return a simple analysis on error
+        return fallback_analysis(subtask)
+
+@traced("agent")
+async def analyse_information_async(subtask, information, client):
+    """
+    Async version of analyse_information.
+    
+    Args:
+        subtask (dict): A subtask from the research plan.
+        information (dict): Information retrieved for the subtask.
+        client (AsyncAIClient): The async client to call the model with.
+    
+    Returns:
+        dict: Analysis of the information.
+    """
+    try:
+        content = await get_completion_content_async(
+            client,
+            build_analysis_messages(subtask, information),
+            TEMPERATURE,
+            cache_message=f"Using cached analysis for subtask: {subtask['id']}",
+            stage="analysis"
+        )
+        
+        return parse_analysis(content, subtask)
+    except Exception as e:
+        print(f"Error in analyse_information_async: {e}")
+        return fallback_analysis(subtask)
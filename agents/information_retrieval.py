@@ -1,139 +1,212 @@
+import asyncio
 import json
 import os
 import re
-import concurrent.futures
-from config import get_model, TEMPERATURE
+from config import TEMPERATURE
 from utils.prompt_templates import INFORMATION_RETRIEVAL_SYSTEM_PROMPT, INFORMATION_RETRIEVAL_HUMAN_PROMPT
-from utils.web_search import search_and_process
-from utils.caching import generate_cache_key, get_cached_response, cache_response
-from utils.client_manager import get_client
+from utils.web_search import search_and_process, search_and_process_async
+from utils.completions import get_completion_content, get_completion_content_async
+from utils.cancellation import RunCancelled
+from utils.tracing import traced
+from utils.worker_pool import worker_pool
 
-def retrieve_information(subtask):
+def deduplicate_results(all_search_results):
+    """
+    Remove duplicate search results based on URL.
+    
+    Args:
+        all_search_results (list): Search results from every query of a subtask.
+    
+    Returns:
+        dict: The unique results keyed by URL, in the order they were found.
+    """
+    unique_results = {}
+    for result in all_search_results:
+        if result["url"] not in unique_results:
+            unique_results[result["url"]] = result
+    return unique_results
+
+def build_retrieval_messages(subtask, unique_results):
+    """
+    Build the messages used to extract information from a subtask's search results.
+    
+    Args:
+        subtask (dict): A subtask from the research plan.
+        unique_results (dict): The unique search results keyed by URL.
+    
+    Returns:
+        list: The messages list.
+    """
+    # Format search results for the prompt - limit content length for speed
+    formatted_results = []
+    for url, result in unique_results.items():
+        # Trim content to speed up processing - PLAY AROUND WITH THIS FIGURE TO SEE EFFECT ON RESULTS
+        content = result['content']
+        if len(content) > 1000:  # Limit to ~1000 chars for faster processing
+            content = content[:1000] + "..."
+        
+        formatted_results.append(
+            f"Source: {result['title']}\n"
+            f"URL: {result['url']}\n"
+            f"Content: {content}\n\n"
+        )
+    
+    # Join the formatted results - limit to top results if many were found
+    if len(formatted_results) > 5:
+        formatted_results = formatted_results[:5]  # Limit to top 5 results (for now)
+    search_results_text = "\n".join(formatted_results)
+    
+    # Format the prompt
+    prompt = INFORMATION_RETRIEVAL_HUMAN_PROMPT.format(
+        subtask_description=subtask["description"],
+        search_results=search_results_text
+    )
+    
+    return [
+        {"role": "system", "content": INFORMATION_RETRIEVAL_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+
+@traced("parse")
+def parse_information(content, subtask, unique_results):
+    """
+    Parse the model's response into the information collected for a subtask.
+    
+    Args:
+        content (str): The model's response content.
+        subtask (dict): A subtask from the research plan.
+        unique_results (dict): The unique search results keyed by URL.
+    
+    Returns:
+        dict: Processed information from various sources.
+    """
+    # Parse the JSON response
+    try:
+        information = json.loads(content)
+        return information
+    except json.JSONDecodeError:
+        # If parsing fails, try to extract JSON from the text
+        json_match = re.search(r'({[\s\S]*})', content)
+        if json_match:
+            try:
+                information = json.loads(json_match.group(1))
+                return information
+            except:
+                pass
+        
+        # Fallback to a manually constructed result
+        return {
+            "subtask_id": subtask["id"],
+            "sources": [
+                {
+                    "title": result["title"],
+                    "url": result["url"],
+                    "credibility_score": 0.7,
+                    "relevance_score": 0.8,
+                    "key_information": [result["snippet"]],
+                    "summary": result["snippet"]
+                } for url, result in list(unique_results.items())[:3]  # Limit to 3 sources
+            ]
+        }
+
+@traced("agent")
+def retrieve_information(subtask, search_results=None):
     """
     Retrieve and process information for a research subtask.
     
     Args:
         subtask (dict): A subtask from the research plan.
+        search_results (dict, optional): Results already found for some of the subtask's
+            queries (e.g. by a batched search of the whole plan), keyed by query.
         
     Returns:
         dict: Processed information from various sources.
     """
     try:
-        # Get search results for each query in parallel
+        # Start from the results found for the plan, and search for the rest in parallel
+        search_results = search_results or {}
         all_search_results = []
+        for query in subtask["search_queries"]:
+            all_search_results.extend(search_results.get(query, []))
+        queries = [query for query in subtask["search_queries"] if query not in search_results]
         
-        # Define the function to process a single query
-        def process_single_query(query):
-            return search_and_process(query)
-        
-        # Use ThreadPoolExecutor to run queries in parallel
-        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
-            # Submit all queries to the executor
-            future_to_query = {
-                executor.submit(process_single_query, query): query 
-                for query in subtask["search_queries"]
-            }
-            
-            # Collect results as they complete
-            for future in concurrent.futures.as_completed(future_to_query):
-                try:
-                    search_results = future.result()
-                    all_search_results.extend(search_results)
-                except Exception as e:
-                    print(f"Error processing query: {e}")
+        # Search every query on the shared worker pool, keeping the results in query order
+        futures = [worker_pool.submit("search", search_and_process, query) for query in queries]
+        worker_pool.wait(futures)
+        for future in futures:
+            try:
+                all_search_results.extend(future.result())
+            except Exception as e:
+                print(f"Error processing query: {e}")
         
         # Remove duplicate results based on URL
-        unique_results = {}
-        for result in all_search_results:
-            if result["url"] not in unique_results:
-                unique_results[result["url"]] = result
+        unique_results = deduplicate_results(all_search_results)
         
-        # Format search results for the prompt - limit content length for speed
-        formatted_results = []
-        for url, result in unique_results.items():
-            # Trim content to speed up processing - PLAY AROUND WITH THIS FIGURE TO SEE EFFECT ON RESULTS
-            content = result['content']
-            if len(content) > 1000:  # Limit to ~1000 chars for faster processing
-                content = content[:1000] + "..."
-                
-            formatted_results.append(
-                f"Source: {result['title']}\n"
-                f"URL: {result['url']}\n"
-                f"Content: {content}\n\n"
-            )
+        # Call the model (or use the cached response)
+        content = get_completion_content(
+            build_retrieval_messages(subtask, unique_results),
+            TEMPERATURE,
+            cache_message=f"Using cached response for subtask: {subtask['id']}",
+            stage="retrieval"
+        )
         
-        # Join the formatted results - limit to top results if many were found
-        if len(formatted_results) > 5:
-            formatted_results = formatted_results[:5]  # Limit to top 5 results (for now)
-        search_results_text = "\n".join(formatted_results)
+        return parse_information(content, subtask, unique_results)
+    except Exception as e:
+        print(f"Error in retrieve_information: {e}")
+        # Return a simple result on error
+        return {
+            "subtask_id": subtask["id"],
+            "sources": []
+        }
+
+@traced("agent")
+async def retrieve_information_async(subtask, client, search_results=None):
+    """
+    Async version of retrieve_information. All search queries run concurrently on the event loop.
+    
+    Args:
+        subtask (dict): A subtask from the research plan.
+        client (AsyncAIClient): The async client to call the model with.
+        search_results (dict, optional): Results already found for some of the subtask's queries.
+    
+    Returns:
+        dict: Processed information from various sources.
+    """
+    try:
+        search_results = search_results or {}
+        all_search_results = []
+        for query in subtask["search_queries"]:
+            all_search_results.extend(search_results.get(query, []))
         
-        # Format the prompt
-        prompt = INFORMATION_RETRIEVAL_HUMAN_PROMPT.format(
-            subtask_description=subtask["description"],
-            search_results=search_results_text
+        # Run every other query concurrently, keeping failures from cancelling the others
+        query_results = await asyncio.gather(
+            *(search_and_process_async(query, client) for query in subtask["search_queries"] if query not in search_results),
+            return_exceptions=True
         )
         
-        # Get the client from client manager
-        client = get_client()
+        for results in query_results:
+            # A cancelled run stops here, rather than carrying on without the results
+            if isinstance(results, RunCancelled):
+                raise results
+            if isinstance(results, Exception):
+                print(f"Error processing query: {results}")
+                continue
+            all_search_results.extend(results)
         
-        # Generate cache key
-        messages = [
-            {"role": "system", "content": INFORMATION_RETRIEVAL_SYSTEM_PROMPT},
-            {"role": "user", "content": prompt}
-        ]
-        cache_key = generate_cache_key(get_model(), messages, TEMPERATURE)
+        unique_results = deduplicate_results(all_search_results)
         
-        # Check cache first
-        cached_response = get_cached_response(cache_key)
-        if cached_response:
-            print(f"Using cached response for subtask: {subtask['id']}")
-            content = cached_response.choices[0].message.content
-        else:
-            # Call the API
-            response = client.chat.create(
-                model=get_model(),
-                messages=messages,
-                temperature=TEMPERATURE
-            )
-            
-            # Cache the response
-            cache_response(cache_key, response)
-            
-            # Extract the content
-            content = response.choices[0].message.content
+        content = await get_completion_content_async(
+            client,
+            build_retrieval_messages(subtask, unique_results),
+            TEMPERATURE,
+            cache_message=f"Using cached response for subtask: {subtask['id']}",
+            stage="retrieval"
+        )
         
-        # Parse the JSON response
-        try:
-            information = json.loads(content)
-            return information
-        except json.JSONDecodeError:
-            # If parsing fails, try to extract JSON from the text
-            json_match = re.search(r'({[\s\S]*})', content)
-            if json_match:
-                try:
-                    information = json.loads(json_match.group(1))
-                    return information
-                except:
-                    pass
-            
-            # Fallback to a manually constructed result
-            return {
-                "subtask_id": subtask["id"],
-                "sources": [
-                    {
-                        "title": result["title"],
-                        "url": result["url"],
-                        "credibility_score": 0.7,
-                        "relevance_score": 0.8,
-                        "key_information": [result["snippet"]],
-                        "summary": result["snippet"]
-                    } for url, result in list(unique_results.items())[:3]  # Limit to 3 sources
-                ]
-            }
+        return parse_information(content, subtask, unique_results)
     except Exception as e:
-        print(f"Error in retrieve_information: {e}")
-        # Return a simple result on error
+        print(f"Error in retrieve_information_async: {e}")
         return {
             "subtask_id": subtask["id"],
             "sources": []
-        }
\ No newline at end of file
+        }
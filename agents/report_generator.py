@@ -1,51 +1,50 @@
 import os
-from config import get_model, TEMPERATURE, MAX_TOKENS
+from config import TEMPERATURE, MAX_TOKENS
 from utils.prompt_templates import REPORT_GENERATOR_SYSTEM_PROMPT
-from utils.caching import generate_cache_key, get_cached_response, cache_response
 from utils.language_detection import format_instructions_for_language
-from utils.client_manager import get_client
+from utils.completions import get_completion_content, get_completion_content_async, stream_completion_content
+from utils.tracing import traced
 
-def generate_report(research_question, analyses, subtasks, language_code='en'):
+def build_report_messages(research_question, analyses, subtasks, language_code='en'):
     """
-    Generate a comprehensive research report based on analysed information.
+    Build the messages used to generate the research report.
     
     Args:
         research_question (str): The main research question.
         analyses (list): A list of analyses for each subtask.
         subtasks (list): A list of subtasks from the research plan.
         language_code (str): The language to use for the report
-        
+    
     Returns:
-        str: A formatted research report.
+        list: The messages list.
     """
-    try:
-        # Create a mapping of subtask IDs to descriptions
-        subtask_map = {subtask["id"]: subtask["description"] for subtask in subtasks}
-        
-        # Format the analyses for the prompt - more concise for speed
-        formatted_analyses = []
-        for analysis in analyses:
-            subtask_id = analysis.get("subtask_id")
-            subtask_description = subtask_map.get(subtask_id, "Unknown subtask")
-            
-            analysis_data = analysis.get("analysis", {})
-            key_findings = analysis_data.get("key_findings", [])[:3]  # Limit to top 3 findings
-            summary = analysis_data.get("summary", "No summary available.")
-            
-            formatted_analyses.append(
-                f"Subtask: {subtask_description}\n"
-                f"Key Findings: " + "; ".join([f"{finding}" for finding in key_findings]) + "\n"
-                f"Summary: {summary}"
-            )
-        
-        # Join the formatted analyses
-        analyses_text = "\n\n".join(formatted_analyses)
+    # Create a mapping of subtask IDs to descriptions
+    subtask_map = {subtask["id"]: subtask["description"] for subtask in subtasks}
+    
+    # Format the analyses for the prompt - more concise for speed
+    formatted_analyses = []
+    for analysis in analyses:
+        subtask_id = analysis.get("subtask_id")
+        subtask_description = subtask_map.get(subtask_id, "Unknown subtask")
         
-        # Get language-specific instructions
-        language_instruction = format_instructions_for_language(language_code)
+        analysis_data = analysis.get("analysis", {})
+        key_findings = analysis_data.get("key_findings", [])[:3]  # Limit to top 3 findings
+        summary = analysis_data.get("summary", "No summary available.")
         
-        # Streamlined prompt for faster processing, with language instruction
-        human_prompt = f"""Generate a concise research report for:
+        formatted_analyses.append(
+            f"Subtask: {subtask_description}\n"
+            f"Key Findings: " + "; ".join([f"{finding}" for finding in key_findings]) + "\n"
+            f"Summary: {summary}"
+        )
+    
+    # Join the formatted analyses
+    analyses_text = "\n\n".join(formatted_analyses)
+    
+    # Get language-specific instructions
+    language_instruction = format_instructions_for_language(language_code)
+    
+    # Streamlined prompt for faster processing, with language instruction
+    human_prompt = f"""Generate a concise research report for:
             Research Question: {research_question}
 
             Analyses:
@@ -54,41 +53,114 @@ def generate_report(research_question, analyses, subtasks, language_code='en'):
             Keep the report focused and under 2000 words.
 
             {language_instruction}"""
+    
+    return [
+        {"role": "system", "content": REPORT_GENERATOR_SYSTEM_PROMPT},
+        {"role": "user", "content": human_prompt}
+    ]
+
+@traced("agent")
+def generate_report(research_question, analyses, subtasks, language_code='en'):
+    """
+    Generate a comprehensive research report based on analysed information.
+    
+    Args:
+        research_question (str): The main research question.
+        analyses (list): A list of analyses for each subtask.
+        subtasks (list): A list of subtasks from the research plan.
+        language_code (str): The language to use for the report
         
-        # Get the client from client manager
-        client = get_client()
-        
-        # Generate cache key
-        messages = [
-            {"role": "system", "content": REPORT_GENERATOR_SYSTEM_PROMPT},
-            {"role": "user", "content": human_prompt}
-        ]
-        cache_key = generate_cache_key(get_model(), messages, TEMPERATURE, MAX_TOKENS)
-        
-        # Check cache first
-        cached_response = get_cached_response(cache_key)
-        if cached_response:
-            print(f"Using cached report for: {research_question}")
-            report = cached_response.choices[0].message.content
-        else:
-            # Call the API
-            response = client.chat.create(
-                model=get_model(),
-                messages=messages,
-                temperature=TEMPERATURE,
-                max_tokens=MAX_TOKENS
-            )
-            
-            # Cache the response
-            cache_response(cache_key, response)
-            
-            # Extract the content
-            report = response.choices[0].message.content
+    Returns:
+        str: A formatted research report.
+    """
+    try:
+        # Call the model (or use the cached response)
+        report = get_completion_content(
+            build_report_messages(research_question, analyses, subtasks, language_code),
+            TEMPERATURE,
+            MAX_TOKENS,
+            cache_message=f"Using cached report for: {research_question}",
+            stage="report"
+        )
         
         return report
     except Exception as e:
         print(f"Error in generate_report: {e}")
+    
+    return fallback_report(research_question, language_code)
+
+@traced("agent")
+async def generate_report_async(research_question, analyses, subtasks, client, language_code='en'):
+    """
+    Async version of generate_report.
+    
+    Args:
+        research_question (str): The main research question.
+        analyses (list): A list of analyses for each subtask.
+        subtasks (list): A list of subtasks from the research plan.
+        client (AsyncAIClient): The async client to call the model with.
+        language_code (str): The language to use for the report
         
+    Returns:
+        str: A formatted research report.
+    """
+    try:
+        return await get_completion_content_async(
+            client,
+            build_report_messages(research_question, analyses, subtasks, language_code),
+            TEMPERATURE,
+            MAX_TOKENS,
+            cache_message=f"Using cached report for: {research_question}",
+            stage="report"
+        )
+    except Exception as e:
+        print(f"Error in generate_report_async: {e}")
+    
+    return fallback_report(research_question, language_code)
+
+def generate_report_stream(research_question, analyses, subtasks, language_code='en'):
+    """
+    Generator version of generate_report, which yields the report as it is written.
+    
+    Args:
+        research_question (str): The main research question.
+        analyses (list): A list of analyses for each subtask.
+        subtasks (list): A list of subtasks from the research plan.
+        language_code (str): The language to use for the report
+    
+    Yields:
+        str: Consecutive pieces of the formatted research report.
+    """
+    streamed = False
+    try:
+        for chunk in stream_completion_content(
+            build_report_messages(research_question, analyses, subtasks, language_code),
+            TEMPERATURE,
+            MAX_TOKENS,
+            cache_message=f"Using cached report for: {research_question}",
+            stage="report"
+        ):
+            streamed = True
+            yield chunk
+        return
+    except Exception as e:
+        print(f"Error in generate_report_stream: {e}")
+    
+    # Part of a report cannot be taken back, so only fall back if nothing was yielded
+    if not streamed:
+        yield fallback_report(research_question, language_code)
+
+def fallback_report(research_question, language_code='en'):
+    """
+    Build a simple report to return when report generation fails.
+    
+    Args:
+        research_question (str): The main research question.
+        language_code (str): The language to use for the report
+    
+    Returns:
+        str: A minimal research report.
+    """
     # Verify language code is supported, default to English if not
     # system is currently limited to the languages I speak
     if language_code not in ['en', 'es', 'fr']:
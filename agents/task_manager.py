@@ -1,114 +1,125 @@
 import json
 import os
 import re
-from config import get_model, TEMPERATURE
+from config import TEMPERATURE
 from utils.prompt_templates import TASK_MANAGER_SYSTEM_PROMPT
-from utils.caching import generate_cache_key, get_cached_response, cache_response
 from utils.language_detection import detect_language, format_instructions_for_language
-from utils.client_manager import get_client
+from utils.completions import get_completion_content, get_completion_content_async
+from utils.tracing import traced
 
-def create_research_plan(research_question):
+def build_research_plan_messages(research_question, language_code):
     """
-    Create a research plan by breaking down a research question into subtasks.
+    Build the messages used to ask the model for a research plan.
     
     Args:
         research_question (str): The main research question.
-        
+        language_code (str): The detected language of the research question.
+    
     Returns:
-        dict: A research plan with subtasks.
+        list: The messages list.
     """
-    try:
-        # Detect the language of the research question
-        language_code = detect_language(research_question)
-        
-        # Get language-specific instructions
-        language_instruction = format_instructions_for_language(language_code)
-        
-        # Modified prompt to request at least 5 subtasks in the detected language
-        human_prompt = f"""I need you to break down the following research question into at least 5 focused subtasks:
+    # Get language-specific instructions
+    language_instruction = format_instructions_for_language(language_code)
+    
+    # Modified prompt to request at least 5 subtasks in the detected language
+    human_prompt = f"""I need you to break down the following research question into at least 5 focused subtasks:
 
             {research_question}
 
             Each subtask should have 1-2 search queries. You MUST create AT LEAST 5 distinct subtasks covering different aspects of the research question. Feel free to create more if the complexity of the topic requires it.
 
             {language_instruction}"""
+    
+    return [
+        {"role": "system", "content": TASK_MANAGER_SYSTEM_PROMPT},
+        {"role": "user", "content": human_prompt}
+    ]
+
+@traced("parse")
+def parse_research_plan(content, research_question, language_code):
+    """
+    Parse the model's response into a research plan with at least 5 subtasks.
+    
+    Args:
+        content (str): The model's response content.
+        research_question (str): The main research question.
+        language_code (str): The detected language of the research question.
+    
+    Returns:
+        dict: A research plan with subtasks.
+    """
+    # Parse the JSON response
+    try:
+        research_plan = json.loads(content)
         
-        # Get the client from the unified client manager
-        client = get_client()
-        
-        # Generate cache key
-        messages = [
-            {"role": "system", "content": TASK_MANAGER_SYSTEM_PROMPT},
-            {"role": "user", "content": human_prompt}
-        ]
-        cache_key = generate_cache_key(get_model(), messages, TEMPERATURE)
+        # Store the detected language in the research plan
+        research_plan["language"] = language_code
         
-        # Check cache first
-        cached_response = get_cached_response(cache_key)
-        if cached_response:
-            print(f"Using cached research plan for: {research_question}")
-            content = cached_response.choices[0].message.content
-        else:
-            # Call the API
-            response = client.chat.create(
-                model=get_model(),
-                messages=messages,
-                temperature=TEMPERATURE
-            )
-            
-            # Cache the response
-            cache_response(cache_key, response)
-            
-            # Extract the content
-            content = response.choices[0].message.content
+        # Ensure that least 5 subtasks were given
+        subtasks = research_plan.get("subtasks", [])
+        if len(subtasks) < 5:
+            # Add more subtasks to reach at least 5
+            existing_count = len(subtasks)
+            additional_subtasks = generate_additional_subtasks(research_question, 5 - existing_count, existing_count, language_code)
+            subtasks.extend(additional_subtasks)
+            research_plan["subtasks"] = subtasks
         
-        # Parse the JSON response
-        try:
-            research_plan = json.loads(content)
-            
-            # Store the detected language in the research plan
-            research_plan["language"] = language_code
-            
-            # Ensure that least 5 subtasks were given
-            subtasks = research_plan.get("subtasks", [])
-            if len(subtasks) < 5:
-                # Add more subtasks to reach at least 5
-                existing_count = len(subtasks)
-                additional_subtasks = generate_additional_subtasks(research_question, 5 - existing_count, existing_count, language_code)
-                subtasks.extend(additional_subtasks)
-                research_plan["subtasks"] = subtasks
+        return research_plan
+    
+    except json.JSONDecodeError:
+        # If parsing fails, try to extract JSON from the text
+        json_match = re.search(r'({[\s\S]*})', content)
+        if json_match:
+            try:
+                research_plan = json.loads(json_match.group(1))
+                
+                # Store the detected language in the research plan
+                research_plan["language"] = language_code
                 
-            return research_plan
-            
-        except json.JSONDecodeError:
-            # If parsing fails, try to extract JSON from the text
-            json_match = re.search(r'({[\s\S]*})', content)
-            if json_match:
-                try:
-                    research_plan = json.loads(json_match.group(1))
-                    
-                    # Store the detected language in the research plan
-                    research_plan["language"] = language_code
-                    
-                    # Ensure we have at least 5 subtasks
-                    subtasks = research_plan.get("subtasks", [])
-                    if len(subtasks) < 5:
-                        # Add more subtasks to reach at least 5
-                        existing_count = len(subtasks)
-                        additional_subtasks = generate_additional_subtasks(research_question, 5 - existing_count, existing_count, language_code)
-                        subtasks.extend(additional_subtasks)
-                        research_plan["subtasks"] = subtasks
-                        
-                    return research_plan
-                except:
-                    pass
-            
-            # Fallback to a manually constructed plan with at least 5 subtasks
-            return {
-                "research_question": research_question,
-                "language": language_code,
-                "subtasks": generate_standard_subtasks(research_question, language_code)
-            }
+                # Ensure we have at least 5 subtasks
+                subtasks = research_plan.get("subtasks", [])
+                if len(subtasks) < 5:
+                    # Add more subtasks to reach at least 5
+                    existing_count = len(subtasks)
+                    additional_subtasks = generate_additional_subtasks(research_question, 5 - existing_count, existing_count, language_code)
+                    subtasks.extend(additional_subtasks)
+                    research_plan["subtasks"] = subtasks
+                
+                return research_plan
+            except:
+                pass
+        
+        # Fallback to a manually constructed plan with at least 5 subtasks
+        return {
+            "research_question": research_question,
+            "language": language_code,
+            "subtasks": generate_standard_subtasks(research_question, language_code)
+        }
+
+@traced("agent")
+def create_research_plan(research_question):
+    """
+    Create a research plan by breaking down a research question into subtasks.
+    
+    Args:
+        research_question (str): The main research question.
+        
+    Returns:
+        dict: A research plan with subtasks.
+    """
+    try:
+        # Detect the language of the research question
+        language_code = detect_language(research_question)
+        
+        # Call the model (or use the cached response)
+        content = get_completion_content(
+            build_research_plan_messages(research_question, language_code),
+            TEMPERATURE,
+            cache_message=f"Using cached research plan for: {research_question}",
+            stage="plan"
+        )
+        
+        return parse_research_plan(content, research_question, language_code)
     except Exception as e:
         print(f"Error in create_research_plan: {e}")
         # Return a fallback plan with at least 5 subtasks
@@ -119,6 +130,39 @@ def create_research_plan(research_question):
             "subtasks": generate_standard_subtasks(research_question, language_code)
         }
 
+@traced("agent")
+async def create_research_plan_async(research_question, client):
+    """
+    Async version of create_research_plan.
+    
+    Args:
+        research_question (str): The main research question.
+        client (AsyncAIClient): The async client to call the model with.
+    
+    Returns:
+        dict: A research plan with subtasks.
+    """
+    try:
+        language_code = detect_language(research_question)
+        
+        content = await get_completion_content_async(
+            client,
+            build_research_plan_messages(research_question, language_code),
+            TEMPERATURE,
+            cache_message=f"Using cached research plan for: {research_question}",
+            stage="plan"
+        )
+        
+        return parse_research_plan(content, research_question, language_code)
+    except Exception as e:
+        print(f"Error in create_research_plan_async: {e}")
+        language_code = detect_language(research_question)
+        return {
+            "research_question": research_question,
+            "language": language_code,
+            "subtasks": generate_standard_subtasks(research_question, language_code)
+        }
+
 def generate_additional_subtasks(research_question, count, start_index=0, language_code='en'):
     """
     Generate additional subtasks to ensure we have the minimum required number.
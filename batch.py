@@ -0,0 +1,230 @@
+"""
+Batch entry point: run every research question in a JSONL file, several at a time.
+
+Each line is either a JSON object with a "question" field (and optionally an "id",
+and a "provider" and "model" to run that question with) or a JSON string. Reports are written as each run finishes, along with one line per
+question in a results JSONL file.
+
+Usage:
+    python batch.py questions.jsonl --concurrency 4 --results results.jsonl
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from config import BATCH_CONCURRENCY, RUN_TIMEOUT_SECONDS, RunConfig
+from main import run_research, save_report, print_call_stats
+from utils.cancellation import RunCancelled, RunTimedOut
+from utils.run_manifest import RunManifest
+from utils.tracing import tracer, export_trace
+from utils.usage import usage_ledger
+
+def read_questions(path, field="question"):
+    """
+    Read research questions from a JSONL file one line at a time.
+    
+    Args:
+        path (str): The JSONL file.
+        field (str, optional): The field of each object holding the question.
+    
+    Yields:
+        dict: The line number, id and question of each entry, and its provider and model if it has them.
+    """
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"Skipping line {line_number}: {e}")
+                continue
+            
+            if isinstance(entry, str):
+                entry = {field: entry}
+            question = entry.get(field) if isinstance(entry, dict) else None
+            if not question:
+                print(f"Skipping line {line_number}: no '{field}' field")
+                continue
+            
+            yield {
+                "line": line_number,
+                "id": entry.get("id", str(line_number)),
+                "question": question,
+                "provider": entry.get("provider"),
+                "model": entry.get("model")
+            }
+
+def checkpoint_id(run_id, entry):
+    """
+    Get the checkpoint ID of a question of a batch. It includes a hash of the question, so
+    a question edited (or moved to another line) between runs of the batch gets a new checkpoint.
+    
+    Args:
+        run_id (str): The batch's run ID.
+        entry (dict): The entry read from the questions file.
+    
+    Returns:
+        str: The run ID of the question's manifest.
+    """
+    question_hash = hashlib.sha256(entry["question"].encode("utf-8")).hexdigest()[:12]
+    return f"{run_id}-{entry['id']}-{question_hash}"
+
+def summarise_stages(task_seconds):
+    """Add up the task timings of a run by stage (the part of the task name before the colon)."""
+    stages = {}
+    for name, seconds in task_seconds.items():
+        stage = name.split(":", 1)[0]
+        stages[stage] = stages.get(stage, 0.0) + seconds
+    return stages
+
+def run_one(entry, output_dir, manifest, timeout=RUN_TIMEOUT_SECONDS):
+    """
+    Run the research pipeline for one question and save its report.
+    
+    Args:
+        entry (dict): The entry read from the questions file.
+        output_dir (str): The directory to save the report to.
+        manifest (RunManifest): The checkpoint of the question's run.
+        timeout (float, optional): The run's time limit in seconds (0 for none).
+    
+    Returns:
+        dict: The results line for the question.
+    """
+    result = {
+        "id": entry["id"],
+        "line": entry["line"],
+        "run_id": manifest.run_id,
+        "question": entry["question"],
+        "started_at": time.time()
+    }
+    try:
+        # Each question runs with its own settings, so questions for different providers can share the batch
+        run_config = RunConfig.from_settings(entry["provider"], entry["model"])
+        result.update({"provider": run_config.provider, "model": run_config.model})
+        
+        # Lines may name any provider, so each question's key is checked rather than only the default's
+        if not run_config.api_key:
+            raise ValueError(f"{run_config.provider.upper()} API key is not set. Please add it to your .env file.")
+        run = run_research(entry["question"], verbose=False, manifest=manifest, run_config=run_config, timeout=timeout)
+        report_path = save_report(run["report"], entry["question"], output_dir, prefix=f"{entry['line']:05d}_")
+        manifest.save("report_path", report_path)
+        result.update({
+            "status": "ok",
+            "report_path": report_path,
+            "resumed_tasks": len(run["resumed_tasks"]),
+            "subtasks": len(run["subtasks"]),
+            "language": run["language"],
+            "elapsed_seconds": run["elapsed_seconds"],
+            "plan_seconds": run["plan_seconds"],
+            "stage_seconds": summarise_stages(run["task_seconds"]),
+            "task_seconds": run["task_seconds"]
+        })
+    except (Exception, RunCancelled) as e:
+        # A run out of time keeps its finished stages, and is resumed when the batch is run again
+        status = "timed_out" if isinstance(e, RunTimedOut) else "cancelled" if isinstance(e, RunCancelled) else "error"
+        result.update({"status": status, "error": str(e), "elapsed_seconds": time.time() - result["started_at"]})
+    
+    # Tokens are counted even when the run failed part way through (and then dropped from the ledger)
+    result["usage"] = usage_ledger.take(manifest.run_id)
+    
+    if tracer.enabled:
+        trace_paths = export_trace(manifest.run_id)
+        if trace_paths:
+            result["spans_path"], result["trace_path"] = trace_paths
+    
+    result["finished_at"] = time.time()
+    return result
+
+def run_batch(path, concurrency=BATCH_CONCURRENCY, output_dir="./reports", results_path="results.jsonl", field="question",
+              run_id=None, timeout=RUN_TIMEOUT_SECONDS):
+    """
+    Run every question in a JSONL file, with a bounded number of research runs at once.
+    Questions are read lazily, so the file can be arbitrarily large. Every run is
+    checkpointed, so rerunning a batch with the same run ID skips the questions that
+    already have a report and resumes the ones that were cut short.
+    
+    Args:
+        path (str): The JSONL file of questions.
+        concurrency (int, optional): The number of research runs at once.
+        output_dir (str, optional): The directory to save reports to.
+        results_path (str, optional): The JSONL file to append a results line to as each run finishes.
+        field (str, optional): The field of each object holding the question.
+        run_id (str, optional): The batch's run ID. Defaults to the name of the questions file.
+        timeout (float, optional): The time limit of each question's run in seconds (0 for none).
+    
+    Returns:
+        dict: The number of questions run, succeeded, failed, timed out, cancelled and skipped, and the wall clock time.
+    """
+    started_at = time.perf_counter()
+    run_id = run_id or os.path.splitext(os.path.basename(path))[0]
+    counts = {"total": 0, "ok": 0, "error": 0, "timed_out": 0, "cancelled": 0, "skipped": 0}
+    results_lock = threading.Lock()
+    
+    with open(results_path, "a", encoding="utf-8") as results_file, ThreadPoolExecutor(max_workers=concurrency) as executor:
+        running = set()
+        
+        def record(future):
+            result = future.result()
+            with results_lock:
+                results_file.write(json.dumps(result, ensure_ascii=False) + "\n")
+                results_file.flush()
+                counts["total"] += 1
+                counts[result["status"]] += 1
+            print(f"[{counts['total']}] {result['status']} in {result['elapsed_seconds']:.1f}s: {result['question'][:70]}")
+        
+        for entry in read_questions(path, field):
+            # A question whose report was saved by an earlier run of the batch is done
+            manifest = RunManifest(checkpoint_id(run_id, entry))
+            if manifest.data.get("question", entry["question"]) != entry["question"]:
+                manifest.reset()
+            if manifest.has("report_path") and manifest.data.get("question") == entry["question"]:
+                counts["skipped"] += 1
+                continue
+            
+            # Only keep as many runs queued as can execute, so the whole file is never in memory
+            if len(running) >= concurrency:
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    record(future)
+            running.add(executor.submit(run_one, entry, output_dir, manifest, timeout))
+        
+        for future in wait(running).done:
+            record(future)
+    
+    counts["wall_clock_seconds"] = time.perf_counter() - started_at
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("questions", help="JSONL file of research questions")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="Research runs at once")
+    parser.add_argument("--output-dir", default="./reports", help="Directory to save reports to")
+    parser.add_argument("--results", default="results.jsonl", help="JSONL file to append per-question results to")
+    parser.add_argument("--field", default="question", help="Field of each JSON object holding the question")
+    parser.add_argument("--run-id", help="Checkpoint ID of the batch, to resume it (defaults to the file name)")
+    parser.add_argument("--trace", action="store_true", help="Write a timing trace of each run (also set by TRACE_ENABLED)")
+    parser.add_argument("--timeout", type=float, default=RUN_TIMEOUT_SECONDS, help="Stop each question's run after this many seconds (0 for no limit)")
+    args = parser.parse_args()
+    
+    if args.trace:
+        tracer.enabled = True
+    
+    os.makedirs(args.output_dir, exist_ok=True)
+    counts = run_batch(args.questions, args.concurrency, args.output_dir, args.results, args.field, args.run_id, args.timeout)
+    
+    print(
+        f"\n{counts['total']} questions in {counts['wall_clock_seconds']:.1f}s "
+        f"({counts['ok']} succeeded, {counts['error']} failed, {counts['timed_out']} timed out, {counts['cancelled']} cancelled, {counts['skipped']} already done). "
+        f"Results written to {args.results}"
+    )
+    print_call_stats()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Benchmark: storage size and get latency of pickled ChatResponse objects versus
+compressed cache records, using the saved reports as the corpus.
+
+Run from the project root:
+    python -m benchmarks.bench_cache_payload --copies 40
+"""
+
+import argparse
+import glob
+import os
+import pickle
+import statistics
+import tempfile
+import time
+
+from utils.ai_client import ChatResponse
+from utils.caching import CacheStore, CODEC_RAW, CODEC_ZLIB, record_from_response, encode_cache_record, decode_cache_record
+
+def load_corpus(pattern, copies):
+    """
+    Build chat responses whose content is taken from the saved reports.
+    
+    Args:
+        pattern (str): Glob pattern of the report files.
+        copies (int): How many responses to build from each report.
+    
+    Returns:
+        list: The chat responses.
+    """
+    responses = []
+    for path in sorted(glob.glob(pattern)):
+        with open(path, encoding="utf-8") as f:
+            report = f.read()
+        for copy in range(copies):
+            responses.append(ChatResponse({
+                "id": f"cmpl-{len(responses)}",
+                "created": int(time.time()),
+                "model": "mistral-small",
+                "choices": [{"message": {"role": "assistant", "content": report}, "finish_reason": "stop"}]
+            }, "mistral"))
+    return responses
+
+def measure(label, store, payloads, decode, rounds):
+    """
+    Store the payloads, then time reading each one back and decoding its content.
+    
+    Args:
+        label (str): The name of the format.
+        store (CacheStore): A store to write the payloads to.
+        payloads (list): The encoded payloads.
+        decode (callable): Turns a payload back into the response content.
+        rounds (int): How many times to read every payload (the fastest round is kept).
+    
+    Returns:
+        tuple: The total payload size in bytes and the per-get latencies in microseconds.
+    """
+    keys = [f"{label}-{i}" for i in range(len(payloads))]
+    store.put_many([(key, payload, "report") for key, payload in zip(keys, payloads)])
+    
+    latencies = [float("inf")] * len(keys)
+    for _ in range(rounds):
+        for i, key in enumerate(keys):
+            start = time.perf_counter()
+            decode(store.get(key))
+            latencies[i] = min(latencies[i], (time.perf_counter() - start) * 1e6)
+    
+    return sum(len(payload) for payload in payloads), latencies
+
+def summarise(label, size, latencies):
+    """Print one row of the results table."""
+    print(f"{label:<26}{size / 1024:>11.1f} KB{statistics.mean(latencies):>11.1f} us{statistics.median(latencies):>11.1f} us")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reports", default=os.path.join("reports", "*.md"), help="Glob pattern of the report corpus")
+    parser.add_argument("--copies", type=int, default=40, help="Responses built from each report")
+    parser.add_argument("--rounds", type=int, default=5, help="Reads of every entry (the fastest is kept)")
+    args = parser.parse_args()
+    
+    responses = load_corpus(args.reports, args.copies)
+    if not responses:
+        print(f"No reports found matching {args.reports}")
+        return
+    
+    with tempfile.TemporaryDirectory() as directory:
+        store = CacheStore(os.path.join(directory, "bench.sqlite3"))
+        
+        pickled = [pickle.dumps(response) for response in responses]
+        pickle_size, pickle_latencies = measure(
+            "pickle", store, pickled, lambda payload: pickle.loads(payload).choices[0].message.content, args.rounds
+        )
+        
+        records = [encode_cache_record(record_from_response(response)) for response in responses]
+        record_size, record_latencies = measure(
+            "record", store, records, lambda payload: decode_cache_record(payload)["content"], args.rounds
+        )
+    
+    print(f"Corpus: {len(responses)} cached reports\n")
+    print(f"{'format':<26}{'total size':>14}{'mean get':>14}{'p50 get':>14}")
+    summarise("pickled objects", pickle_size, pickle_latencies)
+    summarise("records", record_size, record_latencies)
+    
+    # Break the records down by whether they were compressed
+    for codec, label in ((CODEC_RAW, "  stored raw"), (CODEC_ZLIB, "  zlib-compressed")):
+        indexes = [i for i, payload in enumerate(records) if payload[1] == codec]
+        if indexes:
+            print()
+            summarise(f"pickled ({len(indexes)} entries)", sum(len(pickled[i]) for i in indexes), [pickle_latencies[i] for i in indexes])
+            summarise(label, sum(len(records[i]) for i in indexes), [record_latencies[i] for i in indexes])
+    
+    print(f"\nStorage saved: {100 * (1 - record_size / pickle_size):.1f}%")
+    print(f"Mean get latency relative to pickled objects: {statistics.mean(record_latencies) / statistics.mean(pickle_latencies):.2f}x")
+
+if __name__ == "__main__":
+    main()
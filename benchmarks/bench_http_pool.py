@@ -0,0 +1,87 @@
+"""
+Benchmark: per-call latency with a bare requests.post versus the pooled transport.
+
+Run from the project root:
+    python -m benchmarks.bench_http_pool --calls 200
+"""
+
+import argparse
+import json
+import os
+import statistics
+import time
+
+import requests
+
+from benchmarks.stub_server import start_stub_server
+
+def time_calls(call, count):
+    """
+    Time a number of sequential calls.
+    
+    Args:
+        call (callable): The function to call.
+        count (int): The number of calls.
+    
+    Returns:
+        list: The latency of each call in milliseconds.
+    """
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        call()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+def report(label, latencies, connections):
+    """Print a one-line summary of a benchmark run."""
+    print(
+        f"{label:<22} mean {statistics.mean(latencies):7.3f} ms   "
+        f"p50 {statistics.median(latencies):7.3f} ms   "
+        f"connections opened: {connections}"
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200, help="Number of sequential calls per mode")
+    parser.add_argument("--latency", type=float, default=0.0, help="Simulated server latency in seconds")
+    args = parser.parse_args()
+    
+    server, base_url = start_stub_server(latency=args.latency)
+    
+    # Point the client at the stub before config is imported
+    os.environ["AI_PROVIDER"] = "openai"
+    os.environ["OPENAI_API_KEY"] = "stub-key"
+    os.environ["OPENAI_BASE_URL"] = base_url
+    
+    from utils.ai_client import AIClient
+    
+    messages = [{"role": "user", "content": "ping"}]
+    payload = json.dumps({"model": "stub-model", "messages": messages, "temperature": 0.7})
+    headers = {"Content-Type": "application/json", "Authorization": "Bearer stub-key"}
+    
+    # Previous behaviour: a bare requests.post per call (new connection every time)
+    def bare_call():
+        requests.post(f"{base_url}/chat/completions", headers=headers, data=payload)
+    
+    before = server.state.connections
+    bare = time_calls(bare_call, args.calls)
+    report("bare requests.post", bare, server.state.connections - before)
+    
+    # Pooled transport: connections are kept alive and reused
+    client = AIClient()
+    
+    def pooled_call():
+        client.chat.create(model="stub-model", messages=messages)
+    
+    before = server.state.connections
+    pooled = time_calls(pooled_call, args.calls)
+    report("pooled transport", pooled, server.state.connections - before)
+    
+    speedup = statistics.mean(bare) / statistics.mean(pooled)
+    print(f"\nPooled transport is {speedup:.2f}x faster per call on average")
+    
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+"""
+Benchmark: end-to-end latency of run_research_assistant, of each agent function and
+of the caching primitives, against a stub API server that answers every agent's
+prompt with realistic content. For each scenario it reports p50/p95/p99 latency,
+upstream calls per run, the share of completions served from the cache and the
+peak RSS of the process.
+
+Save a run as a baseline, then compare later runs against it. Metrics that got worse
+by more than the tolerance are flagged, and the exit status is 1 so CI can fail on them.
+
+Run from the project root:
+    python -m benchmarks.bench_pipeline --runs 5 --save-baseline baseline.json
+    python -m benchmarks.bench_pipeline --runs 5 --baseline baseline.json --tolerance 15
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+from benchmarks.stub_server import start_stub_server
+from benchmarks.stub_responses import pipeline_response
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where peak RSS is not reported
+    resource = None
+
+# Whether a lower or a higher value of each metric is better
+METRICS = {
+    "p50_ms": "lower",
+    "p95_ms": "lower",
+    "p99_ms": "lower",
+    "calls_per_run": "lower",
+    "cache_hit_ratio": "higher",
+    "peak_rss_mb": "lower"
+}
+
+def percentile(values, percent):
+    """
+    Get a percentile of a list of values, interpolating between the closest ranks.
+    
+    Args:
+        values (list): The values.
+        percent (float): The percentile, between 0 and 100.
+    
+    Returns:
+        float: The percentile.
+    """
+    ordered = sorted(values)
+    if len(ordered) == 1:
+        return ordered[0]
+    
+    rank = (len(ordered) - 1) * percent / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+def peak_rss_mb():
+    """Get the peak resident set size of the process in MB, or None where it is not available."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+class Scenario:
+    """
+    Collects the latencies of one scenario's operations, and the upstream calls and
+    cache hits made while they ran.
+    """
+    
+    def __init__(self, name, server):
+        """
+        Initialise the scenario.
+        
+        Args:
+            name (str): The name of the scenario.
+            server: The stub server, whose request counter gives the upstream calls.
+        """
+        self.name = name
+        self.server = server
+        self.latencies = []
+        self.calls = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+    
+    @contextlib.contextmanager
+    def measure(self):
+        """Time one operation, hiding what the pipeline prints."""
+        from utils.caching import get_cache_stats
+        
+        def cache_hits():
+            stats = get_cache_stats()
+            return stats["memory"]["hits"], stats["disk"]["hits"]
+        
+        with contextlib.redirect_stdout(io.StringIO()):
+            requests, (memory_hits, disk_hits) = self.server.state.requests, cache_hits()
+            start = time.perf_counter()
+            yield
+            self.latencies.append(time.perf_counter() - start)
+            self.calls += self.server.state.requests - requests
+            memory_hits_after, disk_hits_after = cache_hits()
+            self.memory_hits += memory_hits_after - memory_hits
+            self.disk_hits += disk_hits_after - disk_hits
+    
+    def result(self):
+        """
+        Summarise the scenario.
+        
+        Returns:
+            dict: The latency percentiles, calls per run, cache hit ratio (and the hits of each
+                cache tier) and peak RSS.
+        """
+        calls, hits = self.calls, self.memory_hits + self.disk_hits
+        latencies_ms = [latency * 1000 for latency in self.latencies]
+        
+        return {
+            "count": len(latencies_ms),
+            "p50_ms": percentile(latencies_ms, 50),
+            "p95_ms": percentile(latencies_ms, 95),
+            "p99_ms": percentile(latencies_ms, 99),
+            "calls_per_run": calls / len(latencies_ms),
+            # Every completion is either served from the cache or sent upstream
+            "cache_hit_ratio": hits / (hits + calls) if hits + calls else None,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "peak_rss_mb": peak_rss_mb()
+        }
+
+
+def bench_pipeline(server, questions):
+    """Run the whole pipeline for every question, first with a cold cache and then with a warm one."""
+    from main import run_research_assistant
+    
+    results = {}
+    for name in ("pipeline.cold", "pipeline.warm"):
+        scenario = Scenario(name, server)
+        for question in questions:
+            with scenario.measure():
+                run_research_assistant(question)
+        results[name] = scenario.result()
+    return results
+
+def bench_agents(server, questions):
+    """Time each agent function on its own, feeding each one the output of the one before."""
+    from agents.task_manager import create_research_plan
+    from agents.information_retrieval import retrieve_information
+    from agents.analysis import analyse_information
+    from agents.report_generator import generate_report
+    
+    plan = Scenario("agent.create_research_plan", server)
+    retrieval = Scenario("agent.retrieve_information", server)
+    analysis = Scenario("agent.analyse_information", server)
+    report = Scenario("agent.generate_report", server)
+    
+    for question in questions:
+        with plan.measure():
+            research_plan = create_research_plan(question)
+        
+        analyses = []
+        for subtask in research_plan["subtasks"]:
+            with retrieval.measure():
+                information = retrieve_information(subtask)
+            with analysis.measure():
+                analyses.append(analyse_information(subtask, information))
+        
+        with report.measure():
+            generate_report(question, analyses, research_plan["subtasks"], research_plan.get("language", "en"))
+    
+    return {scenario.name: scenario.result() for scenario in (plan, retrieval, analysis, report)}
+
+def bench_caching(server, operations):
+    """Time the caching primitives: key generation, writes, and reads from disk and from memory."""
+    from utils.ai_client import ChatResponse
+    from utils.caching import generate_cache_key, cache_response, get_cached_content, memory_cache
+    
+    content = pipeline_response({"messages": [{"role": "system", "content": "Report Generator Agent"}, {"role": "user", "content": "cache"}]})
+    messages = [[{"role": "user", "content": f"Cache benchmark message {i}"}] for i in range(operations)]
+    
+    key_scenario = Scenario("cache.generate_cache_key", server)
+    keys = []
+    for message in messages:
+        with key_scenario.measure():
+            keys.append(generate_cache_key("stub-model", message, 0.7))
+    
+    write_scenario = Scenario("cache.cache_response", server)
+    for i, key in enumerate(keys):
+        response = ChatResponse({
+            "id": f"bench-{i}",
+            "created": int(time.time()),
+            "model": "stub-model",
+            "choices": [{"message": {"role": "assistant", "content": content}, "finish_reason": "stop"}]
+        }, "openai")
+        with write_scenario.measure():
+            cache_response(key, response, "report")
+    
+    # The first read of each key comes from disk and fills the memory tier, the second comes from memory.
+    # The tier is sized to hold every key meanwhile, or the second pass would evict each key before reading it again
+    limits = memory_cache.max_entries, memory_cache.max_bytes
+    memory_cache.max_entries = max(memory_cache.max_entries, operations)
+    memory_cache.max_bytes = max(memory_cache.max_bytes, operations * len(content.encode("utf-8")) * 2)
+    try:
+        memory_cache.clear()
+        disk_scenario = Scenario("cache.get_cached_content.disk", server)
+        for key in keys:
+            with disk_scenario.measure():
+                get_cached_content(key)
+        
+        memory_scenario = Scenario("cache.get_cached_content.memory", server)
+        for key in keys:
+            with memory_scenario.measure():
+                get_cached_content(key)
+    finally:
+        memory_cache.max_entries, memory_cache.max_bytes = limits
+        memory_cache.clear()
+    
+    # A read scenario served by the other tier would time the wrong thing, so fail loudly
+    for scenario, tier in ((disk_scenario, "disk"), (memory_scenario, "memory")):
+        hits = scenario.memory_hits if tier == "memory" else scenario.disk_hits
+        if hits != operations:
+            raise RuntimeError(
+                f"{scenario.name} read {hits} of {operations} keys from the {tier} tier "
+                f"({scenario.memory_hits} memory hits, {scenario.disk_hits} disk hits)"
+            )
+    
+    return {scenario.name: scenario.result() for scenario in (key_scenario, write_scenario, disk_scenario, memory_scenario)}
+
+def compare(results, baseline, tolerance):
+    """
+    Compare a run with a baseline.
+    
+    Args:
+        results (dict): The scenarios of this run.
+        baseline (dict): The scenarios of the baseline.
+        tolerance (float): How many percent worse a metric may get before it is flagged.
+    
+    Returns:
+        list: The regressions, as (scenario, metric, baseline value, new value) tuples.
+    """
+    regressions = []
+    print(f"\nCompared with the baseline (tolerance {tolerance:.0f}%):")
+    print(f"{'scenario':<34} {'metric':<16} {'baseline':>10} {'now':>10} {'change':>9}")
+    
+    for name, scenario in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:<34} (not in the baseline)")
+            continue
+        
+        for metric, better in METRICS.items():
+            old, new = base.get(metric), scenario.get(metric)
+            if old is None or new is None:
+                continue
+            
+            change = (new - old) / old * 100 if old else 0.0
+            worse = change > tolerance if better == "lower" else change < -tolerance
+            flag = "  REGRESSION" if worse else ""
+            print(f"{name:<34} {metric:<16} {old:>10.3f} {new:>10.3f} {change:>+8.1f}%{flag}")
+            if worse:
+                regressions.append((name, metric, old, new))
+    
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="Research questions per scenario")
+    parser.add_argument("--latency", type=float, default=0.01, help="Simulated server-side latency per call in seconds")
+    parser.add_argument("--cache-operations", type=int, default=2000, help="Operations per caching scenario")
+    parser.add_argument("--save-baseline", metavar="PATH", help="Write the results to a baseline file")
+    parser.add_argument("--baseline", metavar="PATH", help="Compare the results with a baseline file")
+    parser.add_argument("--tolerance", type=float, default=10.0, help="Percent a metric may get worse before it is flagged")
+    args = parser.parse_args()
+    
+    server, base_url = start_stub_server(latency=args.latency, responder=pipeline_response)
+    workspace = tempfile.mkdtemp(prefix="bench_pipeline_")
+    
+    # Point the client at the stub, with no client-side rate limit and a cache of its own,
+    # before config is imported
+    os.environ["AI_PROVIDER"] = "openai"
+    os.environ["OPENAI_API_KEY"] = "stub-key"
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ["OPENAI_REQUESTS_PER_MINUTE"] = "0"
+    os.environ["OPENAI_TOKENS_PER_MINUTE"] = "0"
+    os.environ["CACHE_DB_PATH"] = os.path.join(workspace, "cache.sqlite3")
+    os.environ["CACHE_SWEEP_INTERVAL_SECONDS"] = "0"
+    os.environ["RUN_MANIFEST_DIR"] = os.path.join(workspace, "runs")
+    
+    # Every scenario gets questions of its own, so none starts with a warm cache by accident
+    stamp = time.time_ns()
+    results = {}
+    results.update(bench_pipeline(server, [f"Pipeline question {i} ({stamp})" for i in range(args.runs)]))
+    results.update(bench_agents(server, [f"Agent question {i} ({stamp})" for i in range(args.runs)]))
+    results.update(bench_caching(server, args.cache_operations))
+    
+    print(f"{args.runs} runs, {args.latency * 1000:.0f} ms stub latency, {args.cache_operations} cache operations\n")
+    print(f"{'scenario':<34} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'calls/run':>10} {'hit ratio':>10} {'mem/disk hits':>14} {'peak RSS MB':>12}")
+    for name, result in results.items():
+        hit_ratio = "-" if result["cache_hit_ratio"] is None else f"{result['cache_hit_ratio']:.2f}"
+        peak = "-" if result["peak_rss_mb"] is None else f"{result['peak_rss_mb']:.1f}"
+        tier_hits = f"{result['memory_hits']}/{result['disk_hits']}"
+        print(
+            f"{name:<34} {result['p50_ms']:>9.3f} {result['p95_ms']:>9.3f} {result['p99_ms']:>9.3f} "
+            f"{result['calls_per_run']:>10.2f} {hit_ratio:>10} {tier_hits:>14} {peak:>12}"
+        )
+    
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump({
+                "created_at": time.time(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "settings": {"runs": args.runs, "latency": args.latency, "cache_operations": args.cache_operations},
+                "scenarios": results
+            }, f, indent=2)
+        print(f"\nBaseline saved to {args.save_baseline}")
+    
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline["scenarios"], args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} metrics regressed beyond {args.tolerance:.0f}%")
+            sys.exit(1)
+        print("\nNo regressions")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Benchmark: completing a burst of calls against a stub server that answers 429
+once its per-second quota is used up, with the fixed one-second spacing the
+pipeline used to rely on versus the shared rate limiter.
+
+Run from the project root:
+    python -m benchmarks.bench_rate_limit --calls 60 --quota 10
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.stub_server import start_stub_server
+
+def run(label, calls, workers, quota, limiter, retry_after=True, spacing=0.0):
+    """
+    Make a number of calls against a fresh rate-limited stub server and print a summary.
+    
+    Args:
+        label (str): The name of the mode.
+        calls (int): The number of calls.
+        workers (int): The number of threads making calls.
+        quota (int): Requests the stub accepts per second.
+        limiter (RateLimiter): The limiter the client uses.
+        retry_after (bool, optional): Whether the stub sends Retry-After on 429s.
+        spacing (float, optional): A fixed sleep after each call (the old behaviour).
+    """
+    from utils.ai_client import AIClient
+    from utils.rate_limiter import set_rate_limiter
+    
+    server, base_url = start_stub_server(requests_per_second=quota, retry_after=retry_after)
+    set_rate_limiter("openai", limiter)
+    client = AIClient()
+    client.base_urls["openai"] = base_url
+    messages = [{"role": "user", "content": "ping"}]
+    
+    def call(_):
+        try:
+            client.chat.create(model="stub-model", messages=messages)
+            succeeded = True
+        except Exception:
+            succeeded = False
+        if spacing:
+            time.sleep(spacing)
+        return succeeded
+    
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        succeeded = sum(executor.map(call, range(calls)))
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+    
+    print(
+        f"{label:<34} {elapsed:7.2f} s   {calls / elapsed:6.1f} calls/s   "
+        f"succeeded {succeeded}/{calls}   429s {server.state.throttled}"
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=60, help="Number of calls per mode")
+    parser.add_argument("--quota", type=int, default=10, help="Requests the stub accepts per second")
+    parser.add_argument("--workers", type=int, default=8, help="Threads making calls")
+    parser.add_argument("--fixed-sleep", action="store_true", help="Also run the old sequential one-second spacing")
+    args = parser.parse_args()
+    
+    # Point the client at a stub before config is imported
+    os.environ["AI_PROVIDER"] = "openai"
+    os.environ["OPENAI_API_KEY"] = "stub-key"
+    
+    from utils.rate_limiter import RateLimiter, TokenBucket
+    
+    print(f"{args.calls} calls, stub quota {args.quota} requests/s\n")
+    
+    if args.fixed_sleep:
+        run("sequential, sleep(1) per call", args.calls, 1, args.quota, RateLimiter(max_retries=0), spacing=1.0)
+    
+    run("no limiter, no retries", args.calls, args.workers, args.quota, RateLimiter(max_retries=0))
+    run("backoff on Retry-After", args.calls, args.workers, args.quota, RateLimiter())
+    run(
+        "jittered backoff (no Retry-After)", args.calls, args.workers, args.quota,
+        RateLimiter(max_retries=10, backoff_base=0.25, backoff_max=2), retry_after=False
+    )
+    
+    # Pace to the quota; the stub meters per second, so the burst is one second's worth
+    paced = RateLimiter(requests_per_minute=args.quota * 60)
+    paced.requests = TokenBucket(args.quota * 60, capacity=args.quota)
+    run("token bucket at the quota", args.calls, args.workers, args.quota, paced)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Benchmark: time to first content and total time of a report-sized completion,
+returned whole versus streamed as server-sent events.
+
+Run from the project root:
+    python -m benchmarks.bench_streaming --words 1000 --token-delay 0.002
+"""
+
+import argparse
+import os
+import statistics
+import time
+
+from benchmarks.stub_server import start_stub_server
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--words", type=int, default=1000, help="Words in the completion (one streamed chunk each)")
+    parser.add_argument("--token-delay", type=float, default=0.002, help="Simulated generation time per word in seconds")
+    parser.add_argument("--rounds", type=int, default=5, help="Completions per mode")
+    args = parser.parse_args()
+    
+    content = " ".join(f"word{i}" for i in range(args.words))
+    server, base_url = start_stub_server(content=content, token_delay=args.token_delay)
+    
+    # Point the client at the stub before config is imported
+    os.environ["AI_PROVIDER"] = "openai"
+    os.environ["OPENAI_API_KEY"] = "stub-key"
+    os.environ["OPENAI_BASE_URL"] = base_url
+    
+    from utils.ai_client import AIClient
+    
+    client = AIClient()
+    messages = [{"role": "user", "content": "Write the report"}]
+    
+    results = {"whole": ([], []), "streamed": ([], [])}
+    for _ in range(args.rounds):
+        start = time.perf_counter()
+        text = client.chat.create(model="stub-model", messages=messages).choices[0].message.content
+        elapsed = time.perf_counter() - start
+        results["whole"][0].append(elapsed)
+        results["whole"][1].append(elapsed)
+        
+        start = time.perf_counter()
+        first = None
+        parts = []
+        for delta in client.chat.create(model="stub-model", messages=messages, stream=True):
+            if first is None:
+                first = time.perf_counter() - start
+            parts.append(delta)
+        results["streamed"][0].append(first)
+        results["streamed"][1].append(time.perf_counter() - start)
+        assert "".join(parts) == text == content
+    
+    print(f"{args.words} words, {args.token_delay * 1000:.1f} ms per word, {args.rounds} rounds\n")
+    for label, (first_latencies, totals) in results.items():
+        print(
+            f"{label:<10} first content {statistics.median(first_latencies) * 1000:8.1f} ms   "
+            f"complete {statistics.median(totals) * 1000:8.1f} ms"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Realistic completions for the stub server, so the whole pipeline can run against it.
+Each agent's system prompt is recognised and answered with content its parser accepts.
+"""
+
+import hashlib
+import json
+import re
+
+# Words in a stub report, about the length of a real one
+REPORT_WORDS = 600
+
+def pipeline_response(request):
+    """
+    Build the content of a completion for one of the pipeline's prompts.
+    
+    Args:
+        request (dict): The chat completions request body.
+    
+    Returns:
+        str: The content, in the format the calling agent expects.
+    """
+    messages = request.get("messages") or []
+    system = next((message["content"] for message in messages if message.get("role") == "system"), "")
+    user = next((message["content"] for message in reversed(messages) if message.get("role") == "user"), "")
+    
+    # A short tag that differs between requests, so every answer is distinct
+    tag = hashlib.sha256(user.encode("utf-8")).hexdigest()[:8]
+    
+    if "Task Manager Agent" in system:
+        return json.dumps(research_plan(tag))
+    if "search engine API" in system and "keyed by the exact query" in system:
+        queries = json.loads(user.replace("Search queries:", "").strip())
+        return json.dumps({query: search_results(query, tag) for query in queries})
+    if "search engine API" in system:
+        return json.dumps(search_results(user.replace("Search query:", "").strip(), tag))
+    if "Information Retrieval Agent" in system:
+        return json.dumps(retrieved_information(tag))
+    if "Analysis Agent" in system:
+        return json.dumps(analysis(tag))
+    if "Report Generator Agent" in system:
+        return report(tag)
+    return "{}"
+
+def research_plan(tag):
+    """A plan with five subtasks of two search queries each."""
+    return {
+        "research_question": f"Stub question {tag}",
+        "subtasks": [
+            {
+                "id": f"subtask-{i}",
+                "description": f"Aspect {i} of question {tag}",
+                "search_queries": [f"{tag} aspect {i} overview", f"{tag} aspect {i} evidence"]
+            } for i in range(1, 6)
+        ]
+    }
+
+def search_results(query, tag):
+    """Three search results for a query."""
+    slug = re.sub(r"[^a-z0-9]+", "-", query.lower()).strip("-") or tag
+    return [
+        {
+            "title": f"{query} - source {i}",
+            "url": f"https://example.com/{slug}/{i}",
+            "snippet": f"A brief snippet about {query} from source {i}.",
+            "content": " ".join([f"Content about {query} from source {i}."] * 20)
+        } for i in range(1, 4)
+    ]
+
+def retrieved_information(tag):
+    """The key information of three sources."""
+    return {
+        "subtask_id": tag,
+        "sources": [
+            {
+                "title": f"Source {i}",
+                "url": f"https://example.com/{tag}/{i}",
+                "credibility_score": 0.8,
+                "relevance_score": 0.9,
+                "key_information": [f"Key point {j} of source {i}" for j in range(1, 4)],
+                "summary": f"Summary of source {i} for {tag}."
+            } for i in range(1, 4)
+        ]
+    }
+
+def analysis(tag):
+    """An analysis with a few findings."""
+    return {
+        "subtask_id": tag,
+        "analysis": {
+            "key_findings": [f"Finding {i} for {tag}" for i in range(1, 4)],
+            "patterns_identified": [f"Pattern {i}" for i in range(1, 3)],
+            "contradictions": ["Contradiction 1"],
+            "knowledge_gaps": ["Gap 1"],
+            "summary": f"Summary of the analysis for {tag}."
+        }
+    }
+
+def report(tag):
+    """A Markdown report of about REPORT_WORDS words."""
+    sentence = f"This section discusses the findings of {tag} in some depth."
+    sections = [f"# Research Report {tag}"]
+    for i in range(1, 8):
+        sections.append(f"## Section {i}\n\n" + " ".join([sentence] * (REPORT_WORDS // 70)))
+    return "\n\n".join(sections)
@@ -0,0 +1,230 @@
+"""
+A local stub of the chat completions API used by the benchmarks.
+It speaks HTTP/1.1 with keep-alive so connection reuse can be measured.
+"""
+
+import gzip
+import json
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class StubState:
+    """
+    Counters shared by every request handler of a stub server.
+    """
+    
+    def __init__(self, latency=0.0, requests_per_second=0, retry_after=True, content="{}", token_delay=0.0,
+                 responder=None):
+        """
+        Initialise the counters.
+        
+        Args:
+            latency (float, optional): Simulated server-side latency per request in seconds.
+            requests_per_second (int, optional): Requests accepted per second before answering 429,
+                refilled continuously with a burst of one second's worth (0 for no limit).
+            retry_after (bool, optional): Whether 429 responses carry a Retry-After header.
+            content (str, optional): The content of every completion.
+            token_delay (float, optional): Simulated generation time per word in seconds.
+            responder (callable, optional): Builds the content of a completion from the request body,
+                instead of answering every request with the same content.
+        """
+        self.latency = latency
+        self.content = content
+        self.token_delay = token_delay
+        self.responder = responder
+        self.requests_per_second = requests_per_second
+        self.retry_after = retry_after
+        self.connections = 0
+        self.requests = 0
+        self.throttled = 0
+        self.allowance = float(requests_per_second)
+        self.refilled_at = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def admit(self):
+        """
+        Count a request against the rate limit.
+        
+        Returns:
+            float: 0 if the request is accepted, otherwise the seconds until it would be.
+        """
+        if not self.requests_per_second:
+            return 0.0
+        
+        now = time.monotonic()
+        self.allowance = min(float(self.requests_per_second), self.allowance + (now - self.refilled_at) * self.requests_per_second)
+        self.refilled_at = now
+        
+        if self.allowance < 1:
+            self.throttled += 1
+            return (1 - self.allowance) / self.requests_per_second
+        
+        self.allowance -= 1
+        return 0.0
+    
+    def respond(self, request):
+        """Get the content of the completion answering a request."""
+        if self.responder is not None:
+            return self.responder(request)
+        return self.content
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Handles POST /chat/completions with a canned OpenAI-style response,
+    or a 429 when the stub's rate limit is exceeded.
+    """
+    
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, so Nagle would stall kept-alive connections
+    disable_nagle_algorithm = True
+    
+    def setup(self):
+        """Count each new TCP connection."""
+        super().setup()
+        with self.server.state.lock:
+            self.server.state.connections += 1
+    
+    def do_POST(self):
+        """Return a canned chat completion, streamed as server-sent events if asked."""
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        request = json.loads(body or b"{}")
+        stream = bool(request.get("stream"))
+        content = self.server.state.respond(request)
+        usage = stub_usage(request, content)
+        model = request.get("model") or "stub-model"
+        
+        with self.server.state.lock:
+            self.server.state.requests += 1
+            request_number = self.server.state.requests
+            reset_after = self.server.state.admit()
+        
+        if reset_after:
+            self.send_throttled(reset_after)
+            return
+        
+        if self.server.state.latency:
+            time.sleep(self.server.state.latency)
+        
+        if stream:
+            try:
+                self.send_stream(request_number, content, usage, model)
+            except (BrokenPipeError, ConnectionResetError):
+                # The client stopped reading part way through
+                self.close_connection = True
+            return
+        
+        # A whole completion is only sent once every word has been generated
+        if self.server.state.token_delay:
+            time.sleep(self.server.state.token_delay * (len(content.split(" ")) - 1))
+        
+        body = json.dumps({
+            "id": f"stub-{request_number}",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop"
+                }
+            ],
+            "usage": usage
+        }).encode("utf-8")
+        
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def send_stream(self, request_number, content, usage, model):
+        """Stream the content one word per event, with chunked encoding so the connection stays open."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        
+        def send_event(data):
+            event = f"data: {data}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(event):x}\r\n".encode("ascii") + event + b"\r\n")
+            self.wfile.flush()
+        
+        words = content.split(" ")
+        for i, word in enumerate(words):
+            if i and self.server.state.token_delay:
+                time.sleep(self.server.state.token_delay)
+            event = {
+                "id": f"stub-{request_number}",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "delta": {"content": word if i == 0 else f" {word}"},
+                        "finish_reason": "stop" if i == len(words) - 1 else None
+                    }
+                ]
+            }
+            # The last event carries the usage, as the providers send it
+            if i == len(words) - 1:
+                event["usage"] = usage
+            send_event(json.dumps(event))
+        send_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+    
+    def send_throttled(self, reset_after):
+        """Answer 429, like a provider whose quota is used up."""
+        body = json.dumps({"error": {"message": "Rate limit exceeded", "type": "rate_limit_error"}}).encode("utf-8")
+        
+        self.send_response(429)
+        self.send_header("Content-Type", "application/json")
+        if self.server.state.retry_after:
+            self.send_header("Retry-After", str(math.ceil(reset_after)))
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        """Keep the benchmark output quiet."""
+        pass
+
+
+def stub_usage(request, content):
+    """Count the tokens of a request and its completion at about four characters per token."""
+    prompt_tokens = sum(len(message.get("content") or "") for message in request.get("messages") or []) // 4
+    completion_tokens = len(content) // 4
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+
+def start_stub_server(latency=0.0, host="127.0.0.1", port=0, requests_per_second=0, retry_after=True,
+                      content="{}", token_delay=0.0, responder=None):
+    """
+    Start a stub server in a background thread.
+    
+    Args:
+        latency (float, optional): Simulated server-side latency per request in seconds.
+        host (str, optional): The interface to bind to.
+        port (int, optional): The port to bind to (0 picks a free port).
+        requests_per_second (int, optional): Requests accepted per second before answering 429.
+        retry_after (bool, optional): Whether 429 responses carry a Retry-After header.
+        content (str, optional): The content of every completion.
+        token_delay (float, optional): Simulated generation time per word in seconds.
+        responder (callable, optional): Builds the content of each completion from the request body.
+    
+    Returns:
+        tuple: The server and its base URL.
+    """
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.state = StubState(latency, requests_per_second, retry_after, content, token_delay, responder)
+    
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    
+    base_url = f"http://{host}:{server.server_address[1]}/v1"
+    return server, base_url
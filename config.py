@@ -1,4 +1,6 @@
 import os
+import contextlib
+import contextvars
 from dotenv import load_dotenv
 
 # Load environment variables from .env file if it exists
@@ -9,7 +11,8 @@ MISTRAL_API_KEY = os.environ.get("MISTRAL_API_KEY")
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 
 # Provider configuration (default to Mistral)
-AI_PROVIDER = os.environ.get("AI_PROVIDER", "mistral")  # Options: "mistral" or "openai"
+AI_PROVIDER = os.environ.get("AI_PROVIDER", "mistral")  # Options: "mistral", "openai" or "replay"
+PROVIDERS = ("mistral", "openai", "replay")
 
 # Model configurations
 MISTRAL_MODEL = os.environ.get("MISTRAL_MODEL", "mistral-small")  # Default to the fastest model
@@ -21,47 +24,198 @@ MAX_TOKENS = int(os.environ.get("MAX_TOKENS", "1500"))  # Reduced for speed (for
 
 # Search parameters
 SEARCH_RESULT_LIMIT = int(os.environ.get("SEARCH_RESULT_LIMIT", "2"))
+# Queries answered by one simulated search call when a plan's searches are batched (1 searches each query on its own)
+SEARCH_BATCH_SIZE = int(os.environ.get("SEARCH_BATCH_SIZE", "5"))
+# Search backend - "simulated" asks the model to invent results, "local" searches a BM25 index
+# of the documents in SEARCH_CORPUS_DIR (built with: python -m utils.local_index build)
+SEARCH_BACKEND = os.environ.get("SEARCH_BACKEND", "simulated").lower()
+SEARCH_INDEX_PATH = os.environ.get("SEARCH_INDEX_PATH", os.path.join("search_index", "index.sqlite3"))
+SEARCH_CORPUS_DIR = os.environ.get("SEARCH_CORPUS_DIR", "corpus")
+
+# Cache parameters - every cached response lives in a single SQLite file
+CACHE_DB_PATH = os.environ.get("CACHE_DB_PATH", os.path.join("cache", "cache.sqlite3"))
+
+# Cache size limits, enforced by a background sweeper. Stage quotas are given as
+# "stage=size" pairs, e.g. "search=100MB,retrieval=100MB", and the eviction policy is "lru" or "age"
+CACHE_MAX_BYTES = os.environ.get("CACHE_MAX_BYTES", "512MB")
+CACHE_STAGE_QUOTAS = os.environ.get("CACHE_STAGE_QUOTAS", "")
+CACHE_EVICTION_POLICY = os.environ.get("CACHE_EVICTION_POLICY", "lru")
+CACHE_MAX_AGE_HOURS = float(os.environ.get("CACHE_MAX_AGE_HOURS", "24"))
+CACHE_SWEEP_INTERVAL_SECONDS = float(os.environ.get("CACHE_SWEEP_INTERVAL_SECONDS", "60"))
+
+# Cached records at least this large are zlib-compressed (smaller ones are stored raw, which is faster to read)
+CACHE_COMPRESS_MIN_BYTES = int(os.environ.get("CACHE_COMPRESS_MIN_BYTES", "2048"))
+
+# In-memory cache tier in front of the SQLite file (limits by entry count, bytes and age)
+MEMORY_CACHE_MAX_ENTRIES = int(os.environ.get("MEMORY_CACHE_MAX_ENTRIES", "1000"))
+MEMORY_CACHE_MAX_BYTES = int(os.environ.get("MEMORY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+MEMORY_CACHE_TTL_SECONDS = float(os.environ.get("MEMORY_CACHE_TTL_SECONDS", "3600"))
+
+# Provider API endpoints (overridable so that a local stub server can be used)
+MISTRAL_BASE_URL = os.environ.get("MISTRAL_BASE_URL", "https://api.mistral.ai/v1")
+OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL", "https://api.openai.com/v1")
+
+# HTTP transport parameters - connections are pooled and kept alive per base URL
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", "10"))
+MISTRAL_POOL_SIZE = int(os.environ.get("MISTRAL_POOL_SIZE", str(HTTP_POOL_SIZE)))
+OPENAI_POOL_SIZE = int(os.environ.get("OPENAI_POOL_SIZE", str(HTTP_POOL_SIZE)))
+HTTP_TIMEOUT = float(os.environ.get("HTTP_TIMEOUT", "120"))
+HTTP_GZIP_REQUESTS = os.environ.get("HTTP_GZIP_REQUESTS", "false").lower() == "true"
+
+# AI clients kept for reuse, one per provider, model and API key (least recently used dropped first)
+CLIENT_CACHE_SIZE = int(os.environ.get("CLIENT_CACHE_SIZE", "32"))
+
+# Async pipeline parameters - one event loop with many requests in flight
+ASYNC_PIPELINE = os.environ.get("ASYNC_PIPELINE", "false").lower() == "true"
+ASYNC_MAX_CONNECTIONS = int(os.environ.get("ASYNC_MAX_CONNECTIONS", "100"))
+
+# Pipeline parameters - each subtask's analysis starts as soon as its retrieval finishes,
+# with at most this many tasks running at once
+PIPELINE_MAX_WORKERS = int(os.environ.get("PIPELINE_MAX_WORKERS", "8"))
+# Worker threads shared by every run in the process (pipeline tasks, searches and plans),
+# which caps the work - and so the model calls - running at once across concurrent runs
+WORKER_POOL_SIZE = int(os.environ.get("WORKER_POOL_SIZE", "16"))
+
+# Run manifests - every finished stage of a run is checkpointed here so the run can be resumed
+RUN_MANIFEST_DIR = os.environ.get("RUN_MANIFEST_DIR", "runs")
+
+# Deadline of a research run in seconds (0 for none). A run out of time stops at its next
+# task or model call, keeping the stages it finished so it can be resumed
+RUN_TIMEOUT_SECONDS = float(os.environ.get("RUN_TIMEOUT_SECONDS", "0"))
+
+# Batch mode - research runs in flight at once when running a file of questions
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "4"))
+
+# Job server - research runs started from the web UI, shared by every browser session.
+# At most JOB_MAX_RUNNING run at once (JOB_MAX_PER_USER of them per session), and the
+# rest queue, taking turns between sessions
+JOB_MAX_RUNNING = int(os.environ.get("JOB_MAX_RUNNING", "4"))
+JOB_MAX_PER_USER = int(os.environ.get("JOB_MAX_PER_USER", "1"))
+JOB_HISTORY_SIZE = int(os.environ.get("JOB_HISTORY_SIZE", "50"))
+# A web UI run that no page has checked on for this long is cancelled (0 to never cancel)
+JOB_ABANDON_SECONDS = float(os.environ.get("JOB_ABANDON_SECONDS", "60"))
+# Longest time a page showing a run's progress waits for a new event before redrawing its clock
+UI_REFRESH_SECONDS = float(os.environ.get("UI_REFRESH_SECONDS", "1"))
+
+# Model prices in USD per million prompt/completion tokens, as model=prompt/completion pairs,
+# used to put a cost on each run's token usage
+MODEL_PRICES = os.environ.get("MODEL_PRICES", "mistral-small=0.2/0.6,gpt-3.5-turbo=0.5/1.5")
+
+# Tracing - spans around agent calls, cache lookups, HTTP requests and JSON parsing,
+# written per run to TRACE_DIR as JSON lines and as a Chrome trace
+TRACE_ENABLED = os.environ.get("TRACE_ENABLED", "false").lower() == "true"
+TRACE_DIR = os.environ.get("TRACE_DIR", "traces")
+
+# Rate limits per provider (0 means no limit is applied client-side). Calls otherwise run as
+# fast as the quota allows, and 429 responses are retried with Retry-After or jittered backoff
+MISTRAL_REQUESTS_PER_MINUTE = float(os.environ.get("MISTRAL_REQUESTS_PER_MINUTE", "60"))
+MISTRAL_TOKENS_PER_MINUTE = float(os.environ.get("MISTRAL_TOKENS_PER_MINUTE", "500000"))
+OPENAI_REQUESTS_PER_MINUTE = float(os.environ.get("OPENAI_REQUESTS_PER_MINUTE", "500"))
+OPENAI_TOKENS_PER_MINUTE = float(os.environ.get("OPENAI_TOKENS_PER_MINUTE", "200000"))
+RATE_LIMIT_MAX_RETRIES = int(os.environ.get("RATE_LIMIT_MAX_RETRIES", "5"))
+RATE_LIMIT_BACKOFF_BASE = float(os.environ.get("RATE_LIMIT_BACKOFF_BASE", "1"))
+RATE_LIMIT_BACKOFF_MAX = float(os.environ.get("RATE_LIMIT_BACKOFF_MAX", "60"))
+
+# Replay provider - answers from a cassette of recorded calls, with synthetic latency and failures.
+# In "record" mode, calls missing from the cassette go to REPLAY_UPSTREAM and are added to it
+REPLAY_CASSETTE = os.environ.get("REPLAY_CASSETTE", os.path.join("cassettes", "default.jsonl"))
+REPLAY_MODE = os.environ.get("REPLAY_MODE", "replay")  # Options: "replay" or "record"
+REPLAY_UPSTREAM = os.environ.get("REPLAY_UPSTREAM", "mistral")
+REPLAY_LATENCY = float(os.environ.get("REPLAY_LATENCY", "0"))
+REPLAY_LATENCY_JITTER = float(os.environ.get("REPLAY_LATENCY_JITTER", "0"))
+REPLAY_FAILURE_RATE = float(os.environ.get("REPLAY_FAILURE_RATE", "0"))
+REPLAY_SEED = int(os.environ.get("REPLAY_SEED", "0"))
+
+def parse_size(value):
+    """Parse a size such as "512MB", "64KB" or "1048576" into bytes"""
+    value = str(value).strip().upper()
+    units = {"KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3, "B": 1}
+    for suffix, multiplier in units.items():
+        if value.endswith(suffix):
+            return int(float(value[:-len(suffix)]) * multiplier)
+    return int(value)
+
+def get_cache_stage_quotas():
+    """Get the per-stage cache quotas in bytes"""
+    quotas = {}
+    for item in CACHE_STAGE_QUOTAS.split(","):
+        if "=" in item:
+            stage, size = item.split("=", 1)
+            quotas[stage.strip()] = parse_size(size)
+    return quotas
+
+def get_model_prices():
+    """Get the USD price per million prompt and completion tokens of each model"""
+    prices = {}
+    for item in MODEL_PRICES.split(","):
+        if "=" in item and "/" in item:
+            model, price = item.split("=", 1)
+            prompt_price, completion_price = price.split("/", 1)
+            prices[model.strip()] = (float(prompt_price), float(completion_price))
+    return prices
+
+def get_rate_limits(provider):
+    """Get the requests per minute and tokens per minute of a provider"""
+    if provider.lower() == "replay":
+        return 0, 0
+    elif provider.lower() == "openai":
+        return OPENAI_REQUESTS_PER_MINUTE, OPENAI_TOKENS_PER_MINUTE
+    else:
+        return MISTRAL_REQUESTS_PER_MINUTE, MISTRAL_TOKENS_PER_MINUTE
 
 def get_provider():
     """Get the current AI provider"""
     return AI_PROVIDER
 
-def get_model():
-    """Get the appropriate model name based on the current provider"""
-    if AI_PROVIDER.lower() == "openai":
+def get_model_provider(provider=None):
+    """Get the provider whose models the current (or given) provider uses (a replay cassette uses REPLAY_UPSTREAM's)"""
+    provider = (provider or AI_PROVIDER).lower()
+    if provider == "replay":
+        return REPLAY_UPSTREAM.lower()
+    return provider
+
+def get_model(provider=None):
+    """Get the appropriate model name based on the current (or given) provider"""
+    if get_model_provider(provider) == "openai":
         return OPENAI_MODEL
     else:
         return MISTRAL_MODEL
 
-def get_api_key():
-    """Get the appropriate API key based on the current provider"""
-    if AI_PROVIDER.lower() == "openai":
+def get_api_key(provider=None):
+    """Get the appropriate API key based on the current (or given) provider"""
+    provider = (provider or AI_PROVIDER).lower()
+    if provider == "replay":
+        # Replaying needs no key; recording needs the upstream provider's
+        if REPLAY_MODE.lower() != "record":
+            return "replay"
+        return OPENAI_API_KEY if REPLAY_UPSTREAM.lower() == "openai" else MISTRAL_API_KEY
+    elif provider == "openai":
         return OPENAI_API_KEY
     else:
         return MISTRAL_API_KEY
 
 def set_provider(provider):
-    """Set the AI provider ('mistral' or 'openai')"""
+    """Set the process-wide default AI provider ('mistral', 'openai' or 'replay'). Runs already started keep their RunConfig"""
     global AI_PROVIDER
-    if provider.lower() in ["mistral", "openai"]:
+    if provider.lower() in PROVIDERS:
         AI_PROVIDER = provider.lower()
         os.environ["AI_PROVIDER"] = provider.lower()
     else:
-        raise ValueError("Provider must be either 'mistral' or 'openai'")
+        raise ValueError("Provider must be either 'mistral', 'openai' or 'replay'")
 
 def set_model(model):
-    """Set the model for the current provider"""
+    """Set the process-wide default model for the current provider. Runs already started keep their RunConfig"""
     global MISTRAL_MODEL, OPENAI_MODEL
-    if AI_PROVIDER.lower() == "openai":
+    if get_model_provider() == "openai":
         OPENAI_MODEL = model
         os.environ["OPENAI_MODEL"] = model
     else:
         MISTRAL_MODEL = model
         os.environ["MISTRAL_MODEL"] = model
         
-def get_model_options():
-    """Get available model options for the current provider"""
-    if AI_PROVIDER.lower() == "openai":
+def get_model_options(provider=None):
+    """Get available model options for the current (or given) provider"""
+    if get_model_provider(provider) == "openai":
         return {
             "gpt-3.5-turbo": "GPT-3.5 Turbo (Fastest ⚡)",
             "gpt-4-turbo": "GPT-4 Turbo (Balanced)",
@@ -74,13 +228,103 @@ def get_model_options():
             "mistral-large": "Mistral Large (Most Capable)"
         }
 
+class RunConfig:
+    """
+    The provider, model and API key of one research run. A RunConfig cannot be changed
+    once made, so runs with different settings can share one process without changing
+    each other's settings mid-run. The settings above are only the defaults of new runs.
+    """
+    
+    __slots__ = ("provider", "model", "api_key")
+    
+    def __init__(self, provider, model, api_key):
+        """
+        Initialise the run configuration.
+        
+        Args:
+            provider (str): The AI provider ("mistral", "openai" or "replay").
+            model (str): The model ID.
+            api_key (str): The API key for the provider.
+        """
+        if provider.lower() not in PROVIDERS:
+            raise ValueError("Provider must be either 'mistral', 'openai' or 'replay'")
+        object.__setattr__(self, "provider", provider.lower())
+        object.__setattr__(self, "model", model)
+        object.__setattr__(self, "api_key", api_key)
+    
+    @classmethod
+    def from_settings(cls, provider=None, model=None, api_key=None):
+        """
+        Make a run configuration from the process settings, overriding any of them.
+        
+        Args:
+            provider (str, optional): The AI provider (defaults to AI_PROVIDER).
+            model (str, optional): The model ID (defaults to the provider's configured model).
+            api_key (str, optional): The API key (defaults to the provider's configured key).
+        
+        Returns:
+            RunConfig: The run configuration.
+        """
+        provider = (provider or AI_PROVIDER).lower()
+        return cls(provider, model or get_model(provider), api_key or get_api_key(provider))
+    
+    def replace(self, **changes):
+        """Make a copy of the configuration with some settings changed."""
+        settings = {name: getattr(self, name) for name in self.__slots__}
+        settings.update(changes)
+        return RunConfig(**settings)
+    
+    def __setattr__(self, name, value):
+        raise AttributeError("A RunConfig cannot be changed; use replace() to make a changed copy")
+    
+    def __eq__(self, other):
+        return isinstance(other, RunConfig) and all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+    
+    def __hash__(self):
+        return hash((self.provider, self.model, self.api_key))
+    
+    def __repr__(self):
+        # The key is left out, so configurations can be logged
+        return f"RunConfig(provider={self.provider!r}, model={self.model!r})"
+
+# The RunConfig of the run the current thread or task belongs to. Like the trace context,
+# it follows asyncio tasks on its own and reaches worker threads through copy_context()
+_run_config = contextvars.ContextVar("run_config", default=None)
+
+def get_run_config():
+    """
+    Get the configuration of the current run.
+    
+    Returns:
+        RunConfig: The run's configuration, or one made from the process settings outside a run.
+    """
+    return _run_config.get() or RunConfig.from_settings()
+
+@contextlib.contextmanager
+def use_run_config(run_config):
+    """
+    Run the enclosed block (and every task it starts) with a run configuration.
+    
+    Args:
+        run_config (RunConfig): The configuration of the run.
+    """
+    token = _run_config.set(run_config)
+    try:
+        yield run_config
+    finally:
+        _run_config.reset(token)
+
 # Validate API key
-def validate_api_key():
-    """Validate that the appropriate API key is set"""
-    if AI_PROVIDER.lower() == "openai" and not OPENAI_API_KEY:
+def validate_api_key(provider=None):
+    """Validate that the appropriate API key is set for the current (or given) provider"""
+    provider = (provider or AI_PROVIDER).lower()
+    if provider == "replay" and not get_api_key(provider):
+        print(f"WARNING: Recording a replay cassette needs the {REPLAY_UPSTREAM.upper()} API key. Please add it to your .env file.")
+        return False
+    elif provider == "openai" and not OPENAI_API_KEY:
         print("WARNING: OPENAI_API_KEY is not set. Please add it to your .env file.")
         return False
-    elif AI_PROVIDER.lower() == "mistral" and not MISTRAL_API_KEY:
+    elif provider == "mistral" and not MISTRAL_API_KEY:
         print("WARNING: MISTRAL_API_KEY is not set. Please add it to your .env file.")
         return False
     return True
\ No newline at end of file
@@ -1,55 +1,261 @@
 import os
 import json #next steps - CLEAR IMPORTS THAT ARE NO LONGER IN USE
 import time
-from agents.task_manager import create_research_plan
-from agents.information_retrieval import retrieve_information
-from agents.analysis import analyse_information
-from agents.report_generator import generate_report
+import asyncio
+import argparse
+from config import ASYNC_PIPELINE, PROVIDERS, RUN_TIMEOUT_SECONDS, RunConfig, get_run_config, use_run_config
+from agents.task_manager import create_research_plan, create_research_plan_async
+from agents.information_retrieval import retrieve_information, retrieve_information_async
+from agents.analysis import analyse_information, analyse_information_async
+from agents.report_generator import generate_report, generate_report_async
+from utils.client_manager import get_async_client, client_stats
+from utils.caching import format_cache_stats
+from utils.cancellation import CancelToken, RunCancelled, use_cancel_token
+from utils.web_search import get_search_backend
+from utils.query_dedup import query_stats
+from utils.single_flight import completion_flight
+from utils.rate_limiter import rate_limiter_stats
+from utils.task_graph import TaskGraph
+from utils.worker_pool import worker_pool, format_pool_stats
+from utils.run_manifest import RunManifest, new_run_id
+from utils.tracing import tracer, span, trace_context, export_trace
+from utils.usage import usage_ledger, format_usage
 
-def run_research_assistant(research_question):
+def build_research_graph(research_question, subtasks, language_code='en', report_function=generate_report):
+    """
+    Build the task graph of a research run. Each subtask's analysis starts as soon as its
+    own retrieval finishes, and the report waits on every analysis. The plan's queries are
+    deduplicated, so each distinct query is searched once for every subtask that needs it.
+    When the search backend prefetches (the local index, or simulated search with
+    SEARCH_BATCH_SIZE > 1), every query is searched first, all at once; otherwise each
+    query is a task of its own, and a retrieval starts when its own queries are searched.
+    
+    Args:
+        research_question (str): The research question to investigate.
+        subtasks (list): The subtasks of the research plan.
+        language_code (str, optional): The language to write the report in.
+        report_function (callable, optional): Writes the report, with the same arguments as generate_report.
+    
+    Returns:
+        TaskGraph: The graph, ready to run. Its "report" task returns the report.
+    """
+    graph = TaskGraph()
+    
+    query_plan = query_stats.plan(subtasks)
+    backend = get_search_backend()
+    if backend.prefetch:
+        plan_search = graph.add("search", lambda: backend.search_many(query_plan.queries), stage="search")
+    else:
+        query_tasks = {
+            query: graph.add(f"search:{number}", lambda query=query: backend.search(query), stage="search")
+            for number, query in enumerate(query_plan.queries, 1)
+        }
+    
+    analysis_tasks = []
+    for subtask in subtasks:
+        queries = query_plan.queries_for(subtask)
+        
+        def retrieve(*results, subtask=subtask, queries=queries):
+            # The plan's search returns every query's results, a query's own task just its own
+            found = results[0] if backend.prefetch else dict(zip(queries, results))
+            return retrieve_information(subtask, query_plan.results_for(subtask, found))
+        
+        retrieval_task = graph.add(
+            f"retrieve:{subtask['id']}",
+            retrieve,
+            dependencies=[plan_search] if backend.prefetch else [query_tasks[query] for query in queries],
+            stage="retrieval",
+            trace={"subtask_id": subtask["id"]}
+        )
+        analysis_tasks.append(graph.add(
+            f"analyse:{subtask['id']}",
+            lambda information, subtask=subtask: analyse_information(subtask, information),
+            dependencies=[retrieval_task],
+            stage="analysis",
+            trace={"subtask_id": subtask["id"]}
+        ))
+    
+    graph.add(
+        "report",
+        lambda *analyses: report_function(research_question, list(analyses), subtasks, language_code),
+        dependencies=analysis_tasks,
+        stage="report"
+    )
+    
+    return graph
+
+def run_research(research_question, verbose=True, manifest=None, run_config=None, timeout=None, cancel_token=None):
+    """
+    Run the entire research assistant pipeline and keep the details of the run.
+    
+    Args:
+        research_question (str): The research question to investigate.
+        verbose (bool, optional): Whether to print progress (off when many runs share the console).
+        manifest (RunManifest, optional): The run's checkpoint. Every finished stage is saved to it,
+            and stages it already holds are skipped.
+        run_config (RunConfig, optional): The provider, model and API key of the run (defaults to the process settings).
+        timeout (float, optional): The run's time limit in seconds (defaults to RUN_TIMEOUT_SECONDS).
+        cancel_token (CancelToken, optional): Lets the caller cancel the run (one is made otherwise).
+    
+    Returns:
+        dict: The report, the subtasks and language of the plan, the provider and model, and the
+            timings and token usage of the run.
+    
+    Raises:
+        RunCancelled: If the run was cancelled, or RunTimedOut if it ran out of time. The stages
+            it finished are kept in the manifest, so the run can be resumed.
+    """
+    # Every span and model call of the run is tagged with its ID, so runs sharing a process can be told apart
+    run_id = manifest.run_id if manifest is not None else new_run_id()
+    
+    # The run's settings are fixed when it starts, and every task of the run uses them,
+    # whatever other runs (or changes to the process defaults) do in the meantime
+    run_config = run_config or get_run_config()
+    cancel_token = cancel_token or CancelToken(timeout if timeout is not None else RUN_TIMEOUT_SECONDS)
+    with use_run_config(run_config), use_cancel_token(cancel_token), trace_context(run_id=run_id):
+        with span("run_research", "run", question=research_question, provider=run_config.provider, model=run_config.model):
+            result = _run_research(research_question, verbose, manifest, run_id)
+    
+    result.update({"provider": run_config.provider, "model": run_config.model})
+    return result
+
+def _run_research(research_question, verbose, manifest, run_id):
+    """Run the pipeline for run_research, inside the run's trace context."""
+    def log(message):
+        if verbose:
+            print(message)
+    
+    started_at = time.perf_counter()
+    log(f"Starting research on: {research_question}")
+    
+    if manifest is not None:
+        if manifest.data.get("question", research_question) != research_question:
+            raise ValueError(f"Run {manifest.run_id} was started for a different question: {manifest.data['question']}")
+        if "question" not in manifest.data:
+            manifest.set("question", research_question)
+        if manifest.resumed:
+            log(f"Resuming run {manifest.run_id} ({len(manifest.resumed)} stages already finished)")
+    
+    # Step 1: Create my research plan
+    log("Step 1: Creating research plan...")
+    if manifest is not None and manifest.has("plan"):
+        research_plan = manifest.get("plan")
+    else:
+        research_plan = worker_pool.run("plan", create_research_plan, research_question)
+        if manifest is not None:
+            manifest.save("plan", research_plan)
+    subtasks = research_plan.get("subtasks", [])
+    language_code = research_plan.get("language", "en")
+    plan_seconds = time.perf_counter() - started_at
+    log(f"Research plan created with {len(subtasks)} subtasks")
+    
+    # Steps 2-4: Retrieve, analyse and report, each task starting as soon as its inputs are ready
+    log("Steps 2-4: Retrieving and analysing information, then generating the report...")
+    graph = build_research_graph(research_question, subtasks, language_code)
+    report = graph.run(on_complete=lambda name, result: log(f"  Finished {name}"), checkpoint=manifest)["report"]
+    log(graph.format_timings())
+    
+    usage = usage_ledger.summary(run_id)
+    log(format_usage(usage))
+    
+    log("Research completed!")
+    return {
+        "run_id": run_id,
+        "report": report,
+        "subtasks": subtasks,
+        "language": language_code,
+        "plan_seconds": plan_seconds,
+        "task_seconds": {name: timing["duration"] for name, timing in graph.timings.items()},
+        "resumed_tasks": list(graph.resumed),
+        "usage": usage,
+        "elapsed_seconds": time.perf_counter() - started_at
+    }
+
+def run_research_assistant(research_question, run_id=None, run_config=None, timeout=None):
     """
     Run the entire research assistant pipeline.
     
     Args:
         research_question (str): The research question to investigate.
+        run_id (str, optional): Checkpoint the run under this ID, resuming it if it was started before.
+        run_config (RunConfig, optional): The provider, model and API key of the run.
+        timeout (float, optional): The run's time limit in seconds (defaults to RUN_TIMEOUT_SECONDS).
         
     Returns:
         str: A research report answering the question.
     """
+    manifest = RunManifest(run_id) if run_id else None
+    return run_research(research_question, manifest=manifest, run_config=run_config, timeout=timeout)["report"]
+
+async def run_research_assistant_async(research_question, client=None, run_config=None, timeout=None):
+    """
+    Run the entire research assistant pipeline on a single event loop.
+    Every subtask is fanned out concurrently instead of one at a time.
+    
+    Args:
+        research_question (str): The research question to investigate.
+        client (AsyncAIClient, optional): A shared async client. Several concurrent
+            runs with the same configuration can share one client (and its connection pool).
+        run_config (RunConfig, optional): The provider, model and API key of the run,
+            when no client is passed in (a client carries its own).
+        timeout (float, optional): The run's time limit in seconds (defaults to RUN_TIMEOUT_SECONDS).
+    
+    Returns:
+        str: A research report answering the question.
+    """
+    # Own the client if one was not passed in
+    if client is None:
+        async with get_async_client(run_config) as own_client:
+            return await run_research_assistant_async(research_question, own_client, timeout=timeout)
+    
+    cancel_token = CancelToken(timeout if timeout is not None else RUN_TIMEOUT_SECONDS)
+    with use_run_config(client.run_config), use_cancel_token(cancel_token):
+        return await _run_research_async(research_question, client)
+
+async def _run_research_async(research_question, client):
+    """Run the pipeline for run_research_assistant_async, with the client's run configuration."""
     print(f"Starting research on: {research_question}")
     
     # Step 1: Create my research plan
     print("Step 1: Creating research plan...")
-    research_plan = create_research_plan(research_question)
+    research_plan = await create_research_plan_async(research_question, client)
     subtasks = research_plan.get("subtasks", [])
     print(f"Research plan created with {len(subtasks)} subtasks")
     
-    # Step 2: Retrieve information for each subtask
-    print("Step 2: Retrieving information...")
-    information_collection = []
-    for subtask in subtasks:
-        print(f"  Retrieving information for subtask: {subtask['id']}")
-        information = retrieve_information(subtask)
-        information_collection.append(information)
-        time.sleep(1)  # I use a teeny delay to avoid rate limits
-    
-    # Step 3: Analyse the information
-    print("Step 3: Analysing information...")
-    analyses = []
-    for i, subtask in enumerate(subtasks):
-        print(f"  Analysing information for subtask: {subtask['id']}")
-        analysis = analyse_information(subtask, information_collection[i])
-        analyses.append(analysis)
-        time.sleep(1)  
+    # Steps 2-3: Retrieve and analyse every subtask concurrently, each analysis
+    # starting as soon as its own retrieval finishes
+    print("Steps 2-3: Retrieving and analysing information...")
+    
+    # Each distinct query of the plan is searched once, however many subtasks need it
+    query_plan = query_stats.plan(subtasks)
+    backend = get_search_backend()
+    if backend.prefetch:
+        search_results = await backend.search_many_async(query_plan.queries, client)
+    else:
+        query_tasks = {query: asyncio.ensure_future(backend.search_async(query, client)) for query in query_plan.queries}
+    
+    async def research_subtask(subtask):
+        with trace_context(subtask_id=subtask["id"]):
+            if backend.prefetch:
+                found = search_results
+            else:
+                queries = query_plan.queries_for(subtask)
+                found = dict(zip(queries, await asyncio.gather(*(query_tasks[query] for query in queries))))
+            information = await retrieve_information_async(subtask, client, query_plan.results_for(subtask, found))
+            return await analyse_information_async(subtask, information, client)
+    
+    analyses = await asyncio.gather(*(research_subtask(subtask) for subtask in subtasks))
     
     # Step 4: Generate the final report
     print("Step 4: Generating final report...")
-    report = generate_report(research_question, analyses, subtasks)
+    report = await generate_report_async(
+        research_question, list(analyses), subtasks, client, research_plan.get("language", "en")
+    )
     
     print("Research completed!")
     return report
 
-def save_report(report, research_question, output_dir="./reports"):
+def save_report(report, research_question, output_dir="./reports", prefix=""):
     """
     Save the research report to a file.
     
@@ -57,6 +263,10 @@ def save_report(report, research_question, output_dir="./reports"):
         report (str): The research report.
         research_question (str): The research question.
         output_dir (str): The directory to save the report to.
+        prefix (str, optional): Prepended to the filename, to keep batch reports apart.
+    
+    Returns:
+        str: The path of the saved report.
     """
     # Create the output directory if it doesn't exist
     os.makedirs(output_dir, exist_ok=True)
@@ -64,30 +274,88 @@ def save_report(report, research_question, output_dir="./reports"):
     # Generate a filename based on the research question
     filename = research_question.lower().replace(" ", "_")[:50]
     filename = "".join(c for c in filename if c.isalnum() or c == "_")
-    filename = f"{filename}_{int(time.time())}.md"
+    filename = f"{prefix}{filename}_{int(time.time())}.md"
     
     # Save the report
     with open(os.path.join(output_dir, filename), "w", encoding="utf-8") as f:
         f.write(report)
     
     print(f"Report saved to {os.path.join(output_dir, filename)}")
+    return os.path.join(output_dir, filename)
+
+def print_call_stats():
+    """
+    Print the cache, coalescing, worker pool, client, query deduplication and rate limiting counters of this process.
+    """
+    # Print the cache counters so the memory tier can be sized
+    print(format_cache_stats())
+    flight_stats = completion_flight.stats()
+    print(f"Model calls: {flight_stats['calls']} made, {flight_stats['coalesced']} saved by coalescing identical requests")
+    # Runs and batch lines may use other providers than the default, so every limiter is reported
+    for provider, limiter_stats in rate_limiter_stats().items():
+        print(f"Rate limiting ({provider}): {limiter_stats['throttled']} throttled responses, {limiter_stats['waited_seconds']:.1f}s spent waiting for quota")
+    print(format_pool_stats(worker_pool.stats()))
+    clients = client_stats()
+    print(f"AI clients: {clients['created']} made, {clients['reused']} calls reused a cached client, {clients['cached']} cached now")
+    query_counts = query_stats.stats()
+    print(f"Search queries: {query_counts['queries']} in research plans, {query_counts['saved']} searches saved by deduplication")
+    usage = usage_ledger.summary()["total"]
+    print(
+        f"Tokens: {usage['prompt_tokens']} prompt + {usage['completion_tokens']} completion "
+        f"over {usage['calls']} calls ({usage['cached_calls']} more answered from the cache, {usage['coalesced_calls']} shared with an identical call), ${usage['cost_usd']:.4f}"
+    )
 
 def main():
     """
     Main entry point for the research assistant application.
     """
-    # Check for required API keys
-    from config import MISTRAL_API_KEY
+    from config import validate_api_key
+    
+    parser = argparse.ArgumentParser(description="Run the research assistant on one question.")
+    parser.add_argument("--run-id", help="Resume the checkpointed run with this ID, on the sync pipeline (a new ID is made otherwise)")
+    parser.add_argument("--trace", action="store_true", help="Write a timing trace of the run (also set by TRACE_ENABLED)")
+    parser.add_argument("--provider", choices=PROVIDERS, help="The AI provider of this run (defaults to AI_PROVIDER)")
+    parser.add_argument("--model", help="The model of this run (defaults to the provider's configured model)")
+    parser.add_argument("--timeout", type=float, help="Stop the run after this many seconds (defaults to RUN_TIMEOUT_SECONDS)")
+    args = parser.parse_args()
     
-    if not MISTRAL_API_KEY:
-        print("Error: MISTRAL_API_KEY environment variable is required.")
+    # Check for the provider's API key (the replay provider needs none)
+    if not validate_api_key(args.provider):
         return
+    run_config = RunConfig.from_settings(args.provider, args.model)
     
-    # Get the research question
-    research_question = input("Enter your research question: ")
+    if args.trace:
+        tracer.enabled = True
     
-    # Run the research assistant
-    report = run_research_assistant(research_question)
+    # Runs are checkpointed after every stage, so an interrupted run can be resumed by its ID
+    run_id = args.run_id or new_run_id()
+    manifest = RunManifest(run_id)
+    
+    # Get the research question (a resumed run already has one)
+    research_question = manifest.data.get("question") or input("Enter your research question: ")
+    
+    # Run the research assistant (on one event loop if the async pipeline is enabled). The async
+    # pipeline keeps no checkpoints, so a run being resumed by its ID runs on the sync pipeline
+    use_async = ASYNC_PIPELINE and not args.run_id
+    if ASYNC_PIPELINE and args.run_id:
+        print(f"Resuming run {run_id} with the sync pipeline (the async pipeline cannot resume runs)")
+    try:
+        if use_async:
+            with trace_context(run_id=run_id):
+                report = asyncio.run(run_research_assistant_async(research_question, run_config=run_config, timeout=args.timeout))
+            print(format_usage(usage_ledger.take(run_id)))
+        else:
+            print(f"Run ID: {run_id} (rerun with --run-id {run_id} to resume if interrupted)")
+            report = run_research(research_question, manifest=manifest, run_config=run_config, timeout=args.timeout)["report"]
+            # run_research has logged the run's usage; it stays in the process totals
+            usage_ledger.take(run_id)
+    except RunCancelled as e:
+        # The finished stages are checkpointed, so the run can carry on where it stopped
+        print(f"\n{e}")
+        if not use_async:
+            print(f"Rerun with --run-id {run_id} to resume it")
+        print(format_usage(usage_ledger.take(run_id)))
+        return
     
     # Save the report
     save_report(report, research_question)
@@ -96,6 +364,13 @@ def main():
     print("\n--- Report Preview ---\n")
     print(report[:500] + "...\n")
     print("--- End Preview ---\n")
+    
+    print_call_stats()
+    
+    if tracer.enabled:
+        trace_paths = export_trace(run_id)
+        if trace_paths:
+            print(f"Trace written to {trace_paths[0]} and {trace_paths[1]} (open the .trace.json in https://ui.perfetto.dev)")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -2,8 +2,7 @@ import streamlit as st
 import time
 import json
 import os
-import threading
-import queue
+import uuid
 from dotenv import load_dotenv
 
 # Load environment variables from .env file if it exists
@@ -18,8 +17,13 @@ st.set_page_config(
 )
 
 # Check for API keys first
-from config import MISTRAL_API_KEY, OPENAI_API_KEY, get_provider, set_provider, set_model, validate_api_key
+from config import (
+    MISTRAL_API_KEY, OPENAI_API_KEY, UI_REFRESH_SECONDS,
+    RunConfig, get_api_key, get_model_provider, get_provider, validate_api_key
+)
 from utils.language_detection import detect_language
+from utils.client_manager import invalidate_clients
+from utils.job_server import job_server
 
 # Initialise session state variables
 if "research_status" not in st.session_state:
@@ -30,6 +34,10 @@ if "research_message" not in st.session_state:
     st.session_state.research_message = ""
 if "research_report" not in st.session_state:
     st.session_state.research_report = ""
+if "partial_report" not in st.session_state:
+    st.session_state.partial_report = ""
+if "usage" not in st.session_state:
+    st.session_state.usage = None
 if "subtasks" not in st.session_state:
     st.session_state.subtasks = []
 if "mistral_api_key" not in st.session_state:
@@ -38,8 +46,12 @@ if "openai_api_key" not in st.session_state:
     st.session_state.openai_api_key = ""
 if "thread_error" not in st.session_state:
     st.session_state.thread_error = None
-if "update_queue" not in st.session_state:
-    st.session_state.update_queue = queue.Queue()
+if "user_id" not in st.session_state:
+    st.session_state.user_id = uuid.uuid4().hex
+if "job_id" not in st.session_state:
+    st.session_state.job_id = None
+if "event_cursor" not in st.session_state:
+    st.session_state.event_cursor = 0
 if "research_complete" not in st.session_state:
     st.session_state.research_complete = False
 if "start_time" not in st.session_state:
@@ -50,13 +62,19 @@ if "language_code" not in st.session_state:
     st.session_state.language_code = "en"
 if "ai_provider" not in st.session_state:
     st.session_state.ai_provider = get_provider()
+if "ai_model" not in st.session_state:
+    st.session_state.ai_model = None
 
 # Function to check if we have the necessary API key
 def check_api_key():
     """Check if the required API key is set based on the selected provider"""
     provider = st.session_state.ai_provider
     
-    if provider == "mistral":
+    if provider == "replay":
+        # Replaying needs no key; recording uses the upstream provider's key from .env
+        if not get_api_key("replay"):
+            return False
+    elif provider == "mistral":
         if not MISTRAL_API_KEY and not st.session_state.mistral_api_key:
             return False
     else:  # openai
@@ -66,150 +84,58 @@ def check_api_key():
 
 # Function to handle provider change
 def on_provider_change():
-    """Handle change in AI provider selection"""
-    set_provider(st.session_state.ai_provider)
-
-# This function will run in a separate thread and communicate via the queue
-def run_research_in_thread(research_question, mistral_api_key, openai_api_key, provider, update_queue):
-    """
-    Run the research process in a separate thread and communicate with the main thread via a queue.
-    """
-    try:
-        # Set API keys from session state if provided
-        if mistral_api_key:
-            os.environ["MISTRAL_API_KEY"] = mistral_api_key
-        if openai_api_key:
-            os.environ["OPENAI_API_KEY"] = openai_api_key
-        
-        # Set the provider
-        set_provider(provider)
-        
-        # Detect language of the research question
-        language_code = detect_language(research_question)
-        update_queue.put({"language_code": language_code})
-        
-        # Send status update
-        update_queue.put({"status": "running", "message": "Creating research plan...", "progress": 10})
-        
-        # Import here to avoid circular imports
-        from agents.task_manager import create_research_plan
-        
-        # Step 1: Create a research plan
-        research_plan = create_research_plan(research_question)
-        subtasks = research_plan.get("subtasks", [])
-        
-        # Store the language code from the research plan
-        language_code = research_plan.get("language", "en")
-        update_queue.put({"language_code": language_code})
-        
-        # Send plan update
-        update_queue.put({
-            "status": "running", 
-            "message": f"Research plan created with {len(subtasks)} subtasks", 
-            "progress": 20,
-            "subtasks": subtasks
-        })
-        
-        # Step 2: Retrieve information for each subtask
-        from agents.information_retrieval import retrieve_information
-        
-        information_collection = []
-        for i, subtask in enumerate(subtasks):
-            update_queue.put({
-                "status": "running",
-                "message": f"Retrieving information for subtask {i+1}/{len(subtasks)}: {subtask['description']}",
-                "progress": 20 + int((i + 1) * 40 / len(subtasks))
-            })
-            
-            information = retrieve_information(subtask)
-            information_collection.append(information)
-        
-        # Step 3: Analyse the information
-        from agents.analysis import analyse_information
-        
-        analyses = []
-        for i, subtask in enumerate(subtasks):
-            update_queue.put({
-                "status": "running",
-                "message": f"Analyzing information for subtask {i+1}/{len(subtasks)}: {subtask['description']}",
-                "progress": 60 + int((i + 1) * 30 / len(subtasks))
-            })
-            
-            analysis = analyse_information(subtask, information_collection[i])
-            analyses.append(analysis)
-        
-        # Step 4: Generate the final report
-        from agents.report_generator import generate_report
-        
-        update_queue.put({"status": "running", "message": "Generating final report...", "progress": 90})
-        
-        report = generate_report(research_question, analyses, subtasks, language_code)
-        
-        # Save the report to a file
-        output_dir = "./reports"
-        os.makedirs(output_dir, exist_ok=True)
-        
-        # Generate a filename based on the research question
-        filename = research_question.lower().replace(" ", "_")[:50]
-        filename = "".join(c for c in filename if c.isalnum() or c == "_")
-        filename = f"{filename}_{int(time.time())}.md"
-        
-        # Save the report
-        with open(os.path.join(output_dir, filename), "w", encoding="utf-8") as f:
-            f.write(report)
-        
-        # Send completion update
-        update_queue.put({
-            "status": "completed",
-            "message": "Research completed successfully!",
-            "progress": 100,
-            "report": report
-        })
-        
-    except Exception as e:
-        # Send error update
-        update_queue.put({
-            "status": "error",
-            "message": f"Error: {str(e)}",
-            "progress": 0
-        })
+    """Handle change in AI provider selection (the session's model is chosen again for the new provider)"""
+    st.session_state.ai_model = None
 
 def start_research(research_question):
-    """Start a new research process"""
-    # Get the API keys to pass to the thread
-    mistral_api_key = st.session_state.mistral_api_key if st.session_state.mistral_api_key else MISTRAL_API_KEY
-    openai_api_key = st.session_state.openai_api_key if st.session_state.openai_api_key else OPENAI_API_KEY
+    """Submit a research job to the shared job server, which runs it when this session's turn comes"""
+    # The session's settings are fixed for the run, and passed to the job rather than set process-wide
     provider = st.session_state.ai_provider
+    if provider == "replay":
+        # The replay provider takes its key (if recording needs one) from the settings
+        api_key = None
+    elif provider == "mistral":
+        api_key = st.session_state.mistral_api_key or MISTRAL_API_KEY
+    else:
+        api_key = st.session_state.openai_api_key or OPENAI_API_KEY
+    run_config = RunConfig.from_settings(provider, st.session_state.ai_model, api_key)
     
     # Reset state
     st.session_state.research_status = "starting"
     st.session_state.research_progress = 0
     st.session_state.research_message = "Initialising research..."
     st.session_state.research_report = ""
+    st.session_state.partial_report = ""
+    st.session_state.usage = None
     st.session_state.subtasks = []
     st.session_state.thread_error = None
-    st.session_state.update_queue = queue.Queue()
     st.session_state.research_complete = False
     st.session_state.start_time = time.time()
     st.session_state.elapsed_time = 0
     st.session_state.language_code = detect_language(research_question)
     
-    # Create and start the thread
-    thread = threading.Thread(
-        target=run_research_in_thread,
-        args=(research_question, mistral_api_key, openai_api_key, provider, st.session_state.update_queue),
-        daemon=True
-    )
-    thread.start()
+    # A run the session started before is no longer watched, so it is cancelled (unless another session shares it)
+    if st.session_state.job_id:
+        job_server.cancel(st.session_state.job_id, st.session_state.user_id)
+    
+    # The session only keeps the job's ID and how far through its events it has read
+    job = job_server.submit(research_question, user=st.session_state.user_id, run_config=run_config)
+    st.session_state.job_id = job.job_id
+    st.session_state.event_cursor = 0
 
-# Process updates from the queue
+# Process progress events from the job server
 def process_updates():
-    """Process updates from the queue and update session state"""
+    """Read the new progress events of this session's job and update session state"""
     try:
-        while not st.session_state.update_queue.empty():
-            update = st.session_state.update_queue.get_nowait()
-            
-            # Update session state based on the update from the thread
+        job = job_server.get(st.session_state.job_id)
+        if job is None:
+            st.session_state.research_status = "error"
+            st.session_state.research_message = "Error: the research job is no longer available"
+            return
+        
+        updates, st.session_state.event_cursor = job.updates(st.session_state.event_cursor, timeout=0)
+        for update in updates:
+            # Update session state based on the event from the job
             if "status" in update:
                 st.session_state.research_status = update["status"]
             
@@ -222,6 +148,12 @@ def process_updates():
             if "subtasks" in update:
                 st.session_state.subtasks = update["subtasks"]
             
+            if "partial_report" in update:
+                st.session_state.partial_report = update["partial_report"]
+            
+            if "usage" in update:
+                st.session_state.usage = update["usage"]
+            
             if "report" in update:
                 st.session_state.research_report = update["report"]
                 st.session_state.research_complete = True
@@ -233,7 +165,7 @@ def process_updates():
         st.session_state.thread_error = str(e)
     
     # Update elapsed time if research is ongoing
-    if st.session_state.start_time and st.session_state.research_status in ["starting", "running"]:
+    if st.session_state.start_time and st.session_state.research_status in ["starting", "queued", "running"]:
         st.session_state.elapsed_time = time.time() - st.session_state.start_time
 
 # Format elapsed time as mm:ss
@@ -286,6 +218,11 @@ def get_ui_text(key, language_code='en'):
             'es': "OpenAI",
             'fr': "OpenAI"
         },
+        'replay': {
+            'en': "Replay (recorded responses)",
+            'es': "Reproducción (respuestas grabadas)",
+            'fr': "Relecture (réponses enregistrées)"
+        },
         'mistral_api_key': {
             'en': "Mistral API Key:",
             'es': "Clave API de Mistral:",
@@ -426,6 +363,31 @@ def get_ui_text(key, language_code='en'):
             'es': "Consultas de búsqueda",
             'fr': "Requêtes de recherche"
         },
+        'usage_header': {
+            'en': "Token Usage",
+            'es': "Uso de tokens",
+            'fr': "Utilisation des jetons"
+        },
+        'usage_tokens': {
+            'en': "Tokens",
+            'es': "Tokens",
+            'fr': "Jetons"
+        },
+        'usage_cost': {
+            'en': "Estimated cost",
+            'es': "Coste estimado",
+            'fr': "Coût estimé"
+        },
+        'usage_detail': {
+            'en': "{calls} calls ({cached} from the cache, {shared} shared): {prompt} prompt + {completion} completion tokens",
+            'es': "{calls} llamadas ({cached} desde la caché, {shared} compartidas): {prompt} tokens de entrada + {completion} de salida",
+            'fr': "{calls} appels ({cached} depuis le cache, {shared} partagés) : {prompt} jetons d'entrée + {completion} de sortie"
+        },
+        'report_in_progress': {
+            'en': "Report (being written)",
+            'es': "Informe (en redacción)",
+            'fr': "Rapport (en cours de rédaction)"
+        },
         'completed': {
             'en': "Research completed in",
             'es': "Investigación completada en",
@@ -446,6 +408,11 @@ def get_ui_text(key, language_code='en'):
             'es': "Descargar informe como Markdown",
             'fr': "Télécharger le rapport au format Markdown"
         },
+        'cancel_research': {
+            'en': "Cancel",
+            'es': "Cancelar",
+            'fr': "Annuler"
+        },
         'try_again': {
             'en': "Try Again",
             'es': "Intentar de nuevo",
@@ -485,7 +452,8 @@ with st.sidebar:
     # Provider selection
     provider_options = {
         "mistral": get_ui_text('mistral', language_code),
-        "openai": get_ui_text('openai', language_code)
+        "openai": get_ui_text('openai', language_code),
+        "replay": get_ui_text('replay', language_code)
     }
     
     st.selectbox(
@@ -496,14 +464,24 @@ with st.sidebar:
         on_change=on_provider_change
     )
     
-    # API Key inputs based on provider
+    # API Key inputs based on provider (replay needs none: it replays recorded responses)
     if st.session_state.ai_provider == "mistral":
         if not MISTRAL_API_KEY:
-            st.session_state.mistral_api_key = st.text_input(get_ui_text('mistral_api_key', language_code), type="password", value=st.session_state.mistral_api_key)
-            if st.session_state.mistral_api_key:
-                os.environ["MISTRAL_API_KEY"] = st.session_state.mistral_api_key
-        
-        # Mistral Model selection
+            previous_key = st.session_state.mistral_api_key
+            st.session_state.mistral_api_key = st.text_input(get_ui_text('mistral_api_key', language_code), type="password", value=previous_key)
+            # A replaced key may have been revoked, so its cached clients are dropped
+            if previous_key and st.session_state.mistral_api_key != previous_key:
+                invalidate_clients("mistral", previous_key)
+    elif st.session_state.ai_provider == "openai":
+        if not OPENAI_API_KEY:
+            previous_key = st.session_state.openai_api_key
+            st.session_state.openai_api_key = st.text_input(get_ui_text('openai_api_key', language_code), type="password", value=previous_key)
+            # A replaced key may have been revoked, so its cached clients are dropped
+            if previous_key and st.session_state.openai_api_key != previous_key:
+                invalidate_clients("openai", previous_key)
+    
+    # Model selection (replay offers the models of the provider it recorded, REPLAY_UPSTREAM)
+    if get_model_provider(st.session_state.ai_provider) == "mistral":
         mistral_model_options = {
             "mistral-small-latest": get_ui_text('mistral_fastest', language_code),
             "mistral-medium-latest": get_ui_text('mistral_balanced', language_code),
@@ -516,16 +494,7 @@ with st.sidebar:
             index=0,  # Default to small/fastest
             format_func=lambda x: mistral_model_options[x]
         )
-        
-        # Set the selected model in the environment
-        set_model(selected_model)
     else:  # OpenAI
-        if not OPENAI_API_KEY:
-            st.session_state.openai_api_key = st.text_input(get_ui_text('openai_api_key', language_code), type="password", value=st.session_state.openai_api_key)
-            if st.session_state.openai_api_key:
-                os.environ["OPENAI_API_KEY"] = st.session_state.openai_api_key
-        
-        # OpenAI Model selection
         openai_model_options = {
             "gpt-3.5-turbo": get_ui_text('openai_turbo', language_code),
             "gpt-4-turbo": get_ui_text('openai_4turbo', language_code),
@@ -538,9 +507,9 @@ with st.sidebar:
             index=0,  # Default to 3.5 Turbo
             format_func=lambda x: openai_model_options[x]
         )
-        
-        # Set the selected model in the environment
-        set_model(selected_model)
+    
+    # The model is kept in the session, and used for this session's runs only
+    st.session_state.ai_model = selected_model
     
     # Cache control
     st.subheader(get_ui_text('perf_header', language_code))
@@ -548,11 +517,28 @@ with st.sidebar:
     use_cache = st.checkbox(get_ui_text('use_cache', language_code), value=True, help=get_ui_text('cache_help', language_code))
     if not use_cache:
         if st.button(get_ui_text('clear_cache', language_code)):
-            import shutil
-            if os.path.exists("cache"):
-                shutil.rmtree("cache")
-                os.makedirs("cache")
-                st.success(get_ui_text('cache_cleared', language_code))
+            from utils.caching import clear_cache
+            clear_cache()
+            st.success(get_ui_text('cache_cleared', language_code))
+    
+    # Token usage and cost of the last run (the progress panel shows the running total of the current one)
+    if st.session_state.usage:
+        st.subheader(get_ui_text('usage_header', language_code))
+        total = st.session_state.usage["total"]
+        st.metric(get_ui_text('usage_tokens', language_code), f"{total['total_tokens']:,}")
+        st.metric(get_ui_text('usage_cost', language_code), f"${total['cost_usd']:.4f}")
+        st.caption(get_ui_text('usage_detail', language_code).format(
+            calls=total["calls"] + total["cached_calls"] + total["coalesced_calls"],
+            cached=total["cached_calls"],
+            shared=total["coalesced_calls"],
+            prompt=f"{total['prompt_tokens']:,}",
+            completion=f"{total['completion_tokens']:,}"
+        ))
+        st.dataframe(
+            [{"stage": stage, "tokens": totals["total_tokens"], "cost": f"${totals['cost_usd']:.4f}"}
+             for stage, totals in st.session_state.usage["by_stage"].items()],
+            hide_index=True
+        )
     
     # Button to clear results
     if st.button(get_ui_text('clear_results', language_code)):
@@ -560,6 +546,8 @@ with st.sidebar:
         st.session_state.research_progress = 0
         st.session_state.research_message = ""
         st.session_state.research_report = ""
+        st.session_state.partial_report = ""
+        st.session_state.usage = None
         st.session_state.subtasks = []
         st.session_state.research_complete = False
         st.session_state.start_time = None
@@ -590,14 +578,18 @@ with st.form("research_form"):
         else:
             start_research(research_question)
 
-# Process any updates from the queue
-if st.session_state.research_status in ["starting", "running"]:
+# Progress tracking. Only this fragment reruns while the research runs, and only when the
+# job publishes something new (or the clock is due), instead of the whole page every half second
+@st.fragment
+def show_progress(page_language_code):
+    """Show the progress of this session's job, redrawing itself as the job publishes events"""
     process_updates()
-    # Update language code based on detected language
     language_code = st.session_state.language_code
-
-# Progress tracking
-if st.session_state.research_status in ["starting", "running"]:
+    
+    # The results (or the error), and a page in a newly detected language, are drawn by the whole page
+    if st.session_state.research_status not in ["starting", "queued", "running"] or language_code != page_language_code:
+        st.rerun()
+    
     st.subheader(get_ui_text('progress_title', language_code))
     
     # Show both progress bar and elapsed time
@@ -612,6 +604,18 @@ if st.session_state.research_status in ["starting", "running"]:
         status_container = st.empty()
         status_container.info(st.session_state.research_message)
     
+    # Stop the run, and its model calls, if it is no longer wanted (a run shared with other sessions carries on for them)
+    if st.button(get_ui_text('cancel_research', language_code)):
+        job_server.cancel(st.session_state.job_id, st.session_state.user_id)
+        st.session_state.research_status = "cancelled"
+        st.session_state.research_message = "Research cancelled"
+        st.rerun()
+    
+    # The sidebar is only redrawn with the page, so the running total is shown here
+    if st.session_state.usage:
+        total = st.session_state.usage["total"]
+        st.caption(f"{get_ui_text('usage_tokens', language_code)}: {total['total_tokens']:,} · {get_ui_text('usage_cost', language_code)}: ${total['cost_usd']:.4f}")
+    
     # If we have subtasks, display them
     if st.session_state.subtasks:
         with st.expander(get_ui_text('research_plan', language_code), expanded=True):
@@ -622,10 +626,19 @@ if st.session_state.research_status in ["starting", "running"]:
                     st.markdown(f"**{get_ui_text('subtask', language_code)} {i+1}:** {subtask['description']}")
                 st.markdown(f"{get_ui_text('search_queries', language_code)}: " + ", ".join([f"`{q}`" for q in subtask['search_queries']]))
     
-    # Auto-refresh the page to update status
-    if not st.session_state.research_complete:
-        time.sleep(0.5)  # Shorter refresh time for more responsive UI
-        st.rerun()
+    # Show the report as it streams in
+    if st.session_state.partial_report:
+        st.subheader(get_ui_text('report_in_progress', language_code))
+        st.markdown(st.session_state.partial_report)
+    
+    # Long-poll the job: wait until it publishes an event (or the clock needs redrawing), then redraw this fragment
+    job = job_server.get(st.session_state.job_id)
+    if job is not None:
+        job.wait_for_update(st.session_state.event_cursor, timeout=UI_REFRESH_SECONDS)
+    st.rerun(scope="fragment")
+
+if st.session_state.research_status in ["starting", "queued", "running"]:
+    show_progress(language_code)
 
 # Display results if completed
 if st.session_state.research_status == "completed":
@@ -653,6 +666,10 @@ if st.session_state.research_status == "completed":
                     for query in subtask['search_queries']:
                         st.markdown(f"- {query}")
 
+# Display why the research stopped if it was cancelled or ran out of time
+if st.session_state.research_status == "cancelled":
+    st.warning(st.session_state.research_message)
+
 # Display error if there was one
 if st.session_state.research_status == "error":
     st.error(st.session_state.research_message)
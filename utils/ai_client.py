@@ -1,36 +1,144 @@
 import os
-import requests
 import json
-from config import get_provider, get_api_key
+import asyncio
+import weakref
+import httpx
+from config import (
+    get_run_config, MISTRAL_BASE_URL, OPENAI_BASE_URL,
+    MISTRAL_POOL_SIZE, OPENAI_POOL_SIZE, HTTP_TIMEOUT, ASYNC_MAX_CONNECTIONS
+)
+from utils.cancellation import RunCancelled, check_cancelled, cancellable_sleep, cancellable_sleep_async, request_timeout
+from utils.http_transport import get_transport
+from utils.rate_limiter import get_rate_limiter, estimate_tokens, parse_retry_after, RETRYABLE_STATUS_CODES
+from utils.replay import get_replay_backend
+from utils.tracing import span
+
+def build_chat_request(provider, api_key, model, messages, temperature=0.7, max_tokens=None, stream=False):
+    """
+    Build the headers and payload of a chat completion request.
+    
+    Args:
+        provider (str): The AI provider ("mistral" or "openai").
+        api_key (str): The API key for the provider.
+        model (str): The model ID to use.
+        messages (list): A list of message objects.
+        temperature (float, optional): The temperature for sampling. Default is 0.7.
+        max_tokens (int, optional): The maximum number of tokens to generate.
+        stream (bool, optional): Whether to ask for the completion as server-sent events.
+    
+    Returns:
+        tuple: The request headers and JSON payload.
+    """
+    headers = {
+        "Content-Type": "application/json"
+    }
+    
+    # Set up provider-specific headers and payload
+    if provider == "mistral":
+        headers["Authorization"] = f"Bearer {api_key}"
+        payload = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature
+        }
+        if max_tokens:
+            payload["max_tokens"] = max_tokens
+    else:  # OpenAI
+        headers["Authorization"] = f"Bearer {api_key}"
+        payload = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature
+        }
+        if max_tokens:
+            payload["max_tokens"] = max_tokens
+    
+    # Both providers stream OpenAI-style "data:" events ending with "data: [DONE]"
+    if stream:
+        payload["stream"] = True
+        # Mistral always ends a stream with the usage block; OpenAI only sends it when asked
+        if provider == "openai":
+            payload["stream_options"] = {"include_usage": True}
+    
+    return headers, payload
+
+def parse_stream_line(line):
+    """
+    Parse one line of a server-sent event stream.
+    
+    Args:
+        line (str or bytes): The line, without its trailing newline.
+    
+    Returns:
+        dict: The event's JSON data, None for lines that carry no data, or STREAM_DONE at the end of the stream.
+    """
+    if isinstance(line, bytes):
+        line = line.decode("utf-8")
+    if not line.startswith("data:"):
+        return None
+    
+    data = line[len("data:"):].strip()
+    if data == "[DONE]":
+        return STREAM_DONE
+    return json.loads(data)
+
+# Returned by parse_stream_line for the final "data: [DONE]" event
+STREAM_DONE = object()
+
+def stream_usage(messages, usage, content):
+    """
+    Get the tokens a streamed call used, for settling its quota reservation.
+    
+    Args:
+        messages (list): The messages of the call.
+        usage (dict): The usage the provider reported, or None (e.g. for a stream stopped part way).
+        content (str): The content received.
+    
+    Returns:
+        int: The reported total tokens, or an estimate of the prompt and the content received so far.
+    """
+    if usage and usage.get("total_tokens") is not None:
+        return usage["total_tokens"]
+    return estimate_tokens(messages) + len(content) // 4
+
 
 class AIClient:
     """
-    A unified client for multiple AI providers (Mistral and OpenAI).
+    A unified client for multiple AI providers (Mistral and OpenAI, or a replay cassette).
+    Clients are shared between threads and runs by utils.client_manager, so a client
+    never changes its configuration once made.
     """
     
-    def __init__(self):
-        """Initialise the AI client."""
-        self.provider = get_provider()
-        self.api_key = get_api_key()
+    def __init__(self, run_config=None):
+        """
+        Initialise the AI client.
+        
+        Args:
+            run_config (RunConfig, optional): The provider and API key to call with (defaults to the current run's).
+        """
+        self.run_config = run_config or get_run_config()
+        self.provider = self.run_config.provider
+        self.api_key = self.run_config.api_key
         
         if not self.api_key:
             raise ValueError(f"{self.provider.upper()} API key is not set. Please add it to your .env file.")
         
         # Configure base URLs
         self.base_urls = {
-            "mistral": "https://api.mistral.ai/v1",
-            "openai": "https://api.openai.com/v1"
+            "mistral": MISTRAL_BASE_URL,
+            "openai": OPENAI_BASE_URL
         }
         
-        self.chat = ChatCompletions(self)
-    
-    def update_configuration(self):
-        """Update configuration (useful when provider changes)."""
-        self.provider = get_provider()
-        self.api_key = get_api_key()
+        # Configure connection pool sizes per base URL
+        self.pool_sizes = {
+            "mistral": MISTRAL_POOL_SIZE,
+            "openai": OPENAI_POOL_SIZE
+        }
         
-        if not self.api_key:
-            raise ValueError(f"{self.provider.upper()} API key is not set. Please add it to your .env file.")
+        # Shared pooled transport, so connections are reused across clients and calls
+        self.transport = get_transport()
+        
+        self.chat = ChatCompletions(self)
 
 
 class ChatCompletions:
@@ -47,7 +155,7 @@ class ChatCompletions:
         """
         self.client = client
     
-    def create(self, model, messages, temperature=0.7, max_tokens=None):
+    def create(self, model, messages, temperature=0.7, max_tokens=None, stream=False):
         """
         Create a chat completion with the current provider's API.
         
@@ -56,55 +164,326 @@ class ChatCompletions:
             messages (list): A list of message objects.
             temperature (float, optional): The temperature for sampling. Default is 0.7.
             max_tokens (int, optional): The maximum number of tokens to generate.
+            stream (bool, optional): Whether to stream the completion as it is generated.
             
         Returns:
-            ChatResponse: A standardised response object.
+            ChatResponse: A standardised response object, or a ChatStream of content deltas if streaming.
         """
-        # Ensure we have current configuration
-        self.client.update_configuration()
+        # The client keeps the configuration it was made with, so a change of the process
+        # defaults (or another run's settings) cannot switch its provider mid-run
         provider = self.client.provider
         
-        headers = {
-            "Content-Type": "application/json"
-        }
+        # The replay provider answers from a cassette file (recording from a real provider if asked)
+        if provider == "replay":
+            return get_replay_backend().create(self, model, messages, temperature, max_tokens, stream)
         
-        # Set up provider-specific headers and payload
-        if provider == "mistral":
-            headers["Authorization"] = f"Bearer {self.client.api_key}"
-            payload = {
-                "model": model,
-                "messages": messages,
-                "temperature": temperature
-            }
-            if max_tokens:
-                payload["max_tokens"] = max_tokens
-        else:  # OpenAI
-            headers["Authorization"] = f"Bearer {self.client.api_key}"
-            payload = {
-                "model": model,
-                "messages": messages,
-                "temperature": temperature
-            }
-            if max_tokens:
-                payload["max_tokens"] = max_tokens
-        
-        # Make the API request
-        response = requests.post(
-            f"{self.client.base_urls[provider]}/chat/completions",
-            headers=headers,
-            data=json.dumps(payload)
-        )
+        return self.request(provider, self.client.api_key, model, messages, temperature, max_tokens, stream)
+    
+    def request(self, provider, api_key, model, messages, temperature=0.7, max_tokens=None, stream=False):
+        """
+        Make a chat completion request to a provider's API.
+        
+        Args:
+            provider (str): The AI provider ("mistral" or "openai").
+            api_key (str): The API key for the provider.
+            model (str): The model ID to use.
+            messages (list): A list of message objects.
+            temperature (float, optional): The temperature for sampling. Default is 0.7.
+            max_tokens (int, optional): The maximum number of tokens to generate.
+            stream (bool, optional): Whether to stream the completion as it is generated.
+        
+        Returns:
+            ChatResponse: A standardised response object, or a ChatStream of content deltas if streaming.
+        """
+        headers, payload = build_chat_request(provider, api_key, model, messages, temperature, max_tokens, stream)
+        
+        # The provider's shared limiter paces calls to its quota and decides how to back off
+        limiter = get_rate_limiter(provider)
+        estimated_tokens = estimate_tokens(messages, max_tokens)
+        
+        for attempt in range(limiter.max_retries + 1):
+            # A cancelled run (or one out of time) makes no more requests, and hands back the quota it reserved
+            check_cancelled()
+            try:
+                limiter.acquire(estimated_tokens)
+            except RunCancelled:
+                limiter.record_usage(estimated_tokens, 0)
+                raise
+            
+            # Make the API request over a pooled keep-alive connection, giving up when the run's time is up
+            with span("http.post", "http", provider=provider, attempt=attempt, stream=stream) as request_span:
+                try:
+                    response = self.client.transport.post_json(
+                        self.client.base_urls[provider],
+                        "/chat/completions",
+                        payload,
+                        headers,
+                        pool_size=self.client.pool_sizes[provider],
+                        stream=stream,
+                        timeout=request_timeout(self.client.transport.timeout)
+                    )
+                except Exception:
+                    # A request cut short by the run's deadline reports the deadline, not the timeout
+                    check_cancelled()
+                    raise
+                request_span.set(status=response.status_code)
+            
+            if response.status_code not in RETRYABLE_STATUS_CODES or attempt == limiter.max_retries:
+                break
+            
+            # A throttled call used no tokens; wait as long as the provider asks, or back off
+            limiter.record_usage(estimated_tokens, 0)
+            response.close()
+            cancellable_sleep(limiter.backoff(attempt, parse_retry_after(response.headers.get("Retry-After"))))
         
         if response.status_code != 200:
             raise Exception(f"Error from {provider.upper()} API: {response.status_code} - {response.text}")
         
+        if stream:
+            # The connection goes back to the pool once the stream has been read (or closed)
+            return ChatStream(
+                response.iter_lines(),
+                provider,
+                release=response.close,
+                on_complete=lambda usage, content: limiter.record_usage(estimated_tokens, stream_usage(messages, usage, content))
+            )
+        
         # Parse the response
         response_data = response.json()
+        limiter.record_usage(estimated_tokens, (response_data.get("usage") or {}).get("total_tokens"))
         
         # Create a standardised response object
         return ChatResponse(response_data, provider)
 
 
+class ChatStream:
+    """
+    The content deltas of a streamed chat completion. Iterating yields each piece of
+    content as it arrives; once the stream is exhausted, response holds the assembled
+    ChatResponse. A stream that is not read to the end should be closed, which releases
+    its connection and settles its quota with the content received so far.
+    """
+    
+    def __init__(self, lines, provider, release=None, on_complete=None):
+        """
+        Initialise the stream.
+        
+        Args:
+            lines (iterable): The lines of the server-sent event stream.
+            provider (str): The AI provider ("mistral" or "openai").
+            release (callable, optional): Releases the underlying connection.
+            on_complete (callable, optional): Called once the stream ends or is closed, with the
+                reported usage (or None) and the content received.
+        """
+        self.lines = lines
+        self.provider = provider
+        self.release = release
+        self.on_complete = on_complete
+        self.response = None
+        self._parts = []
+        self._reader = None
+        self._finished = False
+    
+    def __iter__(self):
+        # Only a weak reference, so a reader the caller drops part way is closed (and settled) straight away
+        reader = self._read()
+        self._reader = weakref.ref(reader)
+        return reader
+    
+    def _read(self):
+        response_data = {"choices": []}
+        finish_reason = None
+        usage = None
+        
+        try:
+            for line in self.lines:
+                # A cancelled run stops reading, which closes the connection
+                check_cancelled()
+                event = parse_stream_line(line)
+                # Read on past [DONE] to the end of the body, so the connection can be reused
+                if event is None or event is STREAM_DONE:
+                    continue
+                
+                # The first event carries the completion's metadata
+                for field in ("id", "created", "model"):
+                    if field in event and field not in response_data:
+                        response_data[field] = event[field]
+                if event.get("usage"):
+                    usage = event["usage"]
+                
+                for choice in event.get("choices", []):
+                    if choice.get("finish_reason"):
+                        finish_reason = choice["finish_reason"]
+                    content = (choice.get("delta") or {}).get("content")
+                    if content:
+                        self._parts.append(content)
+                        yield content
+            
+            response_data["choices"] = [
+                {"message": {"role": "assistant", "content": "".join(self._parts)}, "finish_reason": finish_reason}
+            ]
+            response_data["usage"] = usage
+            self.response = ChatResponse(response_data, self.provider)
+        finally:
+            # Runs when the stream is exhausted, and when the reader is closed or fails part way
+            self._finish(usage)
+    
+    def close(self):
+        """Stop reading the stream, releasing its connection and settling its quota."""
+        reader = self._reader() if self._reader is not None else None
+        if reader is not None:
+            reader.close()
+        self._finish(None)
+    
+    def _finish(self, usage):
+        # Only the first end counts, whether the stream was exhausted, stopped or closed
+        if self._finished:
+            return
+        self._finished = True
+        
+        if self.release is not None:
+            self.release()
+        if self.on_complete is not None:
+            self.on_complete(usage, "".join(self._parts))
+
+
+class AsyncAIClient:
+    """
+    An asyncio client for multiple AI providers (Mistral and OpenAI).
+    Many requests can be in flight at once on a single event loop.
+    """
+    
+    def __init__(self, run_config=None, max_connections=ASYNC_MAX_CONNECTIONS):
+        """
+        Initialise the async AI client.
+        
+        Args:
+            run_config (RunConfig, optional): The provider and API key to call with (defaults to the current run's).
+            max_connections (int, optional): The maximum number of open connections.
+                Requests beyond this limit wait for a free connection.
+        """
+        self.run_config = run_config or get_run_config()
+        self.provider = self.run_config.provider
+        self.api_key = self.run_config.api_key
+        
+        if not self.api_key:
+            raise ValueError(f"{self.provider.upper()} API key is not set. Please add it to your .env file.")
+        
+        self.base_urls = {
+            "mistral": MISTRAL_BASE_URL,
+            "openai": OPENAI_BASE_URL
+        }
+        
+        # The httpx client keeps its own keep-alive connection pool
+        self.http = httpx.AsyncClient(
+            timeout=HTTP_TIMEOUT,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        )
+        
+        self.chat = AsyncChatCompletions(self)
+    
+    async def aclose(self):
+        """Close the underlying connection pool."""
+        await self.http.aclose()
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+
+class AsyncChatCompletions:
+    """
+    Handles chat completions for multiple AI providers on an event loop.
+    """
+    
+    def __init__(self, client):
+        """
+        Initialise the async chat completions handler.
+        
+        Args:
+            client (AsyncAIClient): The parent async AI client.
+        """
+        self.client = client
+    
+    async def create(self, model, messages, temperature=0.7, max_tokens=None):
+        """
+        Create a chat completion with the client's provider API.
+        
+        Args:
+            model (str): The model ID to use.
+            messages (list): A list of message objects.
+            temperature (float, optional): The temperature for sampling. Default is 0.7.
+            max_tokens (int, optional): The maximum number of tokens to generate.
+        
+        Returns:
+            ChatResponse: A standardised response object.
+        """
+        provider = self.client.provider
+        if provider == "replay":
+            return await get_replay_backend().create_async(self, model, messages, temperature, max_tokens)
+        
+        return await self.request(provider, self.client.api_key, model, messages, temperature, max_tokens)
+    
+    async def request(self, provider, api_key, model, messages, temperature=0.7, max_tokens=None):
+        """
+        Make a chat completion request to a provider's API.
+        
+        Args:
+            provider (str): The AI provider ("mistral" or "openai").
+            api_key (str): The API key for the provider.
+            model (str): The model ID to use.
+            messages (list): A list of message objects.
+            temperature (float, optional): The temperature for sampling. Default is 0.7.
+            max_tokens (int, optional): The maximum number of tokens to generate.
+        
+        Returns:
+            ChatResponse: A standardised response object.
+        """
+        headers, payload = build_chat_request(provider, api_key, model, messages, temperature, max_tokens)
+        
+        # Same limiter as the sync client, so both share the provider's quota
+        limiter = get_rate_limiter(provider)
+        estimated_tokens = estimate_tokens(messages, max_tokens)
+        
+        for attempt in range(limiter.max_retries + 1):
+            # A cancelled run (or one out of time) makes no more requests, and hands back the quota it reserved
+            check_cancelled()
+            try:
+                await limiter.acquire_async(estimated_tokens)
+            except RunCancelled:
+                limiter.record_usage(estimated_tokens, 0)
+                raise
+            
+            with span("http.post", "http", provider=provider, attempt=attempt) as request_span:
+                try:
+                    response = await self.client.http.post(
+                        f"{self.client.base_urls[provider]}/chat/completions",
+                        headers=headers,
+                        json=payload,
+                        timeout=request_timeout(HTTP_TIMEOUT)
+                    )
+                except Exception:
+                    check_cancelled()
+                    raise
+                request_span.set(status=response.status_code)
+            
+            if response.status_code not in RETRYABLE_STATUS_CODES or attempt == limiter.max_retries:
+                break
+            
+            limiter.record_usage(estimated_tokens, 0)
+            await cancellable_sleep_async(limiter.backoff(attempt, parse_retry_after(response.headers.get("Retry-After"))))
+        
+        if response.status_code != 200:
+            raise Exception(f"Error from {provider.upper()} API: {response.status_code} - {response.text}")
+        
+        response_data = response.json()
+        limiter.record_usage(estimated_tokens, (response_data.get("usage") or {}).get("total_tokens"))
+        
+        return ChatResponse(response_data, provider)
+
+
 class ChatResponse:
     """
     A standardised response object for chat completions.
@@ -123,6 +502,9 @@ class ChatResponse:
         self.created = response_data.get("created")
         self.model = response_data.get("model")
         
+        # Prompt, completion and total tokens, as both providers report them (None if not reported)
+        self.usage = response_data.get("usage")
+        
         # Create standardised choices
         self.choices = []
         
@@ -1,15 +1,547 @@
+import argparse
+import glob
 import hashlib
 import pickle
 import os
 import json
-from datetime import datetime, timedelta
-from config import get_provider
+import sqlite3
+import threading
+import struct
+import time
+import zlib
+from collections import OrderedDict
+from config import (
+    get_run_config, parse_size, get_cache_stage_quotas, CACHE_DB_PATH, CACHE_MAX_BYTES, CACHE_EVICTION_POLICY,
+    CACHE_MAX_AGE_HOURS, CACHE_SWEEP_INTERVAL_SECONDS, CACHE_COMPRESS_MIN_BYTES, MEMORY_CACHE_MAX_ENTRIES,
+    MEMORY_CACHE_MAX_BYTES, MEMORY_CACHE_TTL_SECONDS
+)
+from utils.tracing import span
 
 # Create cache directory
 CACHE_DIR = "cache"
 os.makedirs(CACHE_DIR, exist_ok=True)
 
-def generate_cache_key(model, messages, temperature, max_tokens=None):
+class CacheStore:
+    """
+    A single-file cache store backed by SQLite.
+    Entries are indexed by key, creation time, size and pipeline stage. The database
+    runs in WAL mode so readers in other threads and processes never block each other.
+    """
+    
+    def __init__(self, path=CACHE_DB_PATH):
+        """
+        Initialise the store, creating the database file if needed.
+        
+        Args:
+            path (str): Path to the SQLite database file.
+        """
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        # sqlite3 connections cannot be shared between threads, so each thread gets its own
+        self._local = threading.local()
+        
+        # Lookup counters, reported by get_cache_stats()
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        
+        # Access times of entries read since the last sweep. They are written in
+        # one batch by the sweeper so that reads never have to write to the database.
+        self._touched = {}
+        
+        connection = self._connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript("""
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                cache_key TEXT PRIMARY KEY,
+                stage TEXT,
+                created_at REAL NOT NULL,
+                size INTEGER NOT NULL,
+                payload BLOB NOT NULL,
+                accessed_at REAL
+            );
+        """)
+        
+        # Stores created before access times were tracked need the extra column
+        columns = [row[1] for row in connection.execute("PRAGMA table_info(cache_entries)")]
+        if "accessed_at" not in columns:
+            connection.execute("ALTER TABLE cache_entries ADD COLUMN accessed_at REAL")
+            connection.execute("UPDATE cache_entries SET accessed_at = created_at")
+        
+        connection.executescript("""
+            CREATE INDEX IF NOT EXISTS idx_cache_entries_created_at ON cache_entries (created_at);
+            CREATE INDEX IF NOT EXISTS idx_cache_entries_accessed_at ON cache_entries (accessed_at);
+            CREATE INDEX IF NOT EXISTS idx_cache_entries_size ON cache_entries (size);
+            CREATE INDEX IF NOT EXISTS idx_cache_entries_stage ON cache_entries (stage);
+        """)
+        connection.commit()
+    
+    def _connection(self):
+        """Get this thread's connection to the database."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+    
+    def get(self, cache_key, max_age_seconds=None):
+        """
+        Get the payload stored under a key.
+        
+        Args:
+            cache_key (str): The cache key.
+            max_age_seconds (float, optional): Entries older than this are deleted and treated as missing.
+        
+        Returns:
+            bytes or None: The payload, or None if missing or expired.
+        """
+        return self.get_many([cache_key], max_age_seconds).get(cache_key)
+    
+    def get_many(self, cache_keys, max_age_seconds=None):
+        """
+        Get the payloads stored under several keys in one query.
+        
+        Args:
+            cache_keys (list): The cache keys.
+            max_age_seconds (float, optional): Entries older than this are deleted and treated as missing.
+        
+        Returns:
+            dict: The payloads of the keys that were found, keyed by cache key.
+        """
+        entries = self.get_entries(cache_keys, max_age_seconds)
+        return {cache_key: payload for cache_key, (payload, created_at) in entries.items()}
+    
+    def get_entries(self, cache_keys, max_age_seconds=None):
+        """
+        Get the payloads and creation times stored under several keys in one query.
+        
+        Args:
+            cache_keys (list): The cache keys.
+            max_age_seconds (float, optional): Entries older than this are deleted and treated as missing.
+        
+        Returns:
+            dict: Tuples of (payload, created_at) for the keys that were found, keyed by cache key.
+        """
+        cache_keys = list(cache_keys)
+        if not cache_keys:
+            return {}
+        
+        connection = self._connection()
+        placeholders = ",".join("?" * len(cache_keys))
+        rows = connection.execute(
+            f"SELECT cache_key, created_at, payload FROM cache_entries WHERE cache_key IN ({placeholders})",
+            cache_keys
+        ).fetchall()
+        
+        results = {}
+        expired = []
+        now = time.time()
+        for cache_key, created_at, payload in rows:
+            if max_age_seconds is not None and now - created_at > max_age_seconds:
+                expired.append(cache_key)
+            else:
+                results[cache_key] = (payload, created_at)
+        
+        with self._stats_lock:
+            self.hits += len(results)
+            self.misses += len(cache_keys) - len(results)
+            self.expirations += len(expired)
+            for cache_key in results:
+                self._touched[cache_key] = now
+        
+        # Cache expired, delete it
+        if expired:
+            self.delete_many(expired)
+        
+        return results
+    
+    def touch(self, cache_keys):
+        """
+        Record that entries were read (e.g. from the memory tier) without querying the database.
+        
+        Args:
+            cache_keys (list): The cache keys that were read.
+        """
+        now = time.time()
+        with self._stats_lock:
+            for cache_key in cache_keys:
+                self._touched[cache_key] = now
+    
+    def stats(self):
+        """
+        Get the lookup counters of the store.
+        
+        Returns:
+            dict: Hit, miss and expiration counts.
+        """
+        with self._stats_lock:
+            return {"hits": self.hits, "misses": self.misses, "expirations": self.expirations}
+    
+    def put(self, cache_key, payload, stage=None, created_at=None):
+        """
+        Store a payload under a key, replacing any existing entry.
+        
+        Args:
+            cache_key (str): The cache key.
+            payload (bytes): The serialised payload.
+            stage (str, optional): The pipeline stage that produced the entry.
+            created_at (float, optional): The creation timestamp (defaults to now).
+        """
+        self.put_many([(cache_key, payload, stage)], created_at)
+    
+    def put_many(self, entries, created_at=None):
+        """
+        Store several payloads in one transaction.
+        
+        Args:
+            entries (list): Tuples of (cache_key, payload, stage).
+            created_at (float, optional): The creation timestamp (defaults to now).
+        """
+        created_at = created_at or time.time()
+        connection = self._connection()
+        with connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO cache_entries (cache_key, stage, created_at, size, payload, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                [(cache_key, stage, created_at, len(payload), payload, created_at) for cache_key, payload, stage in entries]
+            )
+    
+    def import_entries(self, rows):
+        """
+        Store pre-built rows, keeping their own creation timestamps.
+        
+        Args:
+            rows (list): Tuples of (cache_key, stage, created_at, payload).
+        """
+        connection = self._connection()
+        with connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO cache_entries (cache_key, stage, created_at, size, payload, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                [(cache_key, stage, created_at, len(payload), payload, created_at) for cache_key, stage, created_at, payload in rows]
+            )
+    
+    def delete_many(self, cache_keys, batch_size=500):
+        """
+        Delete several entries, in short transactions so that writers in other threads are not held up.
+        
+        Args:
+            cache_keys (list): The cache keys to delete.
+            batch_size (int): The number of entries deleted per transaction.
+        """
+        cache_keys = list(cache_keys)
+        connection = self._connection()
+        for start in range(0, len(cache_keys), batch_size):
+            with connection:
+                connection.executemany(
+                    "DELETE FROM cache_entries WHERE cache_key = ?",
+                    [(key,) for key in cache_keys[start:start + batch_size]]
+                )
+    
+    def clear(self):
+        """Delete every entry."""
+        connection = self._connection()
+        with connection:
+            connection.execute("DELETE FROM cache_entries")
+    
+    def flush_access_times(self):
+        """Write the access times recorded by reads since the last flush."""
+        with self._stats_lock:
+            touched, self._touched = self._touched, {}
+        
+        if touched:
+            connection = self._connection()
+            with connection:
+                connection.executemany(
+                    "UPDATE cache_entries SET accessed_at = ? WHERE cache_key = ?",
+                    [(accessed_at, cache_key) for cache_key, accessed_at in touched.items()]
+                )
+    
+    def evict(self, max_bytes=None, stage_quotas=None, policy="lru", max_age_seconds=None):
+        """
+        Evict entries until the store is within its limits.
+        Expired entries go first, then entries over a stage quota, then entries over the total cap.
+        
+        Args:
+            max_bytes (int, optional): The total payload size cap.
+            stage_quotas (dict, optional): Payload size caps keyed by stage.
+            policy (str): "lru" evicts the least recently read entries first, "age" the oldest.
+            max_age_seconds (float, optional): Entries created longer ago than this are always evicted.
+        
+        Returns:
+            tuple: The number of entries and payload bytes evicted.
+        """
+        self.flush_access_times()
+        order_column = "created_at" if policy == "age" else "accessed_at"
+        evicted_entries = 0
+        evicted_bytes = 0
+        
+        # Entries that are never read again would otherwise never expire
+        if max_age_seconds is not None:
+            cutoff = time.time() - max_age_seconds
+            entries, size = self._evict_where("created_at < ?", (cutoff,))
+            evicted_entries += entries
+            evicted_bytes += size
+        
+        for stage, quota in (stage_quotas or {}).items():
+            entries, size = self._evict_over(quota, order_column, "WHERE stage = ?", (stage,))
+            evicted_entries += entries
+            evicted_bytes += size
+        
+        if max_bytes is not None:
+            entries, size = self._evict_over(max_bytes, order_column)
+            evicted_entries += entries
+            evicted_bytes += size
+        
+        return evicted_entries, evicted_bytes
+    
+    def _evict_where(self, condition, params):
+        """Evict every entry matching a condition."""
+        connection = self._connection()
+        rows = connection.execute(f"SELECT cache_key, size FROM cache_entries WHERE {condition}", params).fetchall()
+        self.delete_many([cache_key for cache_key, size in rows])
+        return len(rows), sum(size for cache_key, size in rows)
+    
+    def _evict_over(self, limit, order_column, where="", params=()):
+        """Evict entries in policy order until the matching entries fit within a limit."""
+        connection = self._connection()
+        total = connection.execute(f"SELECT COALESCE(SUM(size), 0) FROM cache_entries {where}", params).fetchone()[0]
+        excess = total - limit
+        if excess <= 0:
+            return 0, 0
+        
+        victims = []
+        freed = 0
+        cursor = connection.execute(f"SELECT cache_key, size FROM cache_entries {where} ORDER BY {order_column} ASC", params)
+        for cache_key, size in cursor:
+            victims.append(cache_key)
+            freed += size
+            if freed >= excess:
+                break
+        cursor.close()
+        
+        self.delete_many(victims)
+        return len(victims), freed
+    
+    def file_size(self):
+        """
+        Get the size of the database on disk, including its write-ahead log.
+        
+        Returns:
+            int: The size in bytes.
+        """
+        return sum(
+            os.path.getsize(path) for path in (self.path, self.path + "-wal") if os.path.exists(path)
+        )
+    
+    def compact(self):
+        """
+        Rebuild the database file so the space of evicted entries is returned to the filesystem.
+        
+        Returns:
+            int: The number of bytes reclaimed on disk.
+        """
+        before = self.file_size()
+        connection = self._connection()
+        connection.execute("VACUUM")
+        connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return before - self.file_size()
+
+
+class CacheSweeper(threading.Thread):
+    """
+    A background thread that keeps the cache store within its size cap and stage quotas.
+    """
+    
+    def __init__(self, store, interval_seconds=CACHE_SWEEP_INTERVAL_SECONDS):
+        """
+        Initialise the sweeper.
+        
+        Args:
+            store (CacheStore): The store to sweep.
+            interval_seconds (float): The time between sweeps.
+        """
+        super().__init__(name="cache-sweeper", daemon=True)
+        self.store = store
+        self.interval_seconds = interval_seconds
+        self._stop_event = threading.Event()
+    
+    def run(self):
+        """Sweep the store every interval until stopped."""
+        while not self._stop_event.wait(self.interval_seconds):
+            try:
+                sweep_cache(self.store)
+            except sqlite3.Error as e:
+                print(f"Warning: Cache sweep failed: {e}")
+    
+    def stop(self):
+        """Stop sweeping."""
+        self._stop_event.set()
+
+
+class MemoryCache:
+    """
+    A bounded, thread-safe in-process LRU cache that sits in front of the cache store.
+    Entries are evicted when they exceed the TTL, or when the entry count or byte limit is reached.
+    """
+    
+    def __init__(self, max_entries=MEMORY_CACHE_MAX_ENTRIES, max_bytes=MEMORY_CACHE_MAX_BYTES, ttl_seconds=MEMORY_CACHE_TTL_SECONDS):
+        """
+        Initialise the memory cache.
+        
+        Args:
+            max_entries (int): The maximum number of entries held.
+            max_bytes (int): The maximum total (serialised) size of the entries held.
+            ttl_seconds (float): How long an entry may stay in memory.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        
+        # cache_key -> (value, size, created_at, loaded_at), least recently used first
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        
+        # Counters, reported by get_cache_stats()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+    
+    def get(self, cache_key, max_age_seconds=None):
+        """
+        Get a value, marking it as recently used.
+        
+        Args:
+            cache_key (str): The cache key.
+            max_age_seconds (float, optional): Entries created longer ago than this are treated as missing.
+        
+        Returns:
+            object or None: The value, or None if missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is None:
+                self.misses += 1
+                return None
+            
+            value, size, created_at, loaded_at = entry
+            now = time.time()
+            if now - loaded_at > self.ttl_seconds or (max_age_seconds is not None and now - created_at > max_age_seconds):
+                self._remove(cache_key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            
+            self._entries.move_to_end(cache_key)
+            self.hits += 1
+            return value
+    
+    def put(self, cache_key, value, size, created_at=None):
+        """
+        Add or replace a value, evicting least recently used entries to stay within the limits.
+        
+        Args:
+            cache_key (str): The cache key.
+            value (object): The value to hold.
+            size (int): The size of the value in bytes, as held in memory (see record_size).
+            created_at (float, optional): When the value was first cached (defaults to now).
+        """
+        # Values bigger than the whole tier are never held
+        if size > self.max_bytes or self.max_entries <= 0:
+            return
+        
+        now = time.time()
+        with self._lock:
+            if cache_key in self._entries:
+                self._remove(cache_key)
+            
+            self._entries[cache_key] = (value, size, created_at or now, now)
+            self._bytes += size
+            
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+    
+    def _remove(self, cache_key):
+        """Remove an entry (the lock must be held)."""
+        value, size, created_at, loaded_at = self._entries.pop(cache_key)
+        self._bytes -= size
+    
+    def clear(self):
+        """Remove every entry."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+    
+    def stats(self):
+        """
+        Get the counters and current size of the memory cache.
+        
+        Returns:
+            dict: Hit, miss, eviction and expiration counts, plus the entries and bytes held.
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "entries": len(self._entries),
+                "bytes": self._bytes
+            }
+
+
+# The process-wide cache store, opened on first use
+_store = None
+_sweeper = None
+_store_lock = threading.Lock()
+
+# The process-wide memory tier
+memory_cache = MemoryCache()
+
+def get_cache_store():
+    """
+    Get the shared cache store.
+    
+    Returns:
+        CacheStore: The process-wide cache store.
+    """
+    global _store, _sweeper
+    with _store_lock:
+        if _store is None:
+            _store = CacheStore()
+            
+            # Enforce the size limits in the background, away from request threads
+            if CACHE_SWEEP_INTERVAL_SECONDS > 0:
+                _sweeper = CacheSweeper(_store)
+                _sweeper.start()
+        return _store
+
+def sweep_cache(store=None):
+    """
+    Evict expired entries and entries over the configured size cap and stage quotas
+    
+    Args:
+        store (CacheStore, optional): The store to sweep (defaults to the shared store)
+    
+    Returns:
+        tuple: The number of entries and payload bytes evicted
+    """
+    store = store or get_cache_store()
+    return store.evict(
+        max_bytes=parse_size(CACHE_MAX_BYTES),
+        stage_quotas=get_cache_stage_quotas(),
+        policy=CACHE_EVICTION_POLICY,
+        max_age_seconds=CACHE_MAX_AGE_HOURS * 3600
+    )
+
+def generate_cache_key(model, messages, temperature, max_tokens=None, run_config=None):
     """
     Generate a unique cache key based on request parameters
     
@@ -18,12 +550,13 @@ def generate_cache_key(model, messages, temperature, max_tokens=None):
         messages (list): The messages list
         temperature (float): The temperature setting
         max_tokens (int, optional): Maximum tokens limit
-        
+        run_config (RunConfig, optional): The run making the request (defaults to the current run)
+    
     Returns:
         str: A hexadecimal cache key
     """
-    # Include the provider in the cache key to differentiate between providers
-    provider = get_provider()
+    # Include the run's provider in the cache key to differentiate between providers
+    provider = (run_config or get_run_config()).provider
     
     # Convert messages to a string representation
     message_str = json.dumps(messages, sort_keys=True)
@@ -34,6 +567,118 @@ def generate_cache_key(model, messages, temperature, max_tokens=None):
     # Generate MD5 hash
     return hashlib.md5(params_str.encode('utf-8')).hexdigest()
 
+# Cached responses are stored as compact records rather than pickled response objects:
+#   version (1 byte) | codec (1 byte) | body
+# where the body is a 2-byte header length, a header of metadata fields separated by
+# RECORD_FIELD_SEPARATOR and then the UTF-8 content, so decoding is a couple of slices.
+# Bodies of at least CACHE_COMPRESS_MIN_BYTES are zlib-compressed. Entries written by
+# older versions are pickled ChatResponse objects, which begin with the pickle protocol
+# marker instead.
+CACHE_RECORD_VERSION = 1
+CODEC_RAW = 0
+CODEC_ZLIB = 1
+RECORD_FIELDS = ("provider", "model", "id", "finish_reason", "created")
+RECORD_FIELD_SEPARATOR = "\x1f"
+
+def record_from_response(response):
+    """
+    Build a cache record from a response object
+    
+    Args:
+        response (ChatResponse): The response to record
+    
+    Returns:
+        dict: The content of the first choice and minimal metadata
+    """
+    choice = response.choices[0] if response.choices else None
+    return {
+        "content": choice.message.content if choice else "",
+        "finish_reason": choice.finish_reason if choice else None,
+        "provider": getattr(response, "provider", None),
+        "model": getattr(response, "model", None),
+        "id": getattr(response, "id", None),
+        "created": getattr(response, "created", None)
+    }
+
+def response_from_record(record):
+    """
+    Rebuild a response object from a cache record (only needed by callers that want the object)
+    
+    Args:
+        record (dict): The cache record
+    
+    Returns:
+        ChatResponse: A standardised response object
+    """
+    from utils.ai_client import ChatResponse
+    response_data = {
+        "id": record.get("id"),
+        "created": record.get("created"),
+        "model": record.get("model"),
+        "choices": [
+            {
+                "message": {"role": "assistant", "content": record.get("content", "")},
+                "finish_reason": record.get("finish_reason")
+            }
+        ]
+    }
+    return ChatResponse(response_data, record.get("provider") or "openai")
+
+def encode_cache_record(record):
+    """
+    Serialise a cache record into a compact, versioned payload
+    
+    Args:
+        record (dict): The cache record
+    
+    Returns:
+        bytes: The payload to store
+    """
+    header = RECORD_FIELD_SEPARATOR.join(
+        "" if record.get(field) is None else str(record[field]) for field in RECORD_FIELDS
+    ).encode("utf-8")
+    body = struct.pack(">H", len(header)) + header + record.get("content", "").encode("utf-8")
+    
+    if len(body) >= CACHE_COMPRESS_MIN_BYTES:
+        return bytes([CACHE_RECORD_VERSION, CODEC_ZLIB]) + zlib.compress(body)
+    return bytes([CACHE_RECORD_VERSION, CODEC_RAW]) + body
+
+def record_size(record):
+    """
+    Get the size of a cache record as the memory tier holds it: decoded, and uncompressed
+    
+    Args:
+        record (dict): The cache record
+    
+    Returns:
+        int: The UTF-8 size in bytes of the content and metadata
+    """
+    return sum(len(str(value).encode("utf-8")) for value in record.values() if value is not None)
+
+def decode_cache_record(payload):
+    """
+    Deserialise a stored payload into a cache record
+    
+    Args:
+        payload (bytes): The stored payload
+    
+    Returns:
+        dict: The cache record
+    """
+    if payload[0] != CACHE_RECORD_VERSION:
+        # Entry written before records existed
+        return record_from_response(pickle.loads(payload))
+    
+    body = zlib.decompress(payload[2:]) if payload[1] == CODEC_ZLIB else payload[2:]
+    header_length = struct.unpack_from(">H", body)[0]
+    values = body[2:2 + header_length].decode("utf-8").split(RECORD_FIELD_SEPARATOR)
+    
+    record = {field: value or None for field, value in zip(RECORD_FIELDS, values)}
+    if record["created"]:
+        record["created"] = int(record["created"])
+    record["content"] = body[2 + header_length:].decode("utf-8")
+    return record
+
 def get_cached_response(cache_key, max_age_hours=24):
     """
     Retrieve a cached response if it exists and is not expired
@@ -41,47 +686,235 @@ def get_cached_response(cache_key, max_age_hours=24):
     Args:
         cache_key (str): The cache key to look up
         max_age_hours (int): Maximum age of the cache in hours
-        
+    
     Returns:
         object or None: The cached response or None if not found/expired
     """
-    cache_file = os.path.join(CACHE_DIR, f"{cache_key}.pickle")
+    return get_cached_responses([cache_key], max_age_hours).get(cache_key)
+
+def get_cached_responses(cache_keys, max_age_hours=24):
+    """
+    Retrieve several cached responses in one lookup
     
-    # Check if cache file exists
-    if not os.path.exists(cache_file):
-        return None
+    Args:
+        cache_keys (list): The cache keys to look up
+        max_age_hours (int): Maximum age of the cache in hours
     
-    # Check if cache is expired
-    file_time = datetime.fromtimestamp(os.path.getmtime(cache_file))
-    if datetime.now() - file_time > timedelta(hours=max_age_hours):
-        # Cache expired, delete it
-        os.remove(cache_file)
-        return None
+    Returns:
+        dict: The cached responses that were found and not expired, keyed by cache key
+    """
+    records = get_cached_records(cache_keys, max_age_hours)
+    return {cache_key: response_from_record(record) for cache_key, record in records.items()}
+
+def get_cached_content(cache_key, max_age_hours=24):
+    """
+    Retrieve the content of a cached response without rebuilding the response object
     
-    # Load and return cached response
-    try:
-        with open(cache_file, 'rb') as f:
-            return pickle.load(f)
-    except (pickle.PickleError, EOFError):
-        # Invalid cache file
-        os.remove(cache_file)
-        return None
+    Args:
+        cache_key (str): The cache key to look up
+        max_age_hours (int): Maximum age of the cache in hours
+    
+    Returns:
+        str or None: The cached content or None if not found/expired
+    """
+    record = get_cached_records([cache_key], max_age_hours).get(cache_key)
+    return record["content"] if record else None
+
+def get_cached_records(cache_keys, max_age_hours=24):
+    """
+    Retrieve several cache records in one lookup, checking the memory tier before the disk store
+    
+    Args:
+        cache_keys (list): The cache keys to look up
+        max_age_hours (int): Maximum age of the cache in hours
+    
+    Returns:
+        dict: The cache records that were found and not expired, keyed by cache key
+    """
+    with span("cache.lookup", "cache", keys=len(cache_keys)) as lookup:
+        max_age_seconds = max_age_hours * 3600
+        
+        # Memory tier first
+        records = {}
+        missing = []
+        for cache_key in cache_keys:
+            record = memory_cache.get(cache_key, max_age_seconds)
+            if record is not None:
+                records[cache_key] = record
+            else:
+                missing.append(cache_key)
+        
+        # Memory hits still count as recent use when the disk store evicts by LRU
+        store = get_cache_store()
+        if records:
+            store.touch(records.keys())
+        
+        if not missing:
+            lookup.set(memory_hits=len(records), disk_hits=0)
+            return records
+        
+        # Read through to the disk store for the rest
+        entries = store.get_entries(missing, max_age_seconds)
+        
+        invalid = []
+        for cache_key, (payload, created_at) in entries.items():
+            try:
+                record = decode_cache_record(payload)
+            except (zlib.error, struct.error, ValueError, IndexError, pickle.PickleError, EOFError, AttributeError):
+                # Invalid cache entry
+                invalid.append(cache_key)
+                continue
+            records[cache_key] = record
+            memory_cache.put(cache_key, record, record_size(record), created_at)
+        
+        if invalid:
+            store.delete_many(invalid)
+        
+        lookup.set(memory_hits=len(cache_keys) - len(missing), disk_hits=len(entries) - len(invalid))
+        return records
 
-def cache_response(cache_key, response):
+def cache_response(cache_key, response, stage=None):
     """
     Cache an API response
     
     Args:
         cache_key (str): The cache key
         response: The response object to cache
-        
+        stage (str, optional): The pipeline stage the response belongs to
+    
     Returns:
         None
     """
-    cache_file = os.path.join(CACHE_DIR, f"{cache_key}.pickle")
+    cache_responses({cache_key: response}, stage)
+
+def cache_responses(responses, stage=None):
+    """
+    Cache several API responses in one transaction, writing through the memory tier to the disk store
     
+    Args:
+        responses (dict): The response objects to cache, keyed by cache key
+        stage (str, optional): The pipeline stage the responses belong to
+    
+    Returns:
+        None
+    """
     try:
-        with open(cache_file, 'wb') as f:
-            pickle.dump(response, f)
-    except (pickle.PickleError, IOError) as e:
-        print(f"Warning: Failed to cache response: {e}")
\ No newline at end of file
+        with span("cache.write", "cache", entries=len(responses), stage=stage):
+            entries = []
+            for cache_key, response in responses.items():
+                record = record_from_response(response)
+                payload = encode_cache_record(record)
+                memory_cache.put(cache_key, record, record_size(record))
+                entries.append((cache_key, payload, stage))
+            get_cache_store().put_many(entries)
+    except (TypeError, ValueError, sqlite3.Error) as e:
+        print(f"Warning: Failed to cache response: {e}")
+
+def get_cache_stats():
+    """
+    Get the hit, miss and eviction counters of each cache tier
+    
+    Returns:
+        dict: The counters of the memory tier and the disk store
+    """
+    return {
+        "memory": memory_cache.stats(),
+        "disk": get_cache_store().stats()
+    }
+
+def format_cache_stats(stats=None):
+    """
+    Format the cache counters as a short, human-readable summary
+    
+    Args:
+        stats (dict, optional): Counters from get_cache_stats() (fetched if not given)
+    
+    Returns:
+        str: One line per cache tier
+    """
+    stats = stats or get_cache_stats()
+    memory = stats["memory"]
+    disk = stats["disk"]
+    return (
+        f"Memory cache: {memory['hits']} hits, {memory['misses']} misses, {memory['evictions']} evictions, "
+        f"{memory['entries']} entries ({memory['bytes'] / 1024:.1f} KB)\n"
+        f"Disk cache: {disk['hits']} hits, {disk['misses']} misses, {disk['expirations']} expirations"
+    )
+
+def clear_cache():
+    """
+    Delete every cached response
+    
+    Returns:
+        None
+    """
+    memory_cache.clear()
+    get_cache_store().clear()
+
+def migrate_pickle_cache(source_dir=CACHE_DIR, delete=False, batch_size=500):
+    """
+    Import a directory of legacy `<key>.pickle` cache files into the cache store
+    
+    Args:
+        source_dir (str): The directory holding the pickle files
+        delete (bool): Whether to delete each file once it has been imported (unreadable files are kept)
+        batch_size (int): The number of files to import per transaction
+    
+    Returns:
+        int: The number of entries imported
+    """
+    store = get_cache_store()
+    paths = glob.glob(os.path.join(source_dir, "*.pickle"))
+    imported = 0
+    
+    for start in range(0, len(paths), batch_size):
+        batch = paths[start:start + batch_size]
+        rows = []
+        imported_paths = []
+        for path in batch:
+            cache_key = os.path.splitext(os.path.basename(path))[0]
+            try:
+                with open(path, 'rb') as f:
+                    record = record_from_response(pickle.load(f))
+            except (pickle.PickleError, EOFError, AttributeError) as e:
+                print(f"Warning: Skipping unreadable cache file {path}: {e}")
+                continue
+            # The file's modification time was its creation time in the old cache
+            rows.append((cache_key, None, os.path.getmtime(path), encode_cache_record(record)))
+            imported_paths.append(path)
+        
+        store.import_entries(rows)
+        imported += len(rows)
+        
+        # Only files whose entries are now committed to the store are deleted; skipped ones stay for inspection
+        if delete:
+            for path in imported_paths:
+                os.remove(path)
+    
+    return imported
+
+def main():
+    """Command-line maintenance for the response cache."""
+    parser = argparse.ArgumentParser(description="Manage the response cache.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    
+    migrate_parser = subparsers.add_parser("migrate", help="Import legacy .pickle cache files into the cache store")
+    migrate_parser.add_argument("--source", default=CACHE_DIR, help="Directory holding the .pickle files")
+    migrate_parser.add_argument("--delete", action="store_true", help="Delete each .pickle file once imported")
+    
+    subparsers.add_parser("compact", help="Evict entries over the size limits and shrink the cache file")
+    
+    args = parser.parse_args()
+    
+    if args.command == "migrate":
+        imported = migrate_pickle_cache(args.source, args.delete)
+        print(f"Imported {imported} cache entries into {get_cache_store().path}")
+    elif args.command == "compact":
+        store = get_cache_store()
+        evicted_entries, evicted_bytes = sweep_cache(store)
+        reclaimed = store.compact()
+        print(f"Evicted {evicted_entries} entries ({evicted_bytes / 1024:.1f} KB of payload)")
+        print(f"Reclaimed {reclaimed} bytes ({reclaimed / 1024 / 1024:.2f} MB); {store.path} is now {store.file_size()} bytes")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+import asyncio
+import contextlib
+import contextvars
+import threading
+import time
+
+# How often an async sleep checks for a cancel, as a threading.Event cannot be awaited
+ASYNC_POLL_SECONDS = 0.1
+
+class RunCancelled(BaseException):
+    """
+    Raised in a run's tasks once the run has been cancelled. Like KeyboardInterrupt it is
+    not an Exception, so the agents' fallbacks for failed calls let it through instead of
+    turning it into a result (which would be checkpointed and reused on resume).
+    """
+
+
+class RunTimedOut(RunCancelled):
+    """Raised in a run's tasks once the run's deadline has passed."""
+
+
+class CancelToken:
+    """
+    The cancellation state of one research run: cancelled by a caller (e.g. a Cancel
+    button), or expired when the run's deadline passes. The pipeline, the worker pool
+    and the HTTP layer check it cooperatively, so a cancelled run stops at its next
+    task or model call and makes no more requests.
+    """
+    
+    def __init__(self, timeout=None):
+        """
+        Initialise the token.
+        
+        Args:
+            timeout (float, optional): Seconds from now until the run's deadline (None or 0 for no deadline).
+        """
+        self.reason = None
+        self.deadline = None
+        self.timeout = None
+        self._event = threading.Event()
+        self.set_deadline(timeout)
+    
+    def set_deadline(self, timeout):
+        """
+        Give the run a deadline, e.g. when a queued run starts.
+        
+        Args:
+            timeout (float): Seconds from now until the deadline (None or 0 for no deadline).
+        """
+        self.timeout = timeout or None
+        self.deadline = time.monotonic() + timeout if timeout else None
+    
+    def cancel(self, reason="Research cancelled"):
+        """
+        Cancel the run. Its tasks stop at their next check.
+        
+        Args:
+            reason (str, optional): Why the run was cancelled, raised with RunCancelled.
+        """
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+    
+    @property
+    def expired(self):
+        """Whether the run's deadline has passed."""
+        return self.deadline is not None and time.monotonic() >= self.deadline
+    
+    @property
+    def cancelled(self):
+        """Whether the run has been cancelled or has run out of time."""
+        return self._event.is_set() or self.expired
+    
+    def remaining(self):
+        """Get the seconds left until the deadline, or None if there is no deadline."""
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.monotonic(), 0.0)
+    
+    def check(self):
+        """Raise RunCancelled (or RunTimedOut) if the run should stop."""
+        if self._event.is_set():
+            raise RunCancelled(self.reason)
+        if self.expired:
+            raise RunTimedOut(f"Research stopped after its {self.timeout:g}s time limit")
+    
+    def sleep(self, seconds):
+        """Sleep, waking up early (and raising) if the run is cancelled or runs out of time."""
+        remaining = self.remaining()
+        if remaining is not None:
+            seconds = min(seconds, remaining)
+        self._event.wait(seconds)
+        self.check()
+    
+    async def sleep_async(self, seconds):
+        """Async version of sleep, which waits without blocking the event loop."""
+        remaining = self.remaining()
+        if remaining is not None:
+            seconds = min(seconds, remaining)
+        end = time.monotonic() + seconds
+        while not self._event.is_set():
+            left = end - time.monotonic()
+            if left <= 0:
+                break
+            await asyncio.sleep(min(left, ASYNC_POLL_SECONDS))
+        self.check()
+
+
+# The CancelToken of the run the current thread or task belongs to. Like the trace context,
+# it follows asyncio tasks on their own and reaches worker threads through copy_context()
+_cancel_token = contextvars.ContextVar("cancel_token", default=None)
+
+def get_cancel_token():
+    """Get the CancelToken of the current run, or None outside a cancellable run."""
+    return _cancel_token.get()
+
+@contextlib.contextmanager
+def use_cancel_token(token):
+    """
+    Run the enclosed block (and every task it starts) with a cancel token.
+    
+    Args:
+        token (CancelToken): The token of the run.
+    """
+    reset = _cancel_token.set(token)
+    try:
+        yield token
+    finally:
+        _cancel_token.reset(reset)
+
+def check_cancelled():
+    """Raise RunCancelled (or RunTimedOut) if the current run should stop."""
+    token = _cancel_token.get()
+    if token is not None:
+        token.check()
+
+def cancellable_sleep(seconds):
+    """Sleep, stopping early if the current run is cancelled or runs out of time."""
+    token = _cancel_token.get()
+    if token is None:
+        time.sleep(seconds)
+    else:
+        token.sleep(seconds)
+
+async def cancellable_sleep_async(seconds):
+    """Async version of cancellable_sleep, which waits without blocking the event loop."""
+    token = _cancel_token.get()
+    if token is None:
+        await asyncio.sleep(seconds)
+    else:
+        await token.sleep_async(seconds)
+
+def request_timeout(timeout):
+    """
+    Limit a request timeout to the time the current run has left.
+    
+    Args:
+        timeout (float): The usual timeout in seconds.
+    
+    Returns:
+        float: The timeout to use.
+    """
+    token = _cancel_token.get()
+    remaining = token.remaining() if token is not None else None
+    if remaining is None:
+        return timeout
+    # A request with no time left still gets a moment, then fails and reports the deadline
+    return max(min(timeout, remaining), 0.1)
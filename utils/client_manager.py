@@ -1,18 +1,103 @@
-from config import get_provider, get_api_key
+import threading
+from collections import OrderedDict
+from config import get_run_config, CLIENT_CACHE_SIZE
 
-def get_client():
+# Long-lived sync clients, keyed by RunConfig (provider, model and API key), least recently used first
+_clients = OrderedDict()
+_clients_lock = threading.Lock()
+_client_stats = {"created": 0, "reused": 0, "evicted": 0, "invalidated": 0}
+
+def get_client(run_config=None):
     """
-    Get the appropriate AI client based on the current provider configuration.
-    This centralises the client creation logic to avoid repetition across files.
+    Get the AI client for a run's provider, model and API key.
+    Clients are made once per configuration and reused by every call and run with it,
+    so the hot path does no per-call setup. A client is never changed once made.
+    
+    Args:
+        run_config (RunConfig, optional): The run's configuration (defaults to the current run's).
     
     Returns:
         object: The appropriate AI client instance
     """
-    provider = get_provider()
-    api_key = get_api_key()
+    run_config = run_config or get_run_config()
     
-    if not api_key:
-        raise ValueError(f"{provider.upper()} API key is not set. Please add it to your .env file or enter it in the UI.")
+    with _clients_lock:
+        client = _clients.get(run_config)
+        if client is not None:
+            _clients.move_to_end(run_config)
+            _client_stats["reused"] += 1
+            return client
+    
+    if not run_config.api_key:
+        raise ValueError(f"{run_config.provider.upper()} API key is not set. Please add it to your .env file or enter it in the UI.")
     
     from utils.ai_client import AIClient
-    return AIClient()
\ No newline at end of file
+    new_client = AIClient(run_config)
+    
+    with _clients_lock:
+        # Another thread may have made the same client meanwhile; keep the first
+        client = _clients.setdefault(run_config, new_client)
+        _clients.move_to_end(run_config)
+        _client_stats["created" if client is new_client else "reused"] += 1
+        
+        # Each user key of a long-running app adds a client, so the least recently used go
+        while len(_clients) > max(CLIENT_CACHE_SIZE, 1):
+            _clients.popitem(last=False)
+            _client_stats["evicted"] += 1
+    
+    return client
+
+def invalidate_clients(provider=None, api_key=None):
+    """
+    Drop cached clients, e.g. when a key is rotated or revoked. Runs holding a dropped
+    client finish with it; later calls make a new one.
+    
+    Args:
+        provider (str, optional): Only drop this provider's clients.
+        api_key (str, optional): Only drop clients using this API key.
+    
+    Returns:
+        int: The number of clients dropped.
+    """
+    with _clients_lock:
+        dropped = [
+            run_config for run_config in _clients
+            if (provider is None or run_config.provider == provider.lower())
+            and (api_key is None or run_config.api_key == api_key)
+        ]
+        for run_config in dropped:
+            del _clients[run_config]
+        _client_stats["invalidated"] += len(dropped)
+    
+    return len(dropped)
+
+def client_stats():
+    """
+    Get the client cache counters.
+    
+    Returns:
+        dict: The clients cached now, and the clients made, reused, evicted and invalidated.
+    """
+    with _clients_lock:
+        return {"cached": len(_clients), **_client_stats}
+
+def get_async_client(run_config=None):
+    """
+    Get an asyncio AI client for a run's provider, model and API key.
+    An async client's connections belong to one event loop, so it is not cached; the
+    caller owns the client, uses it for every call of its run, and should close it
+    (e.g. with `async with`) when done.
+    
+    Args:
+        run_config (RunConfig, optional): The run's configuration (defaults to the current run's).
+    
+    Returns:
+        AsyncAIClient: A new async AI client instance
+    """
+    run_config = run_config or get_run_config()
+    
+    if not run_config.api_key:
+        raise ValueError(f"{run_config.provider.upper()} API key is not set. Please add it to your .env file or enter it in the UI.")
+    
+    from utils.ai_client import AsyncAIClient
+    return AsyncAIClient(run_config)
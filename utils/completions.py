@@ -0,0 +1,167 @@
+from config import get_run_config
+from utils.caching import generate_cache_key, get_cached_content, cache_response
+from utils.client_manager import get_client
+from utils.single_flight import completion_flight
+from utils.usage import usage_ledger
+
+def get_completion_content(messages, temperature, max_tokens=None, cache_message=None, stage=None, run_config=None):
+    """
+    Get the content of a chat completion, using the response cache where possible.
+    This is the single path every agent uses to call the model.
+    
+    Args:
+        messages (list): The messages list.
+        temperature (float): The temperature setting.
+        max_tokens (int, optional): Maximum tokens limit.
+        cache_message (str, optional): Message to print when the cache is hit.
+        stage (str, optional): The pipeline stage, recorded with the cached response.
+        run_config (RunConfig, optional): The provider, model and API key to use (defaults to the current run's).
+    
+    Returns:
+        str: The content of the first completion choice.
+    """
+    run_config = run_config or get_run_config()
+    cache_key = generate_cache_key(run_config.model, messages, temperature, max_tokens, run_config)
+    
+    # Check cache first
+    cached_content = get_cached_content(cache_key)
+    if cached_content is not None:
+        usage_ledger.record_cached(stage, run_config.provider, run_config.model)
+        if cache_message:
+            print(cache_message)
+        return cached_content
+    
+    # Set when this caller makes the call, rather than sharing the result of one in flight
+    made_call = []
+    
+    def call_and_cache():
+        made_call.append(True)
+        
+        # An identical call may have finished between the cache check and joining the flight
+        cached_content = get_cached_content(cache_key)
+        if cached_content is not None:
+            usage_ledger.record_cached(stage, run_config.provider, run_config.model)
+            return cached_content
+        
+        # Call the API
+        client = get_client(run_config)
+        response = client.chat.create(
+            model=run_config.model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens
+        )
+        
+        # Cache the response and count its tokens
+        cache_response(cache_key, response, stage)
+        usage_ledger.record(response, messages, stage)
+        
+        return response.choices[0].message.content
+    
+    # Concurrent identical calls wait for one in-flight request and share its result
+    content = completion_flight.do(cache_key, call_and_cache)
+    if not made_call:
+        usage_ledger.record_coalesced(stage, run_config.provider, run_config.model)
+    return content
+
+async def get_completion_content_async(client, messages, temperature, max_tokens=None, cache_message=None, stage=None, run_config=None):
+    """
+    Async version of get_completion_content.
+    
+    Args:
+        client (AsyncAIClient): The async client to call the model with.
+        messages (list): The messages list.
+        temperature (float): The temperature setting.
+        max_tokens (int, optional): Maximum tokens limit.
+        cache_message (str, optional): Message to print when the cache is hit.
+        stage (str, optional): The pipeline stage, recorded with the cached response.
+        run_config (RunConfig, optional): The provider, model and API key to use (defaults to the current run's).
+    
+    Returns:
+        str: The content of the first completion choice.
+    """
+    # The client was made for the run, so its configuration is the run's
+    run_config = run_config or client.run_config
+    cache_key = generate_cache_key(run_config.model, messages, temperature, max_tokens, run_config)
+    
+    # Check cache first
+    cached_content = get_cached_content(cache_key)
+    if cached_content is not None:
+        usage_ledger.record_cached(stage, run_config.provider, run_config.model)
+        if cache_message:
+            print(cache_message)
+        return cached_content
+    
+    # Set when this caller makes the call, rather than sharing the result of one in flight
+    made_call = []
+    
+    async def call_and_cache():
+        made_call.append(True)
+        
+        cached_content = get_cached_content(cache_key)
+        if cached_content is not None:
+            usage_ledger.record_cached(stage, run_config.provider, run_config.model)
+            return cached_content
+        
+        # Call the API without blocking the event loop
+        response = await client.chat.create(
+            model=run_config.model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens
+        )
+        
+        # Cache the response and count its tokens
+        cache_response(cache_key, response, stage)
+        usage_ledger.record(response, messages, stage)
+        
+        return response.choices[0].message.content
+    
+    content = await completion_flight.do_async(cache_key, call_and_cache)
+    if not made_call:
+        usage_ledger.record_coalesced(stage, run_config.provider, run_config.model)
+    return content
+
+def stream_completion_content(messages, temperature, max_tokens=None, cache_message=None, stage=None, run_config=None):
+    """
+    Streaming version of get_completion_content, which yields the content as it is generated.
+    The assembled completion is cached under the same key, so a cached result is
+    yielded in one piece.
+    
+    Args:
+        messages (list): The messages list.
+        temperature (float): The temperature setting.
+        max_tokens (int, optional): Maximum tokens limit.
+        cache_message (str, optional): Message to print when the cache is hit.
+        stage (str, optional): The pipeline stage, recorded with the cached response.
+        run_config (RunConfig, optional): The provider, model and API key to use (defaults to the current run's).
+    
+    Yields:
+        str: Pieces of the content of the first completion choice.
+    """
+    run_config = run_config or get_run_config()
+    cache_key = generate_cache_key(run_config.model, messages, temperature, max_tokens, run_config)
+    
+    # Check cache first
+    cached_content = get_cached_content(cache_key)
+    if cached_content is not None:
+        usage_ledger.record_cached(stage, run_config.provider, run_config.model)
+        if cache_message:
+            print(cache_message)
+        yield cached_content
+        return
+    
+    # Call the API and pass each delta on as it arrives
+    client = get_client(run_config)
+    stream = client.chat.create(
+        model=run_config.model,
+        messages=messages,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        stream=True
+    )
+    yield from stream
+    
+    # Only a stream that was read to the end is cached
+    cache_response(cache_key, stream.response, stage)
+    usage_ledger.record(stream.response, messages, stage)
@@ -0,0 +1,108 @@
+import gzip
+import json
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from config import HTTP_POOL_SIZE, HTTP_TIMEOUT, HTTP_GZIP_REQUESTS
+
+# Request bodies smaller than this are sent uncompressed even when gzip is enabled,
+# because compressing them costs more than it saves
+GZIP_MIN_BYTES = 1024
+
+class PooledTransport:
+    """
+    A thread-safe HTTP transport that keeps one pooled, keep-alive session per base URL.
+    """
+    
+    def __init__(self, timeout=HTTP_TIMEOUT, gzip_requests=HTTP_GZIP_REQUESTS):
+        """
+        Initialise the transport.
+        
+        Args:
+            timeout (float, optional): The request timeout in seconds.
+            gzip_requests (bool, optional): Whether to gzip large request bodies.
+        """
+        self.timeout = timeout
+        self.gzip_requests = gzip_requests
+        self._sessions = {}
+        self._lock = threading.Lock()
+    
+    def get_session(self, base_url, pool_size=HTTP_POOL_SIZE):
+        """
+        Get (or create) the pooled session for a base URL.
+        
+        Args:
+            base_url (str): The provider base URL.
+            pool_size (int, optional): The maximum number of kept-alive connections.
+        
+        Returns:
+            requests.Session: The session shared by every request to this base URL.
+        """
+        with self._lock:
+            session = self._sessions.get(base_url)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                session.headers.update({"Connection": "keep-alive"})
+                self._sessions[base_url] = session
+            return session
+    
+    def post_json(self, base_url, path, payload, headers, pool_size=HTTP_POOL_SIZE, stream=False, timeout=None):
+        """
+        POST a JSON payload through the pooled session for a base URL.
+        
+        Args:
+            base_url (str): The provider base URL.
+            path (str): The path to append to the base URL.
+            payload (dict): The JSON payload.
+            headers (dict): The request headers.
+            pool_size (int, optional): The pool size used if the session has to be created.
+            stream (bool, optional): Whether to leave the body unread, to be iterated as it arrives.
+            timeout (float, optional): The request timeout, if not the transport's own.
+        
+        Returns:
+            requests.Response: The HTTP response.
+        """
+        session = self.get_session(base_url, pool_size)
+        headers = dict(headers)
+        body = json.dumps(payload).encode("utf-8")
+        
+        # Compress large bodies if enabled (not every provider accepts this, so it is off by default)
+        if self.gzip_requests and len(body) >= GZIP_MIN_BYTES:
+            body = gzip.compress(body)
+            headers["Content-Encoding"] = "gzip"
+        
+        return session.post(
+            f"{base_url}{path}",
+            headers=headers,
+            data=body,
+            timeout=timeout or self.timeout,
+            stream=stream
+        )
+    
+    def close(self):
+        """Close every pooled session."""
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions = {}
+
+
+# The process-wide transport shared by every AIClient
+_transport = None
+_transport_lock = threading.Lock()
+
+def get_transport():
+    """
+    Get the shared pooled transport, creating it on first use.
+    
+    Returns:
+        PooledTransport: The process-wide transport.
+    """
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            _transport = PooledTransport()
+        return _transport
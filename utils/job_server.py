@@ -0,0 +1,449 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from config import get_run_config, JOB_MAX_RUNNING, JOB_MAX_PER_USER, JOB_HISTORY_SIZE, JOB_ABANDON_SECONDS, RUN_TIMEOUT_SECONDS
+from utils.cancellation import CancelToken, RunCancelled, use_cancel_token
+
+# Progress events kept per job; a subscriber that falls further behind gets the job's state instead
+JOB_EVENT_HISTORY = 200
+
+class Job:
+    """
+    One research run submitted to the job server. The run publishes its progress as
+    events, and any number of subscribers (e.g. the browser sessions that asked for it)
+    read them with updates().
+    """
+    
+    def __init__(self, job_id, user, question, run_config):
+        """
+        Initialise the job.
+        
+        Args:
+            job_id (str): The ID of the job, which is also its run ID.
+            user (str): The user who submitted the job.
+            question (str): The research question.
+            run_config (RunConfig): The provider, model and API key of the run.
+        """
+        self.job_id = job_id
+        self.user = user
+        self.question = question
+        self.run_config = run_config
+        self.subscribers = {user}
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        
+        # Cancels the run; its deadline is set when it starts, so time spent queued does not count
+        self.cancel_token = CancelToken()
+        
+        # When a subscriber last read the job, and how many are blocked waiting for it to finish,
+        # so runs nobody is watching any more can be cancelled
+        self.last_seen = time.monotonic()
+        self.waiting = 0
+        
+        # The latest value of every field published so far, and the recent events themselves
+        self.state = {"status": "queued", "progress": 0}
+        self._events = deque(maxlen=JOB_EVENT_HISTORY)
+        self._sequence = 0
+        self._condition = threading.Condition()
+    
+    @property
+    def status(self):
+        """The job's status: queued, running, completed, cancelled or error."""
+        return self.state["status"]
+    
+    @property
+    def done(self):
+        """Whether the job has finished, successfully or not."""
+        return self.status in ("completed", "cancelled", "error")
+    
+    def publish(self, update):
+        """
+        Publish a progress event to the job's subscribers.
+        
+        Args:
+            update (dict): The fields that changed (status, message, progress, subtasks,
+                partial_report, report, usage or language_code).
+        """
+        with self._condition:
+            self._sequence += 1
+            self._events.append((self._sequence, update))
+            self.state.update(update)
+            self._condition.notify_all()
+    
+    def updates(self, cursor=0, timeout=None):
+        """
+        Get the events published after a cursor, waiting for one if there are none yet.
+        
+        Args:
+            cursor (int, optional): The cursor returned by the previous call (0 for every event).
+            timeout (float, optional): The longest time to wait for an event (None waits until
+                there is one, 0 does not wait).
+        
+        Returns:
+            tuple: The new events, and the cursor to pass to the next call. A subscriber whose
+                events are no longer kept gets the job's whole state as one event.
+        """
+        with self._condition:
+            self.last_seen = time.monotonic()
+            self._condition.wait_for(lambda: self._sequence > cursor or self.done, timeout)
+            
+            oldest = self._events[0][0] if self._events else self._sequence + 1
+            if cursor + 1 < oldest:
+                return [dict(self.state)], self._sequence
+            return [update for sequence, update in self._events if sequence > cursor], self._sequence
+    
+    def wait_for_update(self, cursor, timeout=None):
+        """
+        Wait until an event is published after a cursor (or the job finishes), without reading it.
+        
+        Args:
+            cursor (int): The cursor returned by the last call to updates().
+            timeout (float, optional): The longest time to wait.
+        
+        Returns:
+            bool: Whether there is something new to read.
+        """
+        with self._condition:
+            self.last_seen = time.monotonic()
+            return self._condition.wait_for(lambda: self._sequence > cursor or self.done, timeout)
+    
+    def wait(self, timeout=None):
+        """
+        Wait for the job to finish.
+        
+        Args:
+            timeout (float, optional): The longest time to wait.
+        
+        Returns:
+            bool: Whether the job has finished.
+        """
+        with self._condition:
+            self.waiting += 1
+            try:
+                return self._condition.wait_for(lambda: self.done, timeout)
+            finally:
+                self.waiting -= 1
+
+
+class JobServer:
+    """
+    Runs research jobs for many users on a bounded set of job threads. Each user's jobs
+    queue in the order they were submitted, and a free thread takes the next job of the
+    user after the one it served last, so one user queueing many jobs cannot hold up the
+    others. A question already queued or running with the same settings is not run
+    twice: the second submitter subscribes to the first job. A job is cancelled when every
+    subscriber has cancelled it, or when none has checked on it for a while.
+    """
+    
+    def __init__(self, max_running=JOB_MAX_RUNNING, max_per_user=JOB_MAX_PER_USER, history=JOB_HISTORY_SIZE,
+                 abandon_after=JOB_ABANDON_SECONDS, timeout=RUN_TIMEOUT_SECONDS):
+        """
+        Initialise the job server. Job threads are started as jobs arrive.
+        
+        Args:
+            max_running (int, optional): The number of jobs running at once.
+            max_per_user (int, optional): The number of one user's jobs running at once.
+            history (int, optional): The number of finished jobs kept for their subscribers.
+            abandon_after (float, optional): Seconds without a subscriber reading a job before it is cancelled (0 for never).
+            timeout (float, optional): The time limit of each job's run in seconds (0 for none).
+        """
+        self.max_running = max(max_running, 1)
+        self.max_per_user = max(max_per_user, 1)
+        self.history = history
+        self.abandon_after = abandon_after
+        self.timeout = timeout
+        self._reaper = None
+        
+        self._jobs = OrderedDict()
+        self._active = {}
+        self._queues = OrderedDict()
+        self._running = {}
+        self._threads = []
+        self._condition = threading.Condition()
+        
+        # Counters, reported by stats()
+        self.submitted = 0
+        self.shared = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.failed = 0
+    
+    def submit(self, question, user="default", run_config=None):
+        """
+        Queue a research job, or subscribe to an identical one already queued or running.
+        
+        Args:
+            question (str): The research question.
+            user (str, optional): The user (e.g. browser session) submitting the job.
+            run_config (RunConfig, optional): The provider, model and API key of the run.
+        
+        Returns:
+            Job: The job.
+        """
+        from utils.run_manifest import new_run_id
+        
+        run_config = run_config or get_run_config()
+        key = (" ".join(question.split()), run_config)
+        
+        with self._condition:
+            job = self._active.get(key)
+            if job is not None:
+                job.subscribers.add(user)
+                self.shared += 1
+                return job
+            
+            job = Job(new_run_id(), user, question, run_config)
+            self._jobs[job.job_id] = job
+            self._active[key] = job
+            self._queues.setdefault(user, deque()).append(job)
+            self.submitted += 1
+            
+            queued = sum(len(jobs) for jobs in self._queues.values()) - 1
+            job.publish({"status": "queued", "message": f"Waiting for a free slot ({queued} other jobs queued)...", "progress": 0})
+            
+            if len(self._threads) < self.max_running:
+                thread = threading.Thread(target=self._work, name=f"job-{len(self._threads) + 1}", daemon=True)
+                self._threads.append(thread)
+                thread.start()
+            if self._reaper is None and self.abandon_after:
+                self._reaper = threading.Thread(target=self._reap, name="job-reaper", daemon=True)
+                self._reaper.start()
+            self._condition.notify_all()
+        
+        return job
+    
+    def get(self, job_id):
+        """Get a job by its ID, or None if it is unknown or no longer kept."""
+        with self._condition:
+            return self._jobs.get(job_id)
+    
+    def cancel(self, job_id, user=None, reason="Research cancelled"):
+        """
+        Cancel a job, or a user's subscription to it. A job shared with other subscribers
+        keeps running for them; otherwise a queued job is dropped and a running one stops
+        at its next task or model call.
+        
+        Args:
+            job_id (str): The ID of the job.
+            user (str, optional): The user cancelling (None cancels the job for everyone).
+            reason (str, optional): Why the job was cancelled, published to its subscribers.
+        
+        Returns:
+            bool: Whether the job itself was cancelled.
+        """
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if job is None or job.done:
+                return False
+            if user is not None:
+                job.subscribers.discard(user)
+                if job.subscribers:
+                    return False
+            self._cancel(job, reason)
+            return True
+    
+    def _cancel(self, job, reason):
+        """Cancel a job, with the server's lock held."""
+        queued = self._queues.get(job.user)
+        if queued is not None and job in queued:
+            # The job never started, so it finishes here
+            queued.remove(job)
+            if not queued:
+                del self._queues[job.user]
+            self._active.pop((" ".join(job.question.split()), job.run_config), None)
+            self.cancelled += 1
+            job.publish({"status": "cancelled", "message": reason})
+            self._forget_finished()
+        else:
+            job.cancel_token.cancel(reason)
+    
+    def _reap(self):
+        """The loop of the reaper thread: cancel the jobs no subscriber has read for a while."""
+        while True:
+            time.sleep(max(self.abandon_after / 4, 0.1))
+            now = time.monotonic()
+            with self._condition:
+                abandoned = [
+                    job for job in self._jobs.values()
+                    if not job.done and not job.waiting and now - job.last_seen > self.abandon_after
+                ]
+                for job in abandoned:
+                    self._cancel(job, "Research cancelled: nobody is watching it")
+    
+    def _next_job(self):
+        """Take the next job to run, going round the users with queued jobs in turn."""
+        for user, jobs in self._queues.items():
+            if jobs and self._running.get(user, 0) < self.max_per_user:
+                job = jobs.popleft()
+                
+                # The user goes to the back of the round
+                if jobs:
+                    self._queues.move_to_end(user)
+                else:
+                    del self._queues[user]
+                return job
+        return None
+    
+    def _work(self):
+        """The loop of a job thread: run the next fair job, or wait for one."""
+        while True:
+            with self._condition:
+                job = self._next_job()
+                while job is None:
+                    self._condition.wait()
+                    job = self._next_job()
+                self._running[job.user] = self._running.get(job.user, 0) + 1
+            
+            try:
+                run_job(job, self.timeout)
+            finally:
+                with self._condition:
+                    self._running[job.user] -= 1
+                    if not self._running[job.user]:
+                        del self._running[job.user]
+                    self._active.pop((" ".join(job.question.split()), job.run_config), None)
+                    if job.status == "completed":
+                        self.completed += 1
+                    elif job.status == "cancelled":
+                        self.cancelled += 1
+                    else:
+                        self.failed += 1
+                    self._forget_finished()
+                    self._condition.notify_all()
+    
+    def _forget_finished(self):
+        """Drop the oldest finished jobs beyond the history size."""
+        finished = [job_id for job_id, job in self._jobs.items() if job.done]
+        for job_id in finished[:max(len(finished) - self.history, 0)]:
+            del self._jobs[job_id]
+    
+    def stats(self):
+        """
+        Get the server's counters.
+        
+        Returns:
+            dict: The jobs queued and running now (in total and per user), and the jobs
+                submitted, shared with an identical job, completed, cancelled and failed.
+        """
+        with self._condition:
+            return {
+                "max_running": self.max_running,
+                "queued": sum(len(jobs) for jobs in self._queues.values()),
+                "running": sum(self._running.values()),
+                "queued_by_user": {user: len(jobs) for user, jobs in self._queues.items()},
+                "running_by_user": dict(self._running),
+                "submitted": self.submitted,
+                "shared": self.shared,
+                "completed": self.completed,
+                "cancelled": self.cancelled,
+                "failed": self.failed
+            }
+
+
+def run_job(job, timeout=RUN_TIMEOUT_SECONDS):
+    """
+    Run a job's research pipeline, publishing its progress, in the job's trace context and
+    with its RunConfig and cancel token. Errors are published rather than raised.
+    
+    Args:
+        job (Job): The job.
+        timeout (float, optional): The run's time limit in seconds (0 for none).
+    """
+    from config import use_run_config
+    from utils.tracing import trace_context
+    from utils.usage import usage_ledger
+    
+    job.started_at = time.time()
+    job.cancel_token.set_deadline(timeout)
+    try:
+        with trace_context(run_id=job.job_id), use_run_config(job.run_config), use_cancel_token(job.cancel_token):
+            _run_pipeline(job)
+    except RunCancelled as e:
+        job.publish({"status": "cancelled", "message": str(e), "usage": usage_ledger.take(job.job_id)})
+    except Exception as e:
+        job.publish({"status": "error", "message": f"Error: {str(e)}", "progress": 0, "usage": usage_ledger.take(job.job_id)})
+    finally:
+        job.finished_at = time.time()
+
+def _run_pipeline(job):
+    """Run the research pipeline for run_job, publishing its progress."""
+    # Import here to avoid circular imports
+    from agents.task_manager import create_research_plan
+    from agents.report_generator import generate_report_stream
+    from main import build_research_graph, save_report
+    from utils.usage import usage_ledger
+    from utils.worker_pool import worker_pool
+    
+    research_question = job.question
+    job.publish({"status": "running", "message": "Creating research plan...", "progress": 10})
+    
+    # Step 1: Create a research plan
+    research_plan = worker_pool.run("plan", create_research_plan, research_question)
+    subtasks = research_plan.get("subtasks", [])
+    language_code = research_plan.get("language", "en")
+    
+    job.publish({
+        "status": "running",
+        "message": f"Research plan created with {len(subtasks)} subtasks",
+        "progress": 20,
+        "subtasks": subtasks,
+        "language_code": language_code
+    })
+    
+    # Steps 2-4: Retrieve, analyse and report, each task starting as soon as its inputs are ready
+    job.publish({
+        "status": "running",
+        "message": f"Retrieving and analysing information for {len(subtasks)} subtasks...",
+        "progress": 20
+    })
+    
+    def stream_report(research_question, analyses, subtasks, language_code):
+        # Publish the final report as it is written
+        job.publish({"status": "running", "message": "Generating final report...", "progress": 90})
+        
+        report = ""
+        last_sent = 0
+        for chunk in generate_report_stream(research_question, analyses, subtasks, language_code):
+            report += chunk
+            
+            # Pages only redraw a few times a second, so don't publish every token
+            if time.time() - last_sent >= 0.2:
+                job.publish({"partial_report": report})
+                last_sent = time.time()
+        return report
+    
+    graph = build_research_graph(research_question, subtasks, language_code, report_function=stream_report)
+    
+    # Retrieval and analysis of every subtask take the progress from 20% to 90%
+    finished_tasks = []
+    
+    def on_complete(name, result):
+        # Only the retrieval and analysis of subtasks move the progress bar
+        stage, _, subtask_id = name.partition(":")
+        if stage not in ("retrieve", "analyse"):
+            return
+        finished_tasks.append(name)
+        job.publish({
+            "status": "running",
+            "message": f"{'Retrieved' if stage == 'retrieve' else 'Analysed'} information for subtask {subtask_id}",
+            "progress": 20 + int(len(finished_tasks) * 70 / (2 * len(subtasks))),
+            "usage": usage_ledger.summary(job.job_id)
+        })
+    
+    report = graph.run(on_complete=on_complete)["report"]
+    print(graph.format_timings())
+    save_report(report, research_question)
+    
+    job.publish({
+        "status": "completed",
+        "message": "Research completed successfully!",
+        "progress": 100,
+        "report": report,
+        # The run's calls are dropped from the ledger once reported
+        "usage": usage_ledger.take(job.job_id)
+    })
+
+
+# The process-wide job server, shared by every browser session
+job_server = JobServer()
@@ -0,0 +1,372 @@
+import argparse
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+from config import SEARCH_INDEX_PATH, SEARCH_CORPUS_DIR, SEARCH_RESULT_LIMIT
+
+# BM25 parameters: term frequency saturation and document length normalisation
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Documents are split into passages of about this many words, so a result is about one thing
+PASSAGE_WORDS = 200
+
+# Words either side of the best match in a snippet
+SNIPPET_WORDS = 30
+
+# Files read from a corpus directory
+CORPUS_EXTENSIONS = (".md", ".txt", ".html", ".htm", ".jsonl")
+
+# Common English, Spanish and French words, which say nothing about what a passage is about
+STOPWORDS = frozenset("""
+a about an and are as at be by for from has have in is it its of on or that the this to was were will with what how why
+el la los las un una y de del en que es por para con se su al lo como
+le les des du et est en une pour par dans sur qui que au aux ce il elle
+""".split())
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+class LocalIndex:
+    """
+    An inverted index over a local document corpus, stored in a single SQLite file and
+    searched with BM25. Documents are split into passages, and each result carries the
+    passage around the best match as its snippet.
+    """
+    
+    def __init__(self, path=SEARCH_INDEX_PATH):
+        """
+        Open an index, creating an empty one if needed.
+        
+        Args:
+            path (str): Path to the SQLite index file.
+        """
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        # sqlite3 connections cannot be shared between threads, so each thread gets its own
+        self._local = threading.local()
+        self._lengths = None
+        self._lengths_lock = threading.Lock()
+        
+        connection = self._connection()
+        connection.executescript("""
+            CREATE TABLE IF NOT EXISTS passages (
+                passage_id INTEGER PRIMARY KEY,
+                title TEXT NOT NULL,
+                url TEXT NOT NULL,
+                length INTEGER NOT NULL,
+                content TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS postings (
+                term TEXT NOT NULL,
+                passage_id INTEGER NOT NULL,
+                frequency INTEGER NOT NULL,
+                PRIMARY KEY (term, passage_id)
+            ) WITHOUT ROWID;
+        """)
+        connection.commit()
+    
+    def _connection(self):
+        """Get this thread's connection to the index."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            self._local.connection = connection
+        return connection
+    
+    def build(self, documents):
+        """
+        Replace the contents of the index with a set of documents.
+        
+        Args:
+            documents (iterable): Dicts with the title, url and content of each document.
+        
+        Returns:
+            tuple: The number of documents and passages indexed.
+        """
+        connection = self._connection()
+        document_count = 0
+        passage_count = 0
+        
+        with connection:
+            connection.execute("DELETE FROM passages")
+            connection.execute("DELETE FROM postings")
+            
+            for document in documents:
+                document_count += 1
+                for passage in split_passages(document["content"]):
+                    terms = tokenize(passage)
+                    if not terms:
+                        continue
+                    
+                    cursor = connection.execute(
+                        "INSERT INTO passages (title, url, length, content) VALUES (?, ?, ?, ?)",
+                        (document["title"], document["url"], len(terms), passage)
+                    )
+                    connection.executemany(
+                        "INSERT INTO postings (term, passage_id, frequency) VALUES (?, ?, ?)",
+                        [(term, cursor.lastrowid, frequency) for term, frequency in Counter(terms).items()]
+                    )
+                    passage_count += 1
+        
+        connection.execute("VACUUM")
+        with self._lengths_lock:
+            self._lengths = None
+        return document_count, passage_count
+    
+    def lengths(self):
+        """Get the length in terms of every passage, loaded once and kept in memory."""
+        with self._lengths_lock:
+            if self._lengths is None:
+                self._lengths = dict(self._connection().execute("SELECT passage_id, length FROM passages"))
+            return self._lengths
+    
+    def search(self, query, limit=SEARCH_RESULT_LIMIT):
+        """
+        Find the passages that best match a query.
+        
+        Args:
+            query (str): The search query.
+            limit (int, optional): The maximum number of results.
+        
+        Returns:
+            list: Search result items (title, url, snippet, content and score), best first.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        lengths = self.lengths()
+        if not terms or not lengths:
+            return []
+        
+        placeholders = ",".join("?" * len(terms))
+        rows = self._connection().execute(
+            f"SELECT term, passage_id, frequency FROM postings WHERE term IN ({placeholders})",
+            terms
+        ).fetchall()
+        
+        postings = {}
+        for term, passage_id, frequency in rows:
+            postings.setdefault(term, []).append((passage_id, frequency))
+        
+        # Score every passage holding at least one of the terms
+        passage_count = len(lengths)
+        average_length = sum(lengths.values()) / passage_count
+        scores = Counter()
+        for term, term_postings in postings.items():
+            idf = math.log((passage_count - len(term_postings) + 0.5) / (len(term_postings) + 0.5) + 1)
+            for passage_id, frequency in term_postings:
+                length_norm = 1 - BM25_B + BM25_B * lengths[passage_id] / average_length
+                scores[passage_id] += idf * frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * length_norm)
+        
+        # Several passages of one document would crowd out the others, so keep each document's best
+        results = []
+        seen_urls = set()
+        for passage_id, score in scores.most_common():
+            title, url, content = self._connection().execute(
+                "SELECT title, url, content FROM passages WHERE passage_id = ?", (passage_id,)
+            ).fetchone()
+            if url in seen_urls:
+                continue
+            seen_urls.add(url)
+            
+            results.append({
+                "title": title,
+                "url": url,
+                "snippet": extract_snippet(content, set(terms)),
+                "content": content,
+                "score": round(score, 4)
+            })
+            if len(results) >= limit:
+                break
+        
+        return results
+    
+    def stats(self):
+        """
+        Get the size of the index.
+        
+        Returns:
+            dict: The number of passages, distinct terms and documents.
+        """
+        connection = self._connection()
+        return {
+            "passages": connection.execute("SELECT COUNT(*) FROM passages").fetchone()[0],
+            "terms": connection.execute("SELECT COUNT(DISTINCT term) FROM postings").fetchone()[0],
+            "documents": connection.execute("SELECT COUNT(DISTINCT url) FROM passages").fetchone()[0]
+        }
+
+
+def tokenize(text):
+    """
+    Split text into lowercase index terms, leaving out stopwords and single characters.
+    
+    Args:
+        text (str): The text.
+    
+    Returns:
+        list: The terms, in order.
+    """
+    return [
+        token for token in TOKEN_PATTERN.findall(text.lower())
+        if len(token) > 1 and token not in STOPWORDS
+    ]
+
+def split_passages(content, words=PASSAGE_WORDS):
+    """
+    Split a document into passages of about the given number of words, keeping paragraphs whole where possible.
+    
+    Args:
+        content (str): The document text.
+        words (int, optional): The target passage length in words.
+    
+    Returns:
+        list: The passages.
+    """
+    passages = []
+    current = []
+    for paragraph in re.split(r"\n\s*\n", content):
+        paragraph_words = paragraph.split()
+        if current and len(current) + len(paragraph_words) > words:
+            passages.append(" ".join(current))
+            current = []
+        current.extend(paragraph_words)
+        
+        # A paragraph longer than a passage is cut into several
+        while len(current) > words * 1.5:
+            passages.append(" ".join(current[:words]))
+            current = current[words:]
+    
+    if current:
+        passages.append(" ".join(current))
+    return passages
+
+def extract_snippet(content, terms, words=SNIPPET_WORDS):
+    """
+    Take the window of a passage holding the most query terms.
+    
+    Args:
+        content (str): The passage.
+        terms (set): The query terms.
+        words (int, optional): Words either side of the window's centre.
+    
+    Returns:
+        str: The snippet, with ellipses where it was cut.
+    """
+    content_words = content.split()
+    if len(content_words) <= 2 * words:
+        return content
+    
+    hits = [1 if set(tokenize(word)) & terms else 0 for word in content_words]
+    window = 2 * words
+    current_hits = sum(hits[:window])
+    best_start, best_hits = 0, current_hits
+    for start in range(1, len(content_words) - window + 1):
+        current_hits += hits[start + window - 1] - hits[start - 1]
+        if current_hits > best_hits:
+            best_start, best_hits = start, current_hits
+    
+    snippet = " ".join(content_words[best_start:best_start + window])
+    prefix = "... " if best_start > 0 else ""
+    suffix = " ..." if best_start + window < len(content_words) else ""
+    return f"{prefix}{snippet}{suffix}"
+
+def read_corpus(directory):
+    """
+    Read the documents of a corpus directory: Markdown, text and HTML files (one document
+    each), and JSONL files with a title, url and content (or text) on each line.
+    
+    Args:
+        directory (str): The corpus directory, searched recursively.
+    
+    Yields:
+        dict: The title, url and content of each document.
+    """
+    for root, _, files in os.walk(directory):
+        for filename in sorted(files):
+            path = os.path.join(root, filename)
+            extension = os.path.splitext(filename)[1].lower()
+            if extension not in CORPUS_EXTENSIONS:
+                continue
+            
+            with open(path, encoding="utf-8", errors="replace") as f:
+                if extension == ".jsonl":
+                    for line_number, line in enumerate(f, 1):
+                        try:
+                            entry = json.loads(line)
+                        except json.JSONDecodeError:
+                            continue
+                        if not isinstance(entry, dict):
+                            continue
+                        content = entry.get("content") or entry.get("text")
+                        if content:
+                            yield {
+                                "title": entry.get("title") or f"{filename} line {line_number}",
+                                "url": entry.get("url") or f"{path}#{line_number}",
+                                "content": content
+                            }
+                    continue
+                
+                content = f.read()
+            
+            if extension in (".html", ".htm"):
+                title_match = re.search(r"<title>(.*?)</title>", content, re.IGNORECASE | re.DOTALL)
+                title = title_match.group(1).strip() if title_match else filename
+                content = re.sub(r"<(script|style)[\s\S]*?</\1>|<[^>]+>", " ", content, flags=re.IGNORECASE)
+            else:
+                # The first Markdown heading is the title, if there is one
+                heading = re.search(r"^#+\s+(.+)$", content, re.MULTILINE)
+                title = heading.group(1).strip() if heading else os.path.splitext(filename)[0]
+            
+            yield {"title": title, "url": os.path.abspath(path), "content": content}
+
+def build_index(corpus_dir=SEARCH_CORPUS_DIR, index_path=SEARCH_INDEX_PATH):
+    """
+    Build (or rebuild) the search index of a corpus directory.
+    
+    Args:
+        corpus_dir (str, optional): The corpus directory.
+        index_path (str, optional): The index file.
+    
+    Returns:
+        LocalIndex: The index.
+    """
+    index = LocalIndex(index_path)
+    started_at = time.perf_counter()
+    documents, passages = index.build(read_corpus(corpus_dir))
+    print(f"Indexed {documents} documents ({passages} passages) from {corpus_dir} in {time.perf_counter() - started_at:.1f}s")
+    return index
+
+def main():
+    """Command-line building and querying of the local search index."""
+    parser = argparse.ArgumentParser(description="Build or query the local search index.")
+    parser.add_argument("--index", default=SEARCH_INDEX_PATH, help="The index file")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    
+    build_parser = subparsers.add_parser("build", help="Index every document in a corpus directory")
+    build_parser.add_argument("corpus", nargs="?", default=SEARCH_CORPUS_DIR, help="The corpus directory")
+    
+    search_parser = subparsers.add_parser("search", help="Search the index")
+    search_parser.add_argument("query", help="The search query")
+    search_parser.add_argument("--limit", type=int, default=5, help="The number of results")
+    
+    args = parser.parse_args()
+    
+    if args.command == "build":
+        index = build_index(args.corpus, args.index)
+        print(f"{index.stats()['terms']} distinct terms in {args.index}")
+    elif args.command == "search":
+        index = LocalIndex(args.index)
+        started_at = time.perf_counter()
+        results = index.search(args.query, args.limit)
+        print(f"{len(results)} results in {(time.perf_counter() - started_at) * 1000:.2f} ms")
+        for result in results:
+            print(f"\n{result['score']:.2f}  {result['title']}\n      {result['url']}\n      {result['snippet']}")
+
+if __name__ == "__main__":
+    main()
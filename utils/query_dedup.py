@@ -0,0 +1,130 @@
+import threading
+import unicodedata
+from utils.local_index import STOPWORDS, TOKEN_PATTERN
+
+def normalize_query(query):
+    """
+    Reduce a search query to the terms that decide its results, so that variants such as
+    "History of X" and "X history" compare equal: accents, case, punctuation, stopwords,
+    plural endings and word order are ignored.
+    
+    Args:
+        query (str): The search query.
+    
+    Returns:
+        str: The normalised query.
+    """
+    text = unicodedata.normalize("NFKD", query.casefold())
+    text = "".join(character for character in text if not unicodedata.combining(character))
+    
+    # Unlike the index's tokenizer, single characters are kept, so "part 1" and "part 2" stay apart
+    terms = set()
+    for term in TOKEN_PATTERN.findall(text):
+        if term in STOPWORDS:
+            continue
+        if len(term) > 4 and term.endswith("ies"):
+            term = term[:-3] + "y"
+        elif len(term) > 3 and term.endswith("s") and not term.endswith("ss"):
+            term = term[:-1]
+        terms.add(term)
+    
+    # A query of nothing but stopwords is kept as it is
+    return " ".join(sorted(terms)) or " ".join(text.split())
+
+
+class QueryPlan:
+    """
+    The distinct search queries of a research plan. Each distinct query is searched once,
+    and its results are fanned back out to every subtask query that normalises to it.
+    """
+    
+    def __init__(self, subtasks):
+        """
+        Initialise the plan.
+        
+        Args:
+            subtasks (list): The subtasks of the research plan.
+        """
+        # Normalised query -> the first query seen with it, which is the one searched
+        self._searched = {}
+        
+        # Every query of the plan -> the query searched for it
+        self.representative = {}
+        self.total = 0
+        
+        for subtask in subtasks:
+            for query in subtask.get("search_queries", []):
+                self.total += 1
+                searched = self._searched.setdefault(normalize_query(query), query)
+                self.representative[query] = searched
+    
+    @property
+    def queries(self):
+        """The queries to search, one per distinct query, in plan order."""
+        return list(self._searched.values())
+    
+    @property
+    def saved(self):
+        """The searches saved by deduplication."""
+        return self.total - len(self._searched)
+    
+    def queries_for(self, subtask):
+        """Get the queries searched for a subtask's queries, without repeats."""
+        return list(dict.fromkeys(self.representative[query] for query in subtask.get("search_queries", [])))
+    
+    def results_for(self, subtask, results):
+        """
+        Fan the results of the searched queries back out to a subtask's own queries.
+        
+        Args:
+            subtask (dict): A subtask of the plan.
+            results (dict): The results of the searched queries, keyed by query.
+        
+        Returns:
+            dict: The results of each of the subtask's queries that were found.
+        """
+        return {
+            query: results[self.representative[query]]
+            for query in subtask.get("search_queries", [])
+            if self.representative[query] in results
+        }
+
+
+class QueryStats:
+    """Counts the plan queries seen and the searches saved by deduplicating them."""
+    
+    def __init__(self):
+        """Initialise the counters."""
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.saved = 0
+    
+    def plan(self, subtasks):
+        """
+        Deduplicate the queries of a research plan, counting the searches saved.
+        
+        Args:
+            subtasks (list): The subtasks of the research plan.
+        
+        Returns:
+            QueryPlan: The plan's distinct queries.
+        """
+        query_plan = QueryPlan(subtasks)
+        with self._lock:
+            self.queries += query_plan.total
+            self.saved += query_plan.saved
+        return query_plan
+    
+    def stats(self):
+        """
+        Get the counters.
+        
+        Returns:
+            dict: The plan queries seen, and the searches saved by deduplication.
+        """
+        with self._lock:
+            return {"queries": self.queries, "saved": self.saved}
+
+
+# The process-wide counters
+query_stats = QueryStats()
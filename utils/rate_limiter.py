@@ -0,0 +1,252 @@
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from config import get_rate_limits, RATE_LIMIT_MAX_RETRIES, RATE_LIMIT_BACKOFF_BASE, RATE_LIMIT_BACKOFF_MAX
+from utils.cancellation import cancellable_sleep, cancellable_sleep_async
+
+# Responses that mean "slow down and try again" rather than "this request is wrong"
+RETRYABLE_STATUS_CODES = {429, 502, 503, 504}
+
+class TokenBucket:
+    """
+    A token bucket refilled continuously at a per-minute rate.
+    Callers reserve tokens up front and are told how long to wait for them, so
+    the bucket can go into debt and concurrent callers queue up in order.
+    """
+    
+    def __init__(self, rate_per_minute, capacity=None):
+        """
+        Initialise a full bucket.
+        
+        Args:
+            rate_per_minute (float): The refill rate.
+            capacity (float, optional): The largest burst. Defaults to one minute of refill.
+        """
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+    
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+    
+    def reserve(self, amount, now):
+        """
+        Take tokens from the bucket.
+        
+        Args:
+            amount (float): The number of tokens to take.
+            now (float): The current monotonic time.
+        
+        Returns:
+            float: How many seconds the caller must wait before using the tokens.
+        """
+        self._refill(now)
+        self.tokens -= amount
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+    
+    def refund(self, amount, now):
+        """Return tokens to the bucket (a negative amount takes more)."""
+        self._refill(now)
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class RateLimiter:
+    """
+    Keeps one provider's calls within its requests-per-minute and tokens-per-minute
+    quotas, and decides how long to back off when the provider pushes back anyway.
+    Shared by every thread and event loop calling that provider.
+    """
+    
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0, max_retries=RATE_LIMIT_MAX_RETRIES,
+                 backoff_base=RATE_LIMIT_BACKOFF_BASE, backoff_max=RATE_LIMIT_BACKOFF_MAX):
+        """
+        Initialise the limiter.
+        
+        Args:
+            requests_per_minute (float, optional): The request quota (0 for no limit).
+            tokens_per_minute (float, optional): The token quota (0 for no limit).
+            max_retries (int, optional): How many times a throttled call is retried.
+            backoff_base (float, optional): The first backoff ceiling in seconds.
+            backoff_max (float, optional): The largest backoff ceiling in seconds.
+        """
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._lock = threading.Lock()
+        
+        # Set from Retry-After, so every caller waits rather than only the throttled one
+        self._paused_until = 0.0
+        
+        # Counters, reported by stats()
+        self.calls = 0
+        self.throttled = 0
+        self.waited_seconds = 0.0
+    
+    def reserve(self, tokens=0):
+        """
+        Reserve quota for one call.
+        
+        Args:
+            tokens (int, optional): The estimated tokens of the call.
+        
+        Returns:
+            float: How many seconds to wait before making the call.
+        """
+        with self._lock:
+            now = time.monotonic()
+            delay = max(0.0, self._paused_until - now)
+            if self.requests is not None:
+                delay = max(delay, self.requests.reserve(1, now))
+            if self.tokens is not None and tokens:
+                delay = max(delay, self.tokens.reserve(min(tokens, self.tokens.capacity), now))
+            self.calls += 1
+            self.waited_seconds += delay
+            return delay
+    
+    def acquire(self, tokens=0):
+        """Wait until one call fits in the quota (or the current run is cancelled)."""
+        delay = self.reserve(tokens)
+        if delay > 0:
+            cancellable_sleep(delay)
+    
+    async def acquire_async(self, tokens=0):
+        """Async version of acquire, which waits without blocking the event loop."""
+        delay = self.reserve(tokens)
+        if delay > 0:
+            await cancellable_sleep_async(delay)
+    
+    def record_usage(self, estimated_tokens, used_tokens):
+        """
+        Correct the token bucket once the provider reports the real usage of a call.
+        
+        Args:
+            estimated_tokens (int): The tokens reserved for the call.
+            used_tokens (int): The tokens the provider counted, or None if not reported.
+        """
+        if self.tokens is None or used_tokens is None:
+            return
+        with self._lock:
+            self.tokens.refund(estimated_tokens - used_tokens, time.monotonic())
+    
+    def backoff(self, attempt, retry_after=None):
+        """
+        Get how long to wait before retrying a throttled call.
+        
+        Args:
+            attempt (int): The number of the retry, starting at 0.
+            retry_after (float, optional): The delay the provider asked for, in seconds.
+        
+        Returns:
+            float: The delay in seconds.
+        """
+        with self._lock:
+            self.throttled += 1
+            if retry_after is not None:
+                # The provider said when the quota frees up, so hold every caller until then
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+                return retry_after
+        
+        # Full jitter keeps throttled callers from retrying in lock-step
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+    
+    def stats(self):
+        """
+        Get the counters of the limiter.
+        
+        Returns:
+            dict: The calls made, the responses throttled and the total seconds spent waiting for quota.
+        """
+        with self._lock:
+            return {"calls": self.calls, "throttled": self.throttled, "waited_seconds": self.waited_seconds}
+
+
+def parse_retry_after(value):
+    """
+    Parse a Retry-After header, given either in seconds or as an HTTP date.
+    
+    Args:
+        value (str): The header value, or None.
+    
+    Returns:
+        float: The delay in seconds, or None if the header is missing or invalid.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+def estimate_tokens(messages, max_tokens=None):
+    """
+    Estimate the tokens a call counts against the quota (about four characters per token,
+    plus the completion budget, which providers reserve up front).
+    
+    Args:
+        messages (list): The messages of the call.
+        max_tokens (int, optional): The maximum number of tokens to generate.
+    
+    Returns:
+        int: The estimated tokens.
+    """
+    prompt_characters = sum(len(str(message.get("content", ""))) for message in messages)
+    return prompt_characters // 4 + (max_tokens or 0)
+
+# One limiter per provider, shared by every client in the process
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_rate_limiter(provider):
+    """
+    Get the shared rate limiter of a provider, creating it from the configuration.
+    
+    Args:
+        provider (str): The AI provider ("mistral" or "openai").
+    
+    Returns:
+        RateLimiter: The provider's limiter.
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(provider)
+        if limiter is None:
+            requests_per_minute, tokens_per_minute = get_rate_limits(provider)
+            limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+            _limiters[provider] = limiter
+        return limiter
+
+def set_rate_limiter(provider, limiter):
+    """
+    Replace the shared rate limiter of a provider (e.g. with different quotas).
+    
+    Args:
+        provider (str): The AI provider ("mistral" or "openai").
+        limiter (RateLimiter): The new limiter.
+    """
+    with _limiters_lock:
+        _limiters[provider] = limiter
+
+def rate_limiter_stats():
+    """
+    Get the counters of every provider's limiter made so far.
+    
+    Returns:
+        dict: The stats() of each limiter, keyed by provider.
+    """
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {provider: limiter.stats() for provider, limiter in limiters.items()}
@@ -0,0 +1,275 @@
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from config import (
+    REPLAY_CASSETTE, REPLAY_MODE, REPLAY_UPSTREAM,
+    REPLAY_LATENCY, REPLAY_LATENCY_JITTER, REPLAY_FAILURE_RATE, REPLAY_SEED
+)
+from utils.cancellation import cancellable_sleep, cancellable_sleep_async
+
+# Streamed replays are split into chunks of this many words
+STREAM_CHUNK_WORDS = 4
+
+class Cassette:
+    """
+    An append-only JSONL file of recorded chat completions, keyed by the request.
+    """
+    
+    def __init__(self, path):
+        """
+        Load a cassette, or start an empty one.
+        
+        Args:
+            path (str): The cassette file.
+        """
+        self.path = path
+        self.entries = {}
+        self._lock = threading.Lock()
+        
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.entries[entry["key"]] = entry
+    
+    def get(self, key):
+        """Get the recorded entry of a request, or None."""
+        with self._lock:
+            return self.entries.get(key)
+    
+    def record(self, key, request, provider, response_data):
+        """
+        Add a recorded call to the cassette.
+        
+        Args:
+            key (str): The request key.
+            request (dict): The recorded request.
+            provider (str): The provider that answered it.
+            response_data (dict): The response, in the provider's format.
+        """
+        entry = {"key": key, "provider": provider, "recorded_at": time.time(), "request": request, "response": response_data}
+        with self._lock:
+            self.entries[key] = entry
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    
+    def __len__(self):
+        return len(self.entries)
+
+
+class ReplayBackend:
+    """
+    Answers chat completions from a cassette, with synthetic latency and injected
+    failures, so the pipeline can be run and measured with no network or API key.
+    """
+    
+    def __init__(self, cassette_path=REPLAY_CASSETTE, mode=REPLAY_MODE, upstream=REPLAY_UPSTREAM,
+                 latency=REPLAY_LATENCY, latency_jitter=REPLAY_LATENCY_JITTER, failure_rate=REPLAY_FAILURE_RATE,
+                 seed=REPLAY_SEED):
+        """
+        Initialise the backend.
+        
+        Args:
+            cassette_path (str, optional): The cassette file.
+            mode (str, optional): "replay" answers only from the cassette; "record" also sends
+                requests missing from it to the upstream provider and records the answers.
+            upstream (str, optional): The provider to record from ("mistral" or "openai").
+            latency (float, optional): Synthetic latency of each replayed call in seconds.
+            latency_jitter (float, optional): Random extra latency of up to this many seconds.
+            failure_rate (float, optional): The fraction of replayed calls that fail.
+            seed (int, optional): Seeds the jitter and failures, so runs are repeatable.
+        """
+        self.cassette = Cassette(cassette_path)
+        self.mode = mode.lower()
+        self.upstream = upstream.lower()
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+        
+        # Counters, reported by stats()
+        self.hits = 0
+        self.misses = 0
+        self.recorded = 0
+        self.failures = 0
+    
+    def create(self, chat, model, messages, temperature=0.7, max_tokens=None, stream=False):
+        """
+        Answer a chat completion from the cassette (or record it).
+        
+        Args:
+            chat (ChatCompletions): The chat completions handler, used to reach the upstream provider.
+            model (str): The model ID to use.
+            messages (list): A list of message objects.
+            temperature (float, optional): The temperature for sampling.
+            max_tokens (int, optional): The maximum number of tokens to generate.
+            stream (bool, optional): Whether to stream the completion.
+        
+        Returns:
+            ChatResponse: The recorded response, or a ChatStream of it if streaming.
+        """
+        key = request_key(messages, temperature, max_tokens)
+        entry = self.cassette.get(key)
+        
+        if entry is None and self.mode == "record":
+            # Recording is not timed, so the upstream call is made whole even when streaming
+            response = chat.request(self.upstream, chat.client.api_key, model, messages, temperature, max_tokens)
+            entry = self._record(key, model, messages, temperature, max_tokens, response)
+        else:
+            entry = self._replay(entry)
+            cancellable_sleep(self._delay())
+        
+        return self._response(entry, stream)
+    
+    async def create_async(self, chat, model, messages, temperature=0.7, max_tokens=None):
+        """Async version of create, which waits without blocking the event loop."""
+        key = request_key(messages, temperature, max_tokens)
+        entry = self.cassette.get(key)
+        
+        if entry is None and self.mode == "record":
+            response = await chat.request(self.upstream, chat.client.api_key, model, messages, temperature, max_tokens)
+            entry = self._record(key, model, messages, temperature, max_tokens, response)
+        else:
+            entry = self._replay(entry)
+            await cancellable_sleep_async(self._delay())
+        
+        return self._response(entry, False)
+    
+    def _replay(self, entry):
+        """Count a replayed call, raising for a missing recording or an injected failure."""
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                raise Exception(f"Error from REPLAY API: no recording in {self.cassette.path} for this request")
+            
+            self.hits += 1
+            if self.failure_rate and self.random.random() < self.failure_rate:
+                self.failures += 1
+                raise Exception("Error from REPLAY API: 503 - injected failure")
+        return entry
+    
+    def _delay(self):
+        with self._lock:
+            return self.latency + (self.random.uniform(0, self.latency_jitter) if self.latency_jitter else 0.0)
+    
+    def _record(self, key, model, messages, temperature, max_tokens, response):
+        request = {"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens}
+        response_data = {
+            "id": response.id,
+            "created": response.created,
+            "model": response.model,
+            "choices": [
+                {
+                    "index": choice.index,
+                    "message": {"role": choice.message.role, "content": choice.message.content},
+                    "finish_reason": choice.finish_reason
+                } for choice in response.choices
+            ],
+            "usage": response.usage
+        }
+        self.cassette.record(key, request, response.provider, response_data)
+        with self._lock:
+            self.recorded += 1
+        return self.cassette.get(key)
+    
+    def _response(self, entry, stream):
+        from utils.ai_client import ChatResponse, ChatStream
+        
+        if not stream:
+            return ChatResponse(entry["response"], entry["provider"])
+        return ChatStream(stream_lines(entry["response"]), entry["provider"])
+    
+    def stats(self):
+        """
+        Get the counters of the backend.
+        
+        Returns:
+            dict: Replayed calls, calls missing from the cassette, calls recorded and injected failures.
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "recorded": self.recorded, "failures": self.failures}
+
+
+def request_key(messages, temperature, max_tokens):
+    """
+    Get the cassette key of a request. The model is left out, so a cassette can be
+    replayed whatever model is configured.
+    
+    Args:
+        messages (list): The messages list.
+        temperature (float): The temperature setting.
+        max_tokens (int): Maximum tokens limit.
+    
+    Returns:
+        str: The key.
+    """
+    request = json.dumps({"messages": messages, "temperature": temperature, "max_tokens": max_tokens}, sort_keys=True)
+    return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+def stream_lines(response_data):
+    """
+    Turn a recorded response into the server-sent event lines of a streamed one.
+    
+    Args:
+        response_data (dict): The recorded response.
+    
+    Yields:
+        str: The lines of the stream.
+    """
+    choice = (response_data.get("choices") or [{}])[0]
+    words = (choice.get("message") or {}).get("content", "").split(" ")
+    chunks = [" ".join(words[i:i + STREAM_CHUNK_WORDS]) for i in range(0, len(words), STREAM_CHUNK_WORDS)]
+    
+    for i, chunk in enumerate(chunks):
+        last = i == len(chunks) - 1
+        event = {
+            "id": response_data.get("id"),
+            "created": response_data.get("created"),
+            "model": response_data.get("model"),
+            "choices": [
+                {
+                    "index": 0,
+                    "delta": {"content": chunk if i == 0 else f" {chunk}"},
+                    "finish_reason": choice.get("finish_reason") if last else None
+                }
+            ]
+        }
+        # Like Mistral, the last chunk carries the usage of the whole completion
+        if last and response_data.get("usage"):
+            event["usage"] = response_data["usage"]
+        yield "data: " + json.dumps(event)
+    yield "data: [DONE]"
+
+# The process-wide replay backend, created on first use
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_replay_backend():
+    """
+    Get the shared replay backend, loading the cassette on first use.
+    
+    Returns:
+        ReplayBackend: The process-wide backend.
+    """
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = ReplayBackend()
+        return _backend
+
+def set_replay_backend(backend):
+    """
+    Replace the shared replay backend (e.g. with another cassette or latency).
+    
+    Args:
+        backend (ReplayBackend): The new backend.
+    """
+    global _backend
+    with _backend_lock:
+        _backend = backend
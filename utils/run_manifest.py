@@ -0,0 +1,89 @@
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from config import RUN_MANIFEST_DIR
+
+class RunManifest:
+    """
+    The checkpoint of one research run: the result of every finished stage, saved to a
+    small JSON file after each one so a rerun with the same run ID can skip them.
+    """
+    
+    def __init__(self, run_id, directory=RUN_MANIFEST_DIR):
+        """
+        Load the manifest of a run, or start an empty one.
+        
+        Args:
+            run_id (str): The run ID.
+            directory (str, optional): The directory holding the manifests.
+        """
+        self.run_id = run_id
+        self.path = os.path.join(directory, f"{safe_run_id(run_id)}.json")
+        self._lock = threading.Lock()
+        
+        self.data = {"run_id": run_id, "created_at": time.time(), "nodes": {}}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    self.data = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                # A manifest cut short by a crash only costs the work since the last good save
+                print(f"Ignoring unreadable run manifest {self.path}: {e}")
+        
+        self.resumed = set(self.data["nodes"])
+    
+    def has(self, name):
+        """Check whether a stage of the run has finished."""
+        with self._lock:
+            return name in self.data["nodes"]
+    
+    def get(self, name, default=None):
+        """Get the result of a finished stage."""
+        with self._lock:
+            return self.data["nodes"].get(name, default)
+    
+    def save(self, name, result):
+        """
+        Record the result of a finished stage and write the manifest.
+        
+        Args:
+            name (str): The name of the stage.
+            result: The stage's result, which must be JSON serialisable.
+        """
+        with self._lock:
+            self.data["nodes"][name] = result
+            self.data["updated_at"] = time.time()
+            self._write()
+    
+    def set(self, key, value):
+        """Record a detail of the run (e.g. its question) and write the manifest."""
+        with self._lock:
+            self.data[key] = value
+            self._write()
+    
+    def reset(self):
+        """Forget every finished stage and detail of the run, e.g. when its question has changed."""
+        with self._lock:
+            self.data = {"run_id": self.run_id, "created_at": time.time(), "nodes": {}}
+            self.resumed = set()
+            self._write()
+    
+    def _write(self):
+        # Write to a temporary file and swap it in, so a crash never leaves half a manifest
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        temporary_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, ensure_ascii=False)
+        os.replace(temporary_path, self.path)
+
+
+def safe_run_id(run_id):
+    """Make a run ID safe to use as a filename."""
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", str(run_id))[:120]
+
+def new_run_id():
+    """Create a new, unique run ID."""
+    return time.strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:8]
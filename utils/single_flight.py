@@ -0,0 +1,155 @@
+import asyncio
+import threading
+from utils.cancellation import RunCancelled, check_cancelled
+
+class LeaderCancelled(Exception):
+    """Given to the waiters of an async call whose leading task was cancelled, so they make the call again."""
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key: the first caller runs the call and
+    every caller that arrives while it is in flight waits for, and shares, its result.
+    """
+    
+    def __init__(self):
+        """Initialise the single-flight group."""
+        self._lock = threading.Lock()
+        self._calls = {}
+        
+        # Counters, reported by stats()
+        self.calls = 0
+        self.coalesced = 0
+    
+    def do(self, key, function):
+        """
+        Run a function once for all concurrent callers with the same key.
+        
+        Args:
+            key (str): The key identifying identical calls.
+            function (callable): The call to make, taking no arguments.
+        
+        Returns:
+            object: The function's result (shared by every caller).
+        """
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                if call is not None:
+                    self.coalesced += 1
+                    leader = False
+                else:
+                    call = InFlightCall()
+                    self._calls[key] = call
+                    self.calls += 1
+                    leader = True
+            
+            if leader:
+                break
+            
+            # A waiter stops waiting if its own run is cancelled
+            while not call.done.wait(0.1):
+                check_cancelled()
+            
+            # The leader's run was cancelled, not this one, so make the call again
+            if isinstance(call.error, RunCancelled):
+                continue
+            if call.error is not None:
+                raise call.error
+            return call.result
+        
+        try:
+            call.result = function()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+    
+    async def do_async(self, key, coroutine_function):
+        """
+        Async version of do, for callers on an event loop.
+        
+        Args:
+            key (str): The key identifying identical calls.
+            coroutine_function (callable): Returns the coroutine to await, taking no arguments.
+        
+        Returns:
+            object: The coroutine's result (shared by every caller).
+        """
+        loop = asyncio.get_running_loop()
+        
+        # Calls are keyed per event loop, since a future can only be awaited on its own loop
+        flight_key = (id(loop), key)
+        while True:
+            with self._lock:
+                future = self._calls.get(flight_key)
+                if future is not None:
+                    self.coalesced += 1
+                    leader = False
+                else:
+                    future = loop.create_future()
+                    self._calls[flight_key] = future
+                    self.calls += 1
+                    leader = True
+            
+            if leader:
+                break
+            
+            # Shield the shared future so one cancelled waiter does not cancel the others. A
+            # CancelledError only comes from here when this waiter's own task was cancelled
+            try:
+                return await asyncio.shield(future)
+            except LeaderCancelled:
+                # The leader's task was cancelled, not this one, so make the call again
+                continue
+            except RunCancelled:
+                # The leader's run was cancelled; make the call again unless this run was too
+                check_cancelled()
+        
+        try:
+            result = await coroutine_function()
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            # Wake the waiters to retry rather than cancelling them along with this task
+            future.set_exception(LeaderCancelled())
+            future.exception()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved in case nobody else was waiting
+            future.exception()
+            raise
+        finally:
+            with self._lock:
+                del self._calls[flight_key]
+    
+    def stats(self):
+        """
+        Get the counters of the group.
+        
+        Returns:
+            dict: The number of calls made and the number of calls saved by coalescing.
+        """
+        with self._lock:
+            return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._calls)}
+
+
+class InFlightCall:
+    """
+    The shared state of a call that is in flight.
+    """
+    
+    def __init__(self):
+        """Initialise the call state."""
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+# The process-wide group used for model calls, keyed on generate_cache_key
+completion_flight = SingleFlight()
@@ -0,0 +1,221 @@
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED
+from config import PIPELINE_MAX_WORKERS
+from utils.cancellation import RunCancelled
+from utils.tracing import span, trace_context
+from utils.worker_pool import worker_pool
+
+class TaskGraph:
+    """
+    A graph of pipeline tasks, where each task starts as soon as the tasks it depends on
+    have finished. Independent tasks run concurrently on the shared worker pool, and
+    every task is timed.
+    """
+    
+    def __init__(self):
+        """Initialise an empty graph."""
+        self.nodes = {}
+        self.results = {}
+        self.timings = {}
+        self.resumed = []
+        self.started_at = None
+        self.finished_at = None
+    
+    def add(self, name, function, dependencies=(), stage=None, trace=None):
+        """
+        Add a task to the graph.
+        
+        Args:
+            name (str): A unique name for the task.
+            function (callable): The task. It is called with the results of its dependencies,
+                in the order they are listed.
+            dependencies (list, optional): The names of the tasks that must finish first.
+            stage (str, optional): The pipeline stage, used when reporting timings.
+            trace (dict, optional): Trace context (e.g. subtask_id) for the spans the task opens.
+        
+        Returns:
+            str: The name of the task, so it can be used as a dependency.
+        """
+        if name in self.nodes:
+            raise ValueError(f"Task {name} is already in the graph")
+        for dependency in dependencies:
+            if dependency not in self.nodes:
+                raise ValueError(f"Task {name} depends on unknown task {dependency}")
+        
+        self.nodes[name] = TaskNode(name, function, list(dependencies), stage, trace)
+        return name
+    
+    def run(self, max_workers=PIPELINE_MAX_WORKERS, on_complete=None, checkpoint=None):
+        """
+        Run every task in the graph.
+        
+        Args:
+            max_workers (int, optional): The maximum number of tasks running at once.
+            on_complete (callable, optional): Called with the name and result of each task as it
+                finishes, on the thread that called run.
+            checkpoint (RunManifest, optional): Where finished tasks are saved. Tasks it already
+                holds are not run again.
+        
+        Returns:
+            dict: The result of every task, keyed by name.
+        """
+        # Take the results of tasks finished by an earlier run from the checkpoint
+        if checkpoint is not None:
+            for name in self.nodes:
+                if checkpoint.has(name):
+                    self.results[name] = checkpoint.get(name)
+                    self.resumed.append(name)
+        
+        # Count the unfinished dependencies of each task, and who is waiting on it
+        waiting_on = {
+            name: sum(1 for dependency in node.dependencies if dependency not in self.results)
+            for name, node in self.nodes.items() if name not in self.results
+        }
+        dependents = {name: [] for name in self.nodes}
+        for node in self.nodes.values():
+            for dependency in node.dependencies:
+                if node.name in waiting_on and dependency not in self.results:
+                    dependents[dependency].append(node.name)
+        
+        if on_complete is not None:
+            for name in self.resumed:
+                on_complete(name, self.results[name])
+        
+        self.started_at = time.perf_counter()
+        error = None
+        
+        running = {}
+        ready = [name for name, count in waiting_on.items() if count == 0]
+        
+        def submit_ready():
+            # Tasks run on the shared worker pool, by stage priority, with at most max_workers of this graph's at once.
+            # The pool runs them with the caller's trace context (e.g. its run ID)
+            while ready and len(running) < max_workers:
+                node = self.nodes[ready.pop(0)]
+                arguments = [self.results[dependency] for dependency in node.dependencies]
+                running[worker_pool.submit(node.stage, self._run_node, node, arguments)] = node.name
+        
+        submit_ready()
+        while running:
+            done, _ = worker_pool.wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    self.results[name] = future.result()
+                except (Exception, RunCancelled) as e:
+                    # Let the running tasks finish, but start no new ones
+                    error = error or e
+                    
+                    # A cancelled run's queued tasks are dropped rather than left to fail one by one
+                    if isinstance(e, RunCancelled):
+                        for pending in running:
+                            pending.cancel()
+                    continue
+                
+                if checkpoint is not None:
+                    checkpoint.save(name, self.results[name])
+                
+                if on_complete is not None:
+                    on_complete(name, self.results[name])
+                
+                if error is None:
+                    for dependent in dependents[name]:
+                        waiting_on[dependent] -= 1
+                        if waiting_on[dependent] == 0:
+                            ready.append(dependent)
+            
+            if error is None:
+                submit_ready()
+        
+        self.finished_at = time.perf_counter()
+        
+        if error is not None:
+            raise error
+        
+        return self.results
+    
+    def _run_node(self, node, arguments):
+        """Run one task, recording when it started and finished relative to the graph."""
+        started = time.perf_counter() - self.started_at
+        try:
+            with trace_context(**node.trace), span(node.name, "task", stage=node.stage):
+                return node.function(*arguments)
+        finally:
+            finished = time.perf_counter() - self.started_at
+            self.timings[node.name] = {
+                "stage": node.stage,
+                "started": started,
+                "finished": finished,
+                "duration": finished - started,
+                "thread": threading.current_thread().name
+            }
+    
+    def critical_path(self):
+        """
+        Find the chain of dependent tasks with the longest total duration.
+        
+        Returns:
+            tuple: The names of the tasks on the chain, and its total duration in seconds.
+        """
+        longest = {}
+        for name in self._topological_order():
+            node = self.nodes[name]
+            duration = self.timings.get(name, {}).get("duration", 0.0)
+            best = max((longest[dependency] for dependency in node.dependencies), key=lambda chain: chain[1], default=([], 0.0))
+            longest[name] = (best[0] + [name], best[1] + duration)
+        
+        return max(longest.values(), key=lambda chain: chain[1], default=([], 0.0))
+    
+    def _topological_order(self):
+        # Tasks can only depend on tasks added before them, so insertion order is topological
+        return list(self.nodes)
+    
+    def format_timings(self):
+        """
+        Format the timing of every task and of the whole run.
+        
+        Returns:
+            str: A human-readable timing table.
+        """
+        lines = ["--- Pipeline Timings ---"]
+        for name, timing in sorted(self.timings.items(), key=lambda item: item[1]["started"]):
+            lines.append(
+                f"{name:<32} {timing['started']:7.2f}s -> {timing['finished']:7.2f}s  ({timing['duration']:.2f}s)"
+            )
+        
+        if self.started_at is not None and self.finished_at is not None:
+            path, path_duration = self.critical_path()
+            total_duration = sum(timing["duration"] for timing in self.timings.values())
+            if self.resumed:
+                lines.append(f"{len(self.resumed)} tasks resumed from a checkpoint")
+            lines.append(
+                f"Wall clock {self.finished_at - self.started_at:.2f}s, "
+                f"longest chain {path_duration:.2f}s ({' -> '.join(path)}), "
+                f"all tasks back to back {total_duration:.2f}s"
+            )
+        
+        return "\n".join(lines)
+
+
+class TaskNode:
+    """
+    A task in a TaskGraph.
+    """
+    
+    def __init__(self, name, function, dependencies, stage=None, trace=None):
+        """
+        Initialise the task.
+        
+        Args:
+            name (str): The unique name of the task.
+            function (callable): The task, called with the results of its dependencies.
+            dependencies (list): The names of the tasks that must finish first.
+            stage (str, optional): The pipeline stage.
+            trace (dict, optional): Trace context for the spans the task opens.
+        """
+        self.name = name
+        self.function = function
+        self.dependencies = dependencies
+        self.stage = stage
+        self.trace = trace or {}
@@ -0,0 +1,278 @@
+import contextlib
+import contextvars
+import functools
+import inspect
+import itertools
+import json
+import os
+import threading
+import time
+from config import TRACE_ENABLED, TRACE_DIR
+
+# The innermost open span, and the run and subtask IDs that new spans are tagged with.
+# Context variables follow asyncio tasks on their own; threads get them through copy_context().
+_current_span = contextvars.ContextVar("current_span", default=None)
+_trace_context = contextvars.ContextVar("trace_context", default={})
+
+class Span:
+    """
+    One timed operation: an agent call, a cache lookup, an HTTP request or a JSON parse.
+    """
+    
+    def __init__(self, span_id, name, category, parent_id, context, attributes):
+        """
+        Initialise the span.
+        
+        Args:
+            span_id (int): The ID of the span, unique within the process.
+            name (str): What the span times.
+            category (str): The kind of operation ("agent", "cache", "http", "parse", ...).
+            parent_id (int): The ID of the enclosing span, or None.
+            context (dict): The run ID and subtask ID the span belongs to.
+            attributes (dict): Details of the operation.
+        """
+        self.span_id = span_id
+        self.name = name
+        self.category = category
+        self.parent_id = parent_id
+        self.run_id = context.get("run_id")
+        self.subtask_id = context.get("subtask_id")
+        self.attributes = attributes
+        self.thread = threading.current_thread().name
+        self.status = "ok"
+        self.error = None
+        self.started = time.perf_counter()
+        self.duration = None
+    
+    def set(self, **attributes):
+        """Add details learnt while the operation ran (e.g. an HTTP status code)."""
+        self.attributes.update(attributes)
+    
+    def to_dict(self, epoch):
+        """
+        Convert the span to a JSON-serialisable dict.
+        
+        Args:
+            epoch (float): The wall clock time at perf_counter() zero.
+        
+        Returns:
+            dict: The span.
+        """
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "category": self.category,
+            "run_id": self.run_id,
+            "subtask_id": self.subtask_id,
+            "start": epoch + self.started,
+            "duration": self.duration,
+            "thread": self.thread,
+            "status": self.status,
+            "error": self.error,
+            "attributes": self.attributes
+        }
+
+
+class _NoSpan:
+    """Stands in for a span when tracing is off, so callers never need to check."""
+    
+    def set(self, **attributes):
+        pass
+
+
+class Tracer:
+    """
+    Collects the spans of the process. When tracing is off, opening a span costs one
+    attribute check and nothing is kept.
+    """
+    
+    def __init__(self, enabled=TRACE_ENABLED):
+        """
+        Initialise the tracer.
+        
+        Args:
+            enabled (bool, optional): Whether spans are recorded.
+        """
+        self.enabled = enabled
+        self.spans = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        
+        # Spans are timed with perf_counter(); this converts them to wall clock time
+        self.epoch = time.time() - time.perf_counter()
+    
+    @contextlib.contextmanager
+    def span(self, name, category, **attributes):
+        """
+        Time the enclosed block as a span, nested in the current one.
+        
+        Args:
+            name (str): What the span times.
+            category (str): The kind of operation.
+            **attributes: Details of the operation.
+        
+        Yields:
+            Span: The span, whose set() adds more details.
+        """
+        if not self.enabled:
+            yield _NoSpan()
+            return
+        
+        parent = _current_span.get()
+        current = Span(next(self._ids), name, category, parent.span_id if parent else None, _trace_context.get(), attributes)
+        token = _current_span.set(current)
+        try:
+            yield current
+        except BaseException as e:
+            current.status = "error"
+            current.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            current.duration = time.perf_counter() - current.started
+            _current_span.reset(token)
+            with self._lock:
+                self.spans.append(current)
+    
+    def take(self, run_id=None):
+        """
+        Remove and return the finished spans of a run, so a long-lived process does not keep them.
+        
+        Args:
+            run_id (str, optional): The run ID (None takes every span).
+        
+        Returns:
+            list: The spans as dicts, in the order they started.
+        """
+        with self._lock:
+            if run_id is None:
+                taken, self.spans = self.spans, []
+            else:
+                taken = [span for span in self.spans if span.run_id == run_id]
+                self.spans = [span for span in self.spans if span.run_id != run_id]
+        
+        return sorted((span.to_dict(self.epoch) for span in taken), key=lambda span: span["start"])
+
+
+# The process-wide tracer
+tracer = Tracer()
+
+def span(name, category, **attributes):
+    """Open a span on the shared tracer (see Tracer.span)."""
+    return tracer.span(name, category, **attributes)
+
+@contextlib.contextmanager
+def trace_context(**context):
+    """
+    Tag every span opened in the enclosed block with a run ID and/or subtask ID.
+    
+    Args:
+        **context: run_id and/or subtask_id.
+    """
+    token = _trace_context.set({**_trace_context.get(), **context})
+    try:
+        yield
+    finally:
+        _trace_context.reset(token)
+
+def get_trace_context():
+    """Get the run ID and subtask ID of the current context, as a dict."""
+    return _trace_context.get()
+
+def traced(category, name=None):
+    """
+    Decorate a function (sync or async) so every call to it is a span.
+    
+    Args:
+        category (str): The kind of operation.
+        name (str, optional): The span name (defaults to the function's name).
+    
+    Returns:
+        callable: The decorator.
+    """
+    def decorator(function):
+        span_name = name or function.__name__
+        
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                with tracer.span(span_name, category):
+                    return await function(*args, **kwargs)
+            return async_wrapper
+        
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with tracer.span(span_name, category):
+                return function(*args, **kwargs)
+        return wrapper
+    
+    return decorator
+
+def chrome_trace(spans):
+    """
+    Convert spans to the Chrome trace event format, which chrome://tracing and
+    https://ui.perfetto.dev can open.
+    
+    Args:
+        spans (list): Spans as returned by Tracer.take().
+    
+    Returns:
+        dict: The trace.
+    """
+    pid = os.getpid()
+    origin = min((span["start"] for span in spans), default=0.0)
+    threads = {}
+    events = []
+    
+    for span in spans:
+        tid = threads.setdefault(span["thread"], len(threads) + 1)
+        args = {"run_id": span["run_id"], "subtask_id": span["subtask_id"], **span["attributes"]}
+        if span["error"]:
+            args["error"] = span["error"]
+        events.append({
+            "name": span["name"],
+            "cat": span["category"],
+            "ph": "X",
+            "ts": (span["start"] - origin) * 1e6,
+            "dur": (span["duration"] or 0.0) * 1e6,
+            "pid": pid,
+            "tid": tid,
+            "args": {key: value for key, value in args.items() if value is not None}
+        })
+    
+    # Name each thread row after the thread
+    for thread, tid in threads.items():
+        events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": thread}})
+    
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+def export_trace(run_id=None, directory=TRACE_DIR):
+    """
+    Write the spans of a run as JSON lines and as a Chrome trace, and drop them from the tracer.
+    
+    Args:
+        run_id (str, optional): The run ID (None exports every span).
+        directory (str, optional): The directory to write the traces to.
+    
+    Returns:
+        tuple: The paths of the JSON lines file and the Chrome trace, or None if there were no spans.
+    """
+    spans = tracer.take(run_id)
+    if not spans:
+        return None
+    
+    from utils.run_manifest import safe_run_id
+    
+    os.makedirs(directory, exist_ok=True)
+    stem = os.path.join(directory, safe_run_id(run_id or time.strftime("%Y%m%d-%H%M%S")))
+    
+    jsonl_path = f"{stem}.spans.jsonl"
+    with open(jsonl_path, "w", encoding="utf-8") as f:
+        for span in spans:
+            f.write(json.dumps(span, ensure_ascii=False, default=str) + "\n")
+    
+    chrome_path = f"{stem}.trace.json"
+    with open(chrome_path, "w", encoding="utf-8") as f:
+        json.dump(chrome_trace(spans), f, default=str)
+    
+    return jsonl_path, chrome_path
@@ -0,0 +1,193 @@
+import threading
+from config import get_model_prices
+from utils.tracing import get_trace_context
+
+USAGE_FIELDS = ("calls", "cached_calls", "coalesced_calls", "estimated_calls", "prompt_tokens", "completion_tokens")
+
+class UsageLedger:
+    """
+    Adds up the tokens of every model call, per run, stage and model, so their cost can
+    be reported. Calls answered from the cache, or by an identical call already in flight,
+    are counted but cost nothing.
+    """
+    
+    def __init__(self, prices=None):
+        """
+        Initialise an empty ledger.
+        
+        Args:
+            prices (dict, optional): USD per million (prompt, completion) tokens, keyed by model.
+                Defaults to MODEL_PRICES.
+        """
+        self.prices = prices if prices is not None else get_model_prices()
+        
+        # (run_id, stage, provider, model) -> counters
+        self._entries = {}
+        self._lock = threading.Lock()
+    
+    def record(self, response, messages, stage=None):
+        """
+        Count a call made to the provider.
+        
+        Args:
+            response (ChatResponse): The response. Its usage block is used when the provider sent one;
+                otherwise the tokens are estimated from the text (about four characters per token).
+            messages (list): The messages of the request, for the estimate.
+            stage (str, optional): The pipeline stage that made the call.
+        """
+        usage = getattr(response, "usage", None) or {}
+        prompt_tokens = usage.get("prompt_tokens")
+        completion_tokens = usage.get("completion_tokens")
+        estimated = prompt_tokens is None or completion_tokens is None
+        
+        if estimated:
+            content = response.choices[0].message.content if response.choices else ""
+            prompt_tokens = sum(len(message.get("content") or "") for message in messages) // 4
+            completion_tokens = len(content or "") // 4
+        
+        self._add(stage, response.provider, response.model, {
+            "calls": 1,
+            "estimated_calls": int(estimated),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens
+        })
+    
+    def record_cached(self, stage=None, provider=None, model=None):
+        """Count a call that was answered from the cache."""
+        self._add(stage, provider, model, {"cached_calls": 1})
+    
+    def record_coalesced(self, stage=None, provider=None, model=None):
+        """Count a call that shared the response of an identical call already in flight."""
+        self._add(stage, provider, model, {"coalesced_calls": 1})
+    
+    def _add(self, stage, provider, model, counts):
+        # Calls are attributed to the run whose trace context they were made in
+        key = (get_trace_context().get("run_id"), stage, provider, model)
+        with self._lock:
+            entry = self._entries.setdefault(key, dict.fromkeys(USAGE_FIELDS, 0))
+            for field, count in counts.items():
+                entry[field] += count
+    
+    def summary(self, run_id=None):
+        """
+        Add up the calls, tokens and cost of a run (or of every run).
+        
+        Args:
+            run_id (str, optional): The run ID (None adds up every call of the process).
+        
+        Returns:
+            dict: The totals, and the totals by stage and by model.
+        """
+        with self._lock:
+            entries = [
+                (key, dict(entry)) for key, entry in self._entries.items()
+                if run_id is None or key[0] == run_id
+            ]
+        
+        return self._summarise(entries)
+    
+    def take(self, run_id):
+        """
+        Add up a run's calls like summary, and forget them, so a long-lived process does not
+        keep an entry per run. They still count towards the process totals (summary()).
+        
+        Args:
+            run_id (str): The run ID.
+        
+        Returns:
+            dict: The totals, and the totals by stage and by model.
+        """
+        with self._lock:
+            entries = [(key, self._entries.pop(key)) for key in list(self._entries) if key[0] == run_id]
+            
+            # Folded into the entries of calls made outside any run, which are only one per stage and model
+            for (_, stage, provider, model), entry in entries:
+                totals = self._entries.setdefault((None, stage, provider, model), dict.fromkeys(USAGE_FIELDS, 0))
+                for field in USAGE_FIELDS:
+                    totals[field] += entry[field]
+        
+        return self._summarise(entries)
+    
+    def _summarise(self, entries):
+        summary = {"total": new_totals(), "by_stage": {}, "by_model": {}}
+        for (_, stage, provider, model), entry in entries:
+            cost = self.cost(model, entry["prompt_tokens"], entry["completion_tokens"])
+            for totals in (
+                summary["total"],
+                summary["by_stage"].setdefault(stage or "other", new_totals()),
+                summary["by_model"].setdefault(model or "unknown", new_totals())
+            ):
+                for field in USAGE_FIELDS:
+                    totals[field] += entry[field]
+                if cost is None:
+                    totals["unpriced_tokens"] += entry["prompt_tokens"] + entry["completion_tokens"]
+                else:
+                    totals["cost_usd"] += cost
+        
+        for totals in [summary["total"], *summary["by_stage"].values(), *summary["by_model"].values()]:
+            totals["total_tokens"] = totals["prompt_tokens"] + totals["completion_tokens"]
+            totals["cost_usd"] = round(totals["cost_usd"], 6)
+        
+        return summary
+    
+    def cost(self, model, prompt_tokens, completion_tokens):
+        """
+        Get the cost of some tokens of a model.
+        
+        Args:
+            model (str): The model.
+            prompt_tokens (int): The prompt tokens.
+            completion_tokens (int): The completion tokens.
+        
+        Returns:
+            float or None: The cost in USD, or None if the model has no price.
+        """
+        price = self.prices.get(model)
+        if price is None and model:
+            # Providers answer with versioned names (e.g. mistral-small-2402), so fall back to the longest matching prefix
+            prefixes = [prefix for prefix in self.prices if model.startswith(prefix)]
+            price = self.prices[max(prefixes, key=len)] if prefixes else None
+        if price is None:
+            return None
+        return (prompt_tokens * price[0] + completion_tokens * price[1]) / 1_000_000
+    
+    def clear(self):
+        """Forget every call."""
+        with self._lock:
+            self._entries.clear()
+
+
+def new_totals():
+    """Get a zeroed set of usage totals."""
+    return {**dict.fromkeys(USAGE_FIELDS, 0), "total_tokens": 0, "cost_usd": 0.0, "unpriced_tokens": 0}
+
+def format_usage(summary):
+    """
+    Format a usage summary as a short, human-readable table.
+    
+    Args:
+        summary (dict): A summary from UsageLedger.summary().
+    
+    Returns:
+        str: The totals, then one line per stage and per model.
+    """
+    def line(label, totals):
+        text = (
+            f"{label:<16} {totals['calls']:>4} calls + {totals['cached_calls']:>4} cached + {totals['coalesced_calls']:>4} shared  "
+            f"{totals['prompt_tokens']:>8} prompt + {totals['completion_tokens']:>7} completion tokens  "
+            f"${totals['cost_usd']:.4f}"
+        )
+        if totals["unpriced_tokens"]:
+            text += f" (+{totals['unpriced_tokens']} tokens with no price)"
+        return text
+    
+    lines = ["--- Token Usage ---", line("total", summary["total"])]
+    lines += [line(stage, totals) for stage, totals in sorted(summary["by_stage"].items())]
+    lines += [line(model, totals) for model, totals in sorted(summary["by_model"].items())]
+    if summary["total"]["estimated_calls"]:
+        lines.append(f"{summary['total']['estimated_calls']} calls reported no usage, so their tokens are estimated")
+    return "\n".join(lines)
+
+
+# The process-wide ledger
+usage_ledger = UsageLedger()
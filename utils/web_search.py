@@ -2,92 +2,470 @@ import time
 import json
 import os
 import re
-from config import get_model, SEARCH_RESULT_LIMIT
-from utils.caching import generate_cache_key, get_cached_response, cache_response
-from utils.client_manager import get_client
+import asyncio
+import threading
+from config import SEARCH_RESULT_LIMIT, SEARCH_BATCH_SIZE, SEARCH_BACKEND, SEARCH_INDEX_PATH, get_run_config
+from utils.caching import generate_cache_key, get_cached_records, cache_responses
+from utils.cancellation import RunCancelled
+from utils.completions import get_completion_content, get_completion_content_async
+from utils.tracing import traced
+from utils.usage import usage_ledger
+from utils.worker_pool import worker_pool
 
-def simulated_search(query):
+# Streamlined prompt for faster processing
+SEARCH_SYSTEM_PROMPT = """You are a search engine API. Return search results in JSON format:
+        [
+            {
+                "title": "Title of the page",
+                "url": "https://example.com/page1",
+                "snippet": "A brief snippet (1-2 sentences)",
+                "content": "Content (300 words maximum)"
+            }
+        ]
+        
+        Create 2-3 diverse, realistic results with actual website URLs for the query.
+        """
+
+# Several queries in one call. Results are kept short, as retrieval trims them to ~1000 characters anyway
+SEARCH_BATCH_SYSTEM_PROMPT = f"""You are a search engine API. You are given a JSON list of search queries.
+        Return the search results of every query as one JSON object, keyed by the exact query text:
+        {{
+            "query 1": [
+                {{
+                    "title": "Title of the page",
+                    "url": "https://example.com/page1",
+                    "snippet": "A brief snippet (1-2 sentences)",
+                    "content": "Content (150 words maximum)"
+                }}
+            ],
+            "query 2": [...]
+        }}
+        
+        Create {SEARCH_RESULT_LIMIT} diverse, realistic results with actual website URLs for each query.
+        """
+
+def build_search_messages(query):
     """
-    Simulate a web search using the current AI provider with caching.
+    Build the messages for a simulated search.
     
     Args:
         query (str): The search query.
-        
+    
+    Returns:
+        list: The messages list.
+    """
+    prompt = f"Search query: {query}"
+    
+    return [
+        {"role": "system", "content": SEARCH_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+
+@traced("parse")
+def parse_search_results(content, query):
+    """
+    Parse the model's response into a list of search results.
+    
+    Args:
+        content (str): The model's response content.
+        query (str): The search query.
+    
     Returns:
         list: A list of simulated search result items.
     """
     try:
-        # Streamlined prompt for faster processing
-        system_prompt = """You are a search engine API. Return search results in JSON format:
-        [
+        search_results = json.loads(content)
+        return search_results[:SEARCH_RESULT_LIMIT]
+    except json.JSONDecodeError:
+        # If parsing fails, try to extract JSON from the text
+        json_match = re.search(r'(\[[\s\S]*\])', content)
+        if json_match:
+            try:
+                search_results = json.loads(json_match.group(1))
+                return search_results[:SEARCH_RESULT_LIMIT]
+            except:
+                pass
+        
+        # Return a default response if JSON parsing fails
+        return [
             {
-                "title": "Title of the page",
-                "url": "https://example.com/page1",
-                "snippet": "A brief snippet (1-2 sentences)",
-                "content": "Content (300 words maximum)"
+                "title": f"Search result for {query}",
+                "url": "https://example.com/result",
+                "snippet": "This is a placeholder result for your query.",
+                "content": f"This is simulated content for the search query: {query}. Since the actual JSON parsing failed, we're providing this placeholder content."
             }
         ]
+
+@traced("search")
+def simulated_search(query):
+    """
+    Simulate a web search using the current AI provider with caching.
+    
+    Args:
+        query (str): The search query.
+    
+    Returns:
+        list: A list of simulated search result items.
+    """
+    try:
+        content = get_completion_content(
+            build_search_messages(query),
+            0.7,
+            cache_message=f"Using cached search results for: {query}",
+            stage="search"
+        )
+        return parse_search_results(content, query)
+    except Exception as e:
+        print(f"Error in simulated_search: {e}")
+        return []
+
+@traced("search")
+async def simulated_search_async(query, client):
+    """
+    Async version of simulated_search.
+    
+    Args:
+        query (str): The search query.
+        client (AsyncAIClient): The async client to call the model with.
+    
+    Returns:
+        list: A list of simulated search result items.
+    """
+    try:
+        content = await get_completion_content_async(
+            client,
+            build_search_messages(query),
+            0.7,
+            cache_message=f"Using cached search results for: {query}",
+            stage="search"
+        )
+        return parse_search_results(content, query)
+    except Exception as e:
+        print(f"Error in simulated_search_async: {e}")
+        return []
+
+def build_search_batch_messages(queries):
+    """
+    Build the messages for a simulated search of several queries at once.
+    
+    Args:
+        queries (list): The search queries.
+    
+    Returns:
+        list: The messages list.
+    """
+    return [
+        {"role": "system", "content": SEARCH_BATCH_SYSTEM_PROMPT},
+        {"role": "user", "content": f"Search queries: {json.dumps(queries, ensure_ascii=False)}"}
+    ]
+
+def parse_search_batch(content, queries):
+    """
+    Parse the model's response to a batched search into the results of each query.
+    
+    Args:
+        content (str): The model's response content.
+        queries (list): The search queries.
+    
+    Returns:
+        dict: The results of each query found in the response (the rest are left out).
+    """
+    try:
+        results = json.loads(content)
+    except json.JSONDecodeError:
+        # If parsing fails, try to extract JSON from the text
+        json_match = re.search(r'({[\s\S]*})', content)
+        if not json_match:
+            return {}
+        try:
+            results = json.loads(json_match.group(1))
+        except json.JSONDecodeError:
+            return {}
+    
+    if not isinstance(results, dict):
+        return {}
+    
+    # Models sometimes change the case or spacing of the keys
+    by_normalised_key = {" ".join(str(key).lower().split()): value for key, value in results.items()}
+    found = {}
+    for query in queries:
+        query_results = results.get(query, by_normalised_key.get(" ".join(query.lower().split())))
+        if isinstance(query_results, list) and query_results:
+            found[query] = query_results[:SEARCH_RESULT_LIMIT]
+    return found
+
+def search_cache_key(query, run_config):
+    """Get the cache key of a query's results, which is the key of a single-query search."""
+    return generate_cache_key(run_config.model, build_search_messages(query), 0.7, run_config=run_config)
+
+def get_cached_search_results(queries):
+    """
+    Look up the cached results of several queries in one cache lookup.
+    
+    Args:
+        queries (list): The search queries.
+    
+    Returns:
+        dict: The results of each query that was cached.
+    """
+    run_config = get_run_config()
+    keys = {query: search_cache_key(query, run_config) for query in queries}
+    records = get_cached_records(list(keys.values()))
+    
+    results = {}
+    for query, key in keys.items():
+        if key in records:
+            results[query] = parse_search_results(records[key]["content"], query)
+            usage_ledger.record_cached("search", run_config.provider, run_config.model)
+    return results
+
+def cache_search_results(results):
+    """
+    Cache the results of each query of a batched search on their own, so any later
+    search of one of the queries (batched or not) is answered from the cache.
+    
+    Args:
+        results (dict): The results of each query.
+    """
+    from utils.ai_client import ChatResponse
+    
+    run_config = get_run_config()
+    cache_responses({
+        search_cache_key(query, run_config): ChatResponse({
+            "model": run_config.model,
+            "created": int(time.time()),
+            "choices": [{"message": {"role": "assistant", "content": json.dumps(query_results, ensure_ascii=False)}, "finish_reason": "stop"}]
+        }, run_config.provider)
+        for query, query_results in results.items()
+    }, stage="search")
+
+def search_batches(queries):
+    """Split the queries that missed the cache into batches of SEARCH_BATCH_SIZE."""
+    size = max(SEARCH_BATCH_SIZE, 1)
+    return [queries[i:i + size] for i in range(0, len(queries), size)]
+
+def search_batch(queries):
+    """Search one batch of queries in a single model call."""
+    content = get_completion_content(
+        build_search_batch_messages(queries),
+        0.7,
+        cache_message=f"Using cached search results for {len(queries)} queries",
+        stage="search"
+    )
+    return parse_search_batch(content, queries)
+
+@traced("search")
+def simulated_search_batch(queries):
+    """
+    Simulate the web searches of many queries (e.g. every query of a research plan) with
+    SEARCH_BATCH_SIZE queries per model call instead of one. Each query's results are
+    cached on their own, and a query missing from a batch's response is searched alone.
+    
+    Args:
+        queries (list): The search queries.
+    
+    Returns:
+        dict: The list of simulated search result items of each query.
+    """
+    queries = list(dict.fromkeys(queries))
+    results = get_cached_search_results(queries)
+    missing = [query for query in queries if query not in results]
+    
+    batches = search_batches(missing)
+    if batches:
+        # The batches are independent, so they are searched at once on the shared worker pool
+        futures = [worker_pool.submit("search", search_batch, batch) for batch in batches]
+        worker_pool.wait(futures)
+        for future in futures:
+            try:
+                found = future.result()
+            except Exception as e:
+                print(f"Error in simulated_search_batch: {e}")
+                continue
+            cache_search_results(found)
+            results.update(found)
+    
+    for query in queries:
+        if query not in results:
+            results[query] = simulated_search(query)
+    return {query: results[query] for query in queries}
+
+@traced("search")
+async def simulated_search_batch_async(queries, client):
+    """
+    Async version of simulated_search_batch.
+    
+    Args:
+        queries (list): The search queries.
+        client (AsyncAIClient): The async client to call the model with.
+    
+    Returns:
+        dict: The list of simulated search result items of each query.
+    """
+    queries = list(dict.fromkeys(queries))
+    results = get_cached_search_results(queries)
+    missing = [query for query in queries if query not in results]
+    
+    async def search_batch_async(batch):
+        content = await get_completion_content_async(
+            client,
+            build_search_batch_messages(batch),
+            0.7,
+            cache_message=f"Using cached search results for {len(batch)} queries",
+            stage="search"
+        )
+        return parse_search_batch(content, batch)
+    
+    for found in await asyncio.gather(*(search_batch_async(batch) for batch in search_batches(missing)), return_exceptions=True):
+        if isinstance(found, RunCancelled):
+            raise found
+        if isinstance(found, Exception):
+            print(f"Error in simulated_search_batch_async: {found}")
+            continue
+        cache_search_results(found)
+        results.update(found)
+    
+    leftover = [query for query in queries if query not in results]
+    for query, query_results in zip(leftover, await asyncio.gather(*(simulated_search_async(query, client) for query in leftover))):
+        results[query] = query_results
+    return {query: results[query] for query in queries}
+
+
+class SearchBackend:
+    """
+    Where search results come from. A backend answers single queries and, for a whole
+    research plan at once, many queries; the async variants take the pipeline's client.
+    """
+    
+    # The name of the backend, as set by SEARCH_BACKEND
+    name = None
+    
+    # Whether the pipeline should search every query of a plan up front with search_many
+    prefetch = False
+    
+    def search(self, query):
+        """
+        Search for a query.
         
-        Create 2-3 diverse, realistic results with actual website URLs for the query.
+        Args:
+            query (str): The search query.
+        
+        Returns:
+            list: Search result items (title, url, snippet and content).
+        """
+        raise NotImplementedError
+    
+    def search_many(self, queries):
         """
+        Search for several queries.
         
-        prompt = f"Search query: {query}"
+        Args:
+            queries (list): The search queries.
         
-        # Generate cache key
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": prompt}
-        ]
-        cache_key = generate_cache_key(get_model(), messages, 0.7)
+        Returns:
+            dict: The search result items of each query.
+        """
+        return {query: self.search(query) for query in dict.fromkeys(queries)}
+    
+    async def search_async(self, query, client):
+        """Async version of search. By default the search runs on the shared worker pool."""
+        return await asyncio.wrap_future(worker_pool.submit("search", self.search, query))
+    
+    async def search_many_async(self, queries, client):
+        """Async version of search_many. By default the searches run on the shared worker pool."""
+        return await asyncio.wrap_future(worker_pool.submit("search", self.search_many, queries))
+
+
+class SimulatedSearchBackend(SearchBackend):
+    """
+    Asks the model to invent realistic search results, batching a plan's queries into
+    SEARCH_BATCH_SIZE queries per call.
+    """
+    
+    name = "simulated"
+    prefetch = SEARCH_BATCH_SIZE > 1
+    
+    def search(self, query):
+        return simulated_search(query)
+    
+    def search_many(self, queries):
+        return simulated_search_batch(queries)
+    
+    async def search_async(self, query, client):
+        return await simulated_search_async(query, client)
+    
+    async def search_many_async(self, queries, client):
+        return await simulated_search_batch_async(queries, client)
+
+
+class LocalIndexSearchBackend(SearchBackend):
+    """
+    Searches an on-disk BM25 index of a local document corpus. No model call is made,
+    so searches are fast, free and work offline.
+    """
+    
+    name = "local"
+    
+    # A local search takes about a millisecond, so the whole plan is searched at once
+    prefetch = True
+    
+    def __init__(self, index_path=SEARCH_INDEX_PATH):
+        """
+        Initialise the backend.
         
-        # Check cache first
-        cached_response = get_cached_response(cache_key)
-        if cached_response:
-            print(f"Using cached search results for: {query}")
-            content = cached_response.choices[0].message.content
-        else:
-            # Get the client from client manager
-            client = get_client()
-            
-            # Call API
-            response = client.chat.create(
-                model=get_model(),
-                messages=messages,
-                temperature=0.7
-            )
-            
-            # Cache the response
-            cache_response(cache_key, response)
-            
-            # Extract the content
-            content = response.choices[0].message.content
+        Args:
+            index_path (str, optional): The index file, built with `python -m utils.local_index build`.
+        """
+        from utils.local_index import LocalIndex
         
-        # Parse the JSON response
+        self.index = LocalIndex(index_path)
+        if not self.index.lengths():
+            print(f"Warning: the search index {index_path} is empty; build it with: python -m utils.local_index build <corpus>")
+    
+    @traced("search", name="local_search")
+    def search(self, query):
         try:
-            search_results = json.loads(content)
-            return search_results[:SEARCH_RESULT_LIMIT]
-        except json.JSONDecodeError:
-            # If parsing fails, try to extract JSON from the text
-            json_match = re.search(r'(\[[\s\S]*\])', content)
-            if json_match:
-                try:
-                    search_results = json.loads(json_match.group(1))
-                    return search_results[:SEARCH_RESULT_LIMIT]
-                except:
-                    pass
-            
-            # Return a default response if JSON parsing fails
-            return [
-                {
-                    "title": f"Search result for {query}",
-                    "url": "https://example.com/result",
-                    "snippet": "This is a placeholder result for your query.",
-                    "content": f"This is simulated content for the search query: {query}. Since the actual JSON parsing failed, we're providing this placeholder content."
-                }
-            ]
-    except Exception as e:
-        print(f"Error in simulated_search: {e}")
-        return []
+            return self.index.search(query)
+        except Exception as e:
+            print(f"Error in local search: {e}")
+            return []
+
+
+# The search backends by name
+SEARCH_BACKENDS = {
+    "simulated": SimulatedSearchBackend,
+    "local": LocalIndexSearchBackend
+}
+
+# The process-wide search backend, created on first use
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_search_backend():
+    """
+    Get the shared search backend chosen by SEARCH_BACKEND.
+    
+    Returns:
+        SearchBackend: The process-wide backend.
+    """
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            if SEARCH_BACKEND not in SEARCH_BACKENDS:
+                raise ValueError(f"Unknown search backend: {SEARCH_BACKEND} (expected one of {', '.join(SEARCH_BACKENDS)})")
+            _backend = SEARCH_BACKENDS[SEARCH_BACKEND]()
+        return _backend
+
+def set_search_backend(backend):
+    """
+    Replace the shared search backend (e.g. with a local index of another corpus).
+    
+    Args:
+        backend (SearchBackend): The new backend.
+    """
+    global _backend
+    with _backend_lock:
+        _backend = backend
 
 
 def search_and_process(query):
@@ -96,11 +474,24 @@ def search_and_process(query):
     
     Args:
         query (str): The search query.
-        
+    
     Returns:
         list: A list of processed search results.
     """
-    search_results = simulated_search(query)
+    search_results = get_search_backend().search(query)
     
     # Return the results directly (no further processing needed)
-    return search_results
\ No newline at end of file
+    return search_results
+
+async def search_and_process_async(query, client):
+    """
+    Async version of search_and_process.
+    
+    Args:
+        query (str): The search query.
+        client (AsyncAIClient): The async client to call the model with.
+    
+    Returns:
+        list: A list of processed search results.
+    """
+    return await get_search_backend().search_async(query, client)
@@ -0,0 +1,216 @@
+import contextvars
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, FIRST_COMPLETED, ALL_COMPLETED
+from config import WORKER_POOL_SIZE
+from utils.cancellation import check_cancelled
+
+# Which work runs first when the pool is busy (lower first). A plan is short and unblocks
+# the rest of its run, and after that the work furthest along the pipeline goes first, so
+# runs that are nearly done finish instead of every run slowing down together
+STAGE_PRIORITIES = {
+    "plan": 0,
+    "report": 1,
+    "analysis": 2,
+    "retrieval": 3,
+    "search": 4
+}
+DEFAULT_PRIORITY = 5
+
+# Wait times kept per stage for the percentiles
+WAIT_SAMPLES = 1000
+
+# Set on the pool's own threads, so a worker that waits on other tasks can help run them
+_worker = threading.local()
+
+class WorkerPool:
+    """
+    A process-wide pool of long-lived worker threads shared by every agent and every run.
+    Work is queued by stage priority, and the pool keeps count of its queue depth and of
+    how long each stage's work waits for a thread. Its size caps the number of tasks (and
+    so of outbound model calls) running at once across the whole process.
+    """
+    
+    def __init__(self, max_workers=WORKER_POOL_SIZE):
+        """
+        Initialise the pool. Threads are started as work arrives, up to max_workers.
+        
+        Args:
+            max_workers (int, optional): The number of worker threads.
+        """
+        self.max_workers = max(max_workers, 1)
+        self._queue = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._threads = []
+        self._idle = 0
+        
+        # Counters, reported by stats()
+        self.submitted = 0
+        self.completed = 0
+        self.peak_queued = 0
+        self._waits = {}
+    
+    def submit(self, stage, function, *args, **kwargs):
+        """
+        Queue a call to run on the pool, with the caller's context (e.g. its trace context).
+        
+        Args:
+            stage (str): The pipeline stage of the work, which sets its priority.
+            function (callable): The function to call.
+            *args: Positional arguments for the function.
+            **kwargs: Keyword arguments for the function.
+        
+        Returns:
+            Future: The result of the call.
+        """
+        future = Future()
+        context = contextvars.copy_context()
+        priority = STAGE_PRIORITIES.get(stage, DEFAULT_PRIORITY)
+        
+        with self._condition:
+            heapq.heappush(self._queue, (priority, next(self._sequence), time.perf_counter(), stage, future, context, function, args, kwargs))
+            self.submitted += 1
+            self.peak_queued = max(self.peak_queued, len(self._queue))
+            
+            # Start a thread unless an idle one can take the task
+            if len(self._queue) > self._idle and len(self._threads) < self.max_workers:
+                thread = threading.Thread(target=self._work, name=f"worker-{len(self._threads) + 1}", daemon=True)
+                self._threads.append(thread)
+                thread.start()
+            
+            # Wakes an idle worker, or a worker waiting on other tasks that can help run this one
+            self._condition.notify_all()
+        
+        return future
+    
+    def run(self, stage, function, *args, **kwargs):
+        """Run a call on the pool and wait for its result (see submit)."""
+        future = self.submit(stage, function, *args, **kwargs)
+        self.wait([future])
+        return future.result()
+    
+    def wait(self, futures, return_when=ALL_COMPLETED):
+        """
+        Wait for futures, like concurrent.futures.wait. A worker thread that waits on other
+        tasks runs queued work in the meantime, so tasks can fan out onto the pool without
+        every thread ending up blocked on work that has no thread left to run it.
+        
+        Args:
+            futures (iterable): The futures to wait for.
+            return_when (str, optional): FIRST_COMPLETED or ALL_COMPLETED.
+        
+        Returns:
+            tuple: The sets of done and not done futures.
+        """
+        futures = set(futures)
+        
+        def finished():
+            done = {future for future in futures if future.done()}
+            if return_when == FIRST_COMPLETED:
+                ready = bool(done) or not futures
+            else:
+                ready = len(done) == len(futures)
+            return done if ready else None
+        
+        helping = getattr(_worker, "pool", None) is self
+        while True:
+            with self._condition:
+                done = finished()
+                while done is None and not (helping and self._queue):
+                    self._condition.wait(0.1)
+                    done = finished()
+                if done is not None:
+                    return done, futures - done
+                task = heapq.heappop(self._queue)
+            self._run_task(task)
+    
+    def _work(self):
+        """The loop of a worker thread: run the highest priority task, or wait for one."""
+        _worker.pool = self
+        while True:
+            with self._condition:
+                self._idle += 1
+                while not self._queue:
+                    self._condition.wait()
+                self._idle -= 1
+                task = heapq.heappop(self._queue)
+            self._run_task(task)
+    
+    def _run_task(self, task):
+        """Run one queued task, recording how long it waited."""
+        _, _, queued_at, stage, future, context, function, args, kwargs = task
+        waited = time.perf_counter() - queued_at
+        
+        if future.set_running_or_notify_cancel():
+            try:
+                future.set_result(context.run(_run_unless_cancelled, function, args, kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+        
+        with self._condition:
+            self.completed += 1
+            self._waits.setdefault(stage or "other", deque(maxlen=WAIT_SAMPLES)).append(waited)
+            # Wakes the threads waiting on this task
+            self._condition.notify_all()
+    
+    def stats(self):
+        """
+        Get the pool's counters.
+        
+        Returns:
+            dict: The thread, queue and task counts, and the wait times of each stage in ms
+                (average, p95 and maximum over the last WAIT_SAMPLES tasks).
+        """
+        with self._condition:
+            waits = {stage: sorted(samples) for stage, samples in self._waits.items()}
+            stats = {
+                "max_workers": self.max_workers,
+                "workers": len(self._threads),
+                "busy": len(self._threads) - self._idle,
+                "queued": len(self._queue),
+                "peak_queued": self.peak_queued,
+                "submitted": self.submitted,
+                "completed": self.completed
+            }
+        
+        stats["wait_ms"] = {
+            stage: {
+                "tasks": len(samples),
+                "avg": sum(samples) / len(samples) * 1000,
+                "p95": samples[min(int(len(samples) * 0.95), len(samples) - 1)] * 1000,
+                "max": samples[-1] * 1000
+            } for stage, samples in waits.items()
+        }
+        return stats
+
+
+def _run_unless_cancelled(function, args, kwargs):
+    """Run a queued call, unless the run it belongs to was cancelled while it waited."""
+    check_cancelled()
+    return function(*args, **kwargs)
+
+def format_pool_stats(stats):
+    """
+    Format the worker pool's counters for printing.
+    
+    Args:
+        stats (dict): The counters from WorkerPool.stats().
+    
+    Returns:
+        str: The counters, with one line per stage.
+    """
+    lines = [
+        f"Worker pool: {stats['workers']}/{stats['max_workers']} threads, {stats['completed']} tasks run, "
+        f"{stats['queued']} queued now (peak {stats['peak_queued']})"
+    ]
+    for stage, wait in sorted(stats["wait_ms"].items(), key=lambda item: STAGE_PRIORITIES.get(item[0], DEFAULT_PRIORITY)):
+        lines.append(f"  {stage:<10} {wait['tasks']:>5} tasks, waited {wait['avg']:.1f} ms on average (p95 {wait['p95']:.1f} ms, max {wait['max']:.1f} ms)")
+    return "\n".join(lines)
+
+
+# The process-wide pool
+worker_pool = WorkerPool()